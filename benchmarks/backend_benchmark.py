@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""
+backend_benchmark.py
+Author: Chloe Xufeng, Owen Xu
+
+Compares the latency of the webapp's PostgreSQL and in-memory backends
+(webapp/backends.py) on the same data, and checks that they agree.
+
+The script writes a snapshot of the database's crime events (in event id
+order) for the memory backend, then runs each operation --repeat times on
+both backends and reports the median latency. The webapp's config.py is
+only read for its optional settings; the database is the one --dsn names.
+Events whose type has no row in types are left out of the snapshot, so the
+victim results differ when the database holds such events.
+
+    python3 benchmarks/backend_benchmark.py --dsn "dbname=crime"
+
+Results are printed as a table and, with --json, written to a file.
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import statistics
+
+import psycopg2
+
+REPO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, os.path.join(REPO_DIR, 'webapp'))
+sys.path.insert(0, REPO_DIR)
+
+import snapshot
+import backends
+import pool
+
+EXPORT_QUERY = '''
+    SELECT months.month, areas.area, types.type, crimes.vict_age, crimes.vict_sex
+    FROM crime_events
+    JOIN crimes ON crimes.id = crime_events.crime_id
+    JOIN types ON types.id = crime_events.type_id
+    JOIN months ON months.id = crime_events.month_id
+    JOIN areas ON areas.id = crime_events.area_id
+    ORDER BY crime_events.id
+'''
+
+def build_snapshot(dsn, path):
+    '''Writes the database's crime events to a snapshot at path, dated the 1st of their month'''
+    writer = snapshot.SnapshotWriter()
+    connection = psycopg2.connect(dsn)
+    try:
+        cursor = connection.cursor(name='snapshot_export')
+        cursor.itersize = 50000
+        cursor.execute(EXPORT_QUERY)
+        for month, area, crime_type, vict_age, vict_sex in cursor:
+            year, month_number = month.split('-')
+            writer.add([f'{month_number}/01/{year} 12:00:00 AM', area, crime_type,
+                        '' if vict_age is None else str(vict_age), vict_sex or ''])
+    finally:
+        connection.close()
+    return writer.save(path)
+
+def operations(session):
+    '''Returns the operations to time as (name, function of a session), resolving filters on session'''
+    months = session.dimension_values('months')
+    areas = session.dimension_values('areas')
+    types = session.dimension_values('types')
+    start, end = months[0], months[-1]
+    middle = months[len(months) // 3], months[2 * len(months) // 3]
+    some_areas = session.area_ids(areas[:3])
+    all_areas = session.area_ids(areas)
+    one_type = session.type_ids(types[:1])
+    all_types = session.type_ids(types)
+
+    def export_rows(s):
+        batches = s.export_batches(None, None, None, None, False, 10000)
+        return sum(len(batch) for batch in batches or [])
+
+    return [
+        ('dimension lists', lambda s: [s.dimension_values(d) for d in ('areas', 'types', 'months')]),
+        ('charts, 3 areas 1 type', lambda s: s.chart_counts(middle[0], middle[1], some_areas, one_type)),
+        ('charts, everything', lambda s: s.chart_counts(start, end, all_areas, all_types)),
+        ('count, 3 areas', lambda s: s.event_count(None, None, some_areas, None)),
+        ('count, everything', lambda s: s.event_count(None, None)),
+        ('crimes page of 100', lambda s: len(s.crimes_page(s.month_ids(None, None), some_areas, None, None, 100)[0])),
+        ('victim sex counts', lambda s: s.victim_sex_counts()),
+        ('export every row', export_rows),
+    ]
+
+def run(backend, repeat):
+    '''Times each operation on backend; returns {name: {"median_ms", "result"}}'''
+    session = backend.session()
+    try:
+        results = {}
+        for name, operation in operations(session):
+            times = []
+            for _ in range(repeat):
+                started = time.perf_counter()
+                result = operation(session)
+                times.append(1000 * (time.perf_counter() - started))
+            results[name] = {"median_ms": round(statistics.median(times), 3), "result": result}
+        return results
+    finally:
+        session.close()
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the PostgreSQL and in-memory webapp backends.')
+    parser.add_argument('--dsn', default='', help='PostgreSQL connection string (default: the PG* environment variables)')
+    parser.add_argument('--snapshot', help='snapshot directory to write and load (default: a temporary directory)')
+    parser.add_argument('--repeat', type=int, default=20, help='runs per operation; the median is reported (default 20)')
+    parser.add_argument('--json', help='also write the results to this JSON file')
+    args = parser.parse_args()
+
+    workdir = None
+    path = args.snapshot
+    if path is None:
+        workdir = tempfile.mkdtemp(prefix='backend-bench-')
+        path = os.path.join(workdir, 'crime.snapshot')
+    try:
+        started = time.perf_counter()
+        build_snapshot(args.dsn, path)
+        print(f"Snapshot written in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+        started = time.perf_counter()
+        memory = backends.MemoryBackend(path)
+        print(f"Memory backend loaded {memory.stats()['rows']} rows in {time.perf_counter() - started:.2f}s",
+              file=sys.stderr)
+        connection_pool = pool.ConnectionPool(lambda: psycopg2.connect(args.dsn), min_size=1, max_size=1)
+        postgres = backends.PostgresBackend(connection_pool)
+
+        results = {"postgres": run(postgres, args.repeat), "memory": run(memory, args.repeat)}
+        connection_pool.closeall()
+
+        print(f"{'operation':26} {'postgres ms':>12} {'memory ms':>12} {'speedup':>8}  agree")
+        for name, timed in results['postgres'].items():
+            other = results['memory'][name]
+            agree = timed['result'] == other['result']
+            print(f"{name:26} {timed['median_ms']:>12.2f} {other['median_ms']:>12.2f} "
+                  f"{timed['median_ms'] / max(other['median_ms'], 1e-3):>7.1f}x  {'yes' if agree else 'NO'}")
+        if args.json:
+            with open(args.json, 'w', encoding='utf-8') as f:
+                json.dump({backend: {name: timed['median_ms'] for name, timed in timings.items()}
+                           for backend, timings in results.items()}, f, indent=2)
+    finally:
+        if workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+if __name__ == '__main__':
+    main()
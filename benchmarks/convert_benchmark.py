@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+convert_benchmark.py
+Author: Chloe Xufeng, Owen Xu
+
+Measures the run time and peak memory of convert.py on a scaled-up input.
+
+The script replicates data/2024&2025data.csv in a scratch directory until it
+holds --rows rows, then runs convert.py there as a child process, once per
+--repeat, and reports the wall time and maximum resident set size of each run.
+With --baseline it also runs the convert.py from that git revision on the
+same input, and with --jobs it also runs convert.py --jobs N for each N; it
+checks that every run wrote identical table CSVs.
+
+    python3 benchmarks/convert_benchmark.py --rows 10000000 --baseline HEAD~1
+    python3 benchmarks/convert_benchmark.py --rows 10000000 --jobs 2 4 8
+
+Results are printed as a table and, with --json, written to a file.
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import hashlib
+import argparse
+import tempfile
+import statistics
+import subprocess
+
+REPO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+INPUT_FILE = os.path.join(REPO_DIR, 'data', '2024&2025data.csv')
+OUTPUT_FILES = ['crime_types.csv', 'crime_times.csv', 'areas.csv', 'crimes.csv', 'crime_events.csv']
+
+def replicate_input(source, target, rows):
+    '''Writes the header and data rows of source to target, repeated until there are rows data rows'''
+    with open(source, newline='', encoding='utf-8') as f:
+        header = f.readline()
+        body = f.readlines()
+    if not body:
+        sys.exit(f"{source} has no data rows")
+    if not body[-1].endswith('\n'):
+        body[-1] += '\r\n'
+    written = 0
+    with open(target, 'w', newline='', encoding='utf-8') as f:
+        f.write(header)
+        while written < rows:
+            part = body[:rows - written]
+            f.writelines(part)
+            written += len(part)
+    return written
+
+def run_convert(script, workdir, args=()):
+    '''
+    Runs script with workdir as its working directory; returns (seconds, peak
+    RSS in MiB). The RSS is the largest of the script and its worker processes.
+    '''
+    started = time.perf_counter()
+    process = subprocess.Popen([sys.executable, script, *args], cwd=workdir)
+    _, status, usage = os.wait4(process.pid, 0)
+    elapsed = time.perf_counter() - started
+    process.returncode = os.waitstatus_to_exitcode(status)
+    if process.returncode != 0:
+        sys.exit(f"{script} exited with status {process.returncode}")
+    # ru_maxrss is in KiB on Linux
+    return elapsed, usage.ru_maxrss / 1024
+
+def output_digests(workdir):
+    '''Returns the SHA-1 of each table CSV convert.py wrote in workdir'''
+    digests = {}
+    for name in OUTPUT_FILES:
+        digest = hashlib.sha1()
+        with open(os.path.join(workdir, 'data', name), 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+        digests[name] = digest.hexdigest()
+    return digests
+
+def benchmark(label, script, workdir, repeat, args=()):
+    runs = []
+    for i in range(repeat):
+        seconds, rss = run_convert(script, workdir, args)
+        print(f"{label} run {i + 1}: {seconds:.1f}s, {rss:.0f} MiB", file=sys.stderr)
+        runs.append({"seconds": round(seconds, 3), "max_rss_mib": round(rss, 1)})
+    return {
+        "script": label,
+        "runs": runs,
+        "median_seconds": round(statistics.median(run['seconds'] for run in runs), 3),
+        "max_rss_mib": max(run['max_rss_mib'] for run in runs),
+        "outputs": output_digests(workdir)
+    }
+
+def baseline_script(revision, workdir):
+    '''Writes convert.py as of the given git revision into workdir and returns its path'''
+    source = subprocess.run(['git', 'show', f'{revision}:convert.py'], cwd=REPO_DIR,
+                            check=True, capture_output=True).stdout
+    path = os.path.join(workdir, 'convert_baseline.py')
+    with open(path, 'wb') as f:
+        f.write(source)
+    return path
+
+def print_report(rows, results):
+    print(f"{'script':24} {'rows':>12} {'median s':>10} {'rows/s':>12} {'max RSS MiB':>12}")
+    for result in results:
+        print(f"{result['script']:24} {rows:>12} {result['median_seconds']:>10.1f} "
+              f"{rows / result['median_seconds']:>12.0f} {result['max_rss_mib']:>12.0f}")
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark convert.py on a replicated input file.')
+    parser.add_argument('--rows', type=int, default=10000000, help='number of input rows to convert (default 10000000)')
+    parser.add_argument('--input', default=INPUT_FILE, help='source CSV to replicate (default data/2024&2025data.csv)')
+    parser.add_argument('--baseline', help='git revision whose convert.py to run for comparison, e.g. HEAD~1')
+    parser.add_argument('--jobs', type=int, nargs='+', default=[],
+                        help='also run convert.py --jobs N for each N given')
+    parser.add_argument('--repeat', type=int, default=1, help='runs per script; the median time is reported (default 1)')
+    parser.add_argument('--workdir', help='scratch directory to use (default: a new temporary directory, removed afterwards)')
+    parser.add_argument('--json', help='also write the results to this JSON file')
+    args = parser.parse_args()
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix='convert-bench-')
+    try:
+        os.makedirs(os.path.join(workdir, 'data'), exist_ok=True)
+        started = time.perf_counter()
+        rows = replicate_input(args.input, os.path.join(workdir, 'data', '2024&2025data.csv'), args.rows)
+        print(f"Wrote {rows} input rows in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+
+        script = os.path.join(REPO_DIR, 'convert.py')
+        results = [benchmark('convert.py', script, workdir, args.repeat)]
+        for jobs in args.jobs:
+            results.append(benchmark(f'convert.py --jobs {jobs}', script, workdir, args.repeat,
+                                     ['--jobs', str(jobs)]))
+        if args.baseline:
+            script = baseline_script(args.baseline, workdir)
+            results.append(benchmark(f'convert.py@{args.baseline}', script, workdir, args.repeat))
+
+        print_report(rows, results)
+        if len(results) > 1:
+            same = all(result['outputs'] == results[0]['outputs'] for result in results)
+            print("Outputs identical" if same else "Outputs DIFFER between runs")
+        if args.json:
+            with open(args.json, 'w', encoding='utf-8') as f:
+                json.dump({"rows": rows, "results": results}, f, indent=2)
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+"""
+index_benchmark.py
+Author: Chloe Xufeng, Owen Xu
+
+Measures how data/crime-events-keys.sql changes the query plans and latency
+of the API's filtered queries.
+
+The script copies the crime tables into a scratch schema ("bench" by default),
+replicates crime_events until it holds --rows events, and runs each filter
+shape with EXPLAIN ANALYZE before and after applying the migration to the
+copy. The public tables are only read.
+
+    python3 benchmarks/index_benchmark.py --dsn "dbname=crime" --rows 20000000
+
+Results are printed as a table and, with --json, written to a file.
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+
+import psycopg2
+
+MIGRATION_FILE = os.path.join(os.path.dirname(__file__), '..', 'data', 'crime-events-keys.sql')
+
+# Filter shapes the API issues, from narrow to wide. Each takes the number of
+# months, areas and types to select; the first n values of each dimension are used.
+SHAPES = [
+    ('1 month, 1 area, 1 type', 1, 1, 1),
+    ('3 months, 3 areas, 2 types', 3, 3, 2),
+    ('all months, 5 areas, all types', None, 5, None),
+    ('all months, all areas, 1 type', None, None, 1),
+]
+
+# The query as /filteredcsv runs it: names matched with LOWER() on the dimensions.
+NAME_FILTER_QUERY = '''
+    SELECT months.month, areas.area, types.type, crimes.vict_age, crimes.vict_sex
+    FROM crimes
+    JOIN crime_events ON crimes.id = crime_events.crime_id
+    JOIN types ON types.id = crime_events.type_id
+    JOIN months ON months.id = crime_events.month_id
+    JOIN areas ON areas.id = crime_events.area_id
+    WHERE months.month >= %s AND months.month <= %s
+      AND LOWER(areas.area) = ANY(%s::text[])
+      AND LOWER(types.type) = ANY(%s::text[])
+'''
+
+# The same filter with dimension values resolved to ids first.
+ID_FILTER_QUERY = '''
+    SELECT months.month, areas.area, types.type, crimes.vict_age, crimes.vict_sex
+    FROM crime_events
+    JOIN crimes ON crimes.id = crime_events.crime_id
+    JOIN types ON types.id = crime_events.type_id
+    JOIN months ON months.id = crime_events.month_id
+    JOIN areas ON areas.id = crime_events.area_id
+    WHERE crime_events.month_id = ANY(%s)
+      AND crime_events.area_id = ANY(%s)
+      AND crime_events.type_id = ANY(%s)
+'''
+
+def build_scratch_schema(connection, schema, rows):
+    '''Copies the crime tables into schema, replicating crime_events up to rows events'''
+    cursor = connection.cursor()
+    cursor.execute(f'DROP SCHEMA IF EXISTS {schema} CASCADE')
+    cursor.execute(f'CREATE SCHEMA {schema}')
+    for table in ('crimes', 'types', 'months', 'areas'):
+        cursor.execute(f'CREATE TABLE {schema}.{table} AS SELECT * FROM public.{table}')
+    cursor.execute(f'ALTER TABLE {schema}.crimes ADD PRIMARY KEY (id)')
+    cursor.execute(f'ALTER TABLE {schema}.months ADD PRIMARY KEY (id)')
+    cursor.execute(f'ALTER TABLE {schema}.areas ADD PRIMARY KEY (id)')
+
+    cursor.execute('SELECT COUNT(*) FROM public.crime_events')
+    base_rows = cursor.fetchone()[0]
+    if base_rows == 0:
+        raise SystemExit('public.crime_events is empty; load data/database.sql first')
+    copies = -(-rows // base_rows)
+    print(f"Replicating {base_rows} events x {copies} into {schema}.crime_events ...", file=sys.stderr)
+    started = time.perf_counter()
+    cursor.execute(f'''
+        CREATE TABLE {schema}.crime_events AS
+        SELECT crime_id, type_id, month_id, area_id
+        FROM public.crime_events, generate_series(1, %s)
+        LIMIT %s
+    ''', (copies, rows))
+    cursor.execute(f'ANALYZE {schema}.crime_events')
+    connection.commit()
+    print(f"  done in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+
+def shape_params(cursor, months_n, areas_n, types_n):
+    '''Returns (name parameters, id parameters) selecting the first n values of each dimension'''
+    def first(table, column, n):
+        cursor.execute(f'SELECT id, {column} FROM {table} ORDER BY {column}')
+        values = cursor.fetchall()
+        return values if n is None else values[:n]
+
+    months = first('months', 'month', months_n)
+    areas = first('areas', 'area', areas_n)
+    types = first('types', 'type', types_n)
+    names = [months[0][1], months[-1][1],
+             [area.lower() for _, area in areas],
+             [type_.lower() for _, type_ in types]]
+    ids = [[id for id, _ in months], [id for id, _ in areas], [id for id, _ in types]]
+    return names, ids
+
+def measure(cursor, query, params, repeat):
+    '''Runs EXPLAIN ANALYZE repeat times; returns the median time and the plan's node types'''
+    timings = []
+    plan = None
+    for _ in range(repeat):
+        cursor.execute('EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) ' + query, params)
+        result = cursor.fetchone()[0][0]
+        timings.append(result['Planning Time'] + result['Execution Time'])
+        plan = result['Plan']
+    nodes = []
+    def walk(node):
+        label = node['Node Type']
+        if 'Relation Name' in node:
+            label += f" on {node['Relation Name']}"
+        if 'Index Name' in node:
+            label += f" using {node['Index Name']}"
+        nodes.append(label)
+        for child in node.get('Plans', []):
+            walk(child)
+    walk(plan)
+    return {
+        "median_ms": round(statistics.median(timings), 3),
+        "rows": plan['Actual Rows'],
+        "plan": nodes
+    }
+
+def run_shapes(connection, schema, repeat):
+    cursor = connection.cursor()
+    cursor.execute(f'SET search_path = {schema}')
+    results = []
+    for label, months_n, areas_n, types_n in SHAPES:
+        names, ids = shape_params(cursor, months_n, areas_n, types_n)
+        results.append({
+            "shape": label,
+            "name_filter": measure(cursor, NAME_FILTER_QUERY, names, repeat),
+            "id_filter": measure(cursor, ID_FILTER_QUERY, ids, repeat)
+        })
+    connection.rollback()
+    return results
+
+def apply_migration(connection, schema):
+    '''Runs the migration file against the scratch schema'''
+    with open(MIGRATION_FILE, encoding='utf-8') as f:
+        migration = f.read()
+    # The file manages its own transaction; run it with autocommit on.
+    connection.autocommit = True
+    cursor = connection.cursor()
+    cursor.execute(f'SET search_path = {schema}')
+    started = time.perf_counter()
+    cursor.execute(migration)
+    cursor.execute('SET search_path = public')
+    connection.autocommit = False
+    print(f"Migration applied in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+
+def print_report(before, after):
+    print(f"{'shape':34} {'filter':6} {'before ms':>11} {'after ms':>11} {'rows':>10}")
+    for old, new in zip(before, after):
+        for kind in ('name_filter', 'id_filter'):
+            print(f"{old['shape']:34} {kind[:-7]:6} {old[kind]['median_ms']:>11.1f} "
+                  f"{new[kind]['median_ms']:>11.1f} {new[kind]['rows']:>10}")
+            print(f"{'':34}   before: {' > '.join(old[kind]['plan'][:4])}")
+            print(f"{'':34}   after:  {' > '.join(new[kind]['plan'][:4])}")
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark data/crime-events-keys.sql on scaled-up data.')
+    parser.add_argument('--dsn', default='', help='PostgreSQL connection string (default: the PG* environment variables)')
+    parser.add_argument('--rows', type=int, default=10000000, help='number of crime_events rows to benchmark with (default 10000000)')
+    parser.add_argument('--schema', default='bench', help='scratch schema to create (default bench; dropped and recreated)')
+    parser.add_argument('--repeat', type=int, default=5, help='runs per query; the median is reported (default 5)')
+    parser.add_argument('--keep', action='store_true', help='keep the scratch schema afterwards')
+    parser.add_argument('--json', help='also write the results to this JSON file')
+    args = parser.parse_args()
+
+    connection = psycopg2.connect(args.dsn)
+    try:
+        build_scratch_schema(connection, args.schema, args.rows)
+        before = run_shapes(connection, args.schema, args.repeat)
+        apply_migration(connection, args.schema)
+        after = run_shapes(connection, args.schema, args.repeat)
+        print_report(before, after)
+        if args.json:
+            with open(args.json, 'w', encoding='utf-8') as f:
+                json.dump({"rows": args.rows, "before": before, "after": after}, f, indent=2)
+        if not args.keep:
+            connection.cursor().execute(f'DROP SCHEMA {args.schema} CASCADE')
+            connection.commit()
+    finally:
+        connection.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,348 @@
+#!/usr/bin/env python3
+"""
+load_test.py
+Author: Chloe Xufeng, Owen Xu
+
+Drives a mix of webapp API requests at one or more concurrency levels and
+reports latency percentiles, throughput and the server's peak memory, so
+runs can be compared for regressions.
+
+Each level runs --duration seconds after --warmup seconds whose requests
+are not counted. Every client thread keeps one HTTP connection and picks
+its requests from the mix at random, with filter values taken from the
+server's own /api/areas, /api/types and /api/dates. The mixes are:
+
+- browse: what the page does; dimension lists, charts of narrow, medium and
+  wide filters, crimes pages and filtered CSV downloads
+- charts: /charts/filtered only, split between the three selectivities
+- exports: /filteredcsv of medium filters, and an occasional /rawcsv
+
+With --server the script starts the server itself (from webapp/) and
+samples the memory of its process tree; otherwise pass --pid to sample an
+already running one. Against synthetic data (see synthetic_data.py):
+
+    python3 benchmarks/synthetic_data.py --events 10M
+    python3 benchmarks/load_test.py --schema loadtest --concurrency 1 8 32 \\
+        --server "uvicorn asgi:app --port 5000 --workers 4" --json run.json
+
+and to compare a later run with it, failing when a p95 grew by over 20%:
+
+    python3 benchmarks/load_test.py ... --json new.json --baseline run.json
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import shlex
+import signal
+import argparse
+import threading
+import subprocess
+import http.client
+from urllib.parse import urlsplit, urlencode
+
+WEBAPP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'webapp')
+
+# -- Requests: each returns a path for a random choice of filter values --
+
+def pick(rng, values, n):
+    return rng.sample(values, min(n, len(values)))
+
+def month_window(rng, months, length):
+    '''A random run of length consecutive months (all of them when None)'''
+    if length is None or length >= len(months):
+        return months[0], months[-1]
+    first = rng.randrange(len(months) - length + 1)
+    return months[first], months[first + length - 1]
+
+def chart_filter(rng, dims, areas, types, months):
+    start, end = month_window(rng, dims['months'], months)
+    return urlencode({
+        'areas': ','.join(dims['areas'] if areas is None else pick(rng, dims['areas'], areas)),
+        'types': ','.join(dims['types'] if types is None else pick(rng, dims['types'], types)),
+        'start_month': start,
+        'end_month': end,
+    })
+
+def dimension_list(rng, dims):
+    return rng.choice(['/api/areas', '/api/types', '/api/dates'])
+
+def filtered_chart(areas, types, months):
+    return lambda rng, dims: '/api/charts/filtered?' + chart_filter(rng, dims, areas, types, months)
+
+def crimes_over_time(rng, dims):
+    return '/api/charts/crimesOverTime?' + chart_filter(rng, dims, 3, 2, 12)
+
+def crimes_page(rng, dims):
+    start, end = month_window(rng, dims['months'], 6)
+    return '/api/crimes?' + urlencode({'areas': ','.join(pick(rng, dims['areas'], 2)),
+                                       'start_month': start, 'end_month': end,
+                                       'limit': 100, 'count': 'true'})
+
+def filtered_csv(areas, types, months):
+    return lambda rng, dims: '/api/filteredcsv?' + chart_filter(rng, dims, areas, types, months)
+
+def raw_csv(rng, dims):
+    return '/api/rawcsv'
+
+# (name, weight, request) for each mix; names label the per-route results
+MIXES = {
+    'browse': [
+        ('dimension lists', 30, dimension_list),
+        ('charts narrow', 15, filtered_chart(1, 1, 3)),
+        ('charts medium', 15, filtered_chart(5, 3, 12)),
+        ('charts wide', 5, filtered_chart(None, None, None)),
+        ('crimes over time', 15, crimes_over_time),
+        ('crimes page', 15, crimes_page),
+        ('filtered csv', 5, filtered_csv(2, 2, 3)),
+    ],
+    'charts': [
+        ('charts narrow', 1, filtered_chart(1, 1, 3)),
+        ('charts medium', 1, filtered_chart(5, 3, 12)),
+        ('charts wide', 1, filtered_chart(None, None, None)),
+    ],
+    'exports': [
+        ('filtered csv', 19, filtered_csv(5, 3, 12)),
+        ('raw csv', 1, raw_csv),
+    ],
+}
+
+# -- Server memory --
+
+def process_tree(pid):
+    '''pid and all its descendants, from /proc'''
+    pids = [pid]
+    for parent in pids:
+        try:
+            for task in os.listdir(f'/proc/{parent}/task'):
+                with open(f'/proc/{parent}/task/{task}/children') as f:
+                    pids.extend(int(child) for child in f.read().split())
+        except OSError:
+            pass
+    return pids
+
+def rss_bytes(pid):
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return 0
+
+class MemorySampler(threading.Thread):
+    '''Samples the summed RSS of a process tree every interval seconds, keeping the peak'''
+
+    def __init__(self, pid, interval=0.1):
+        super().__init__(daemon=True)
+        self.pid = pid
+        self.interval = interval
+        self.peak = 0
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.is_set():
+            self.peak = max(self.peak, sum(rss_bytes(pid) for pid in process_tree(self.pid)))
+            self.stopped.wait(self.interval)
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+        return self.peak
+
+# -- Load --
+
+def fetch(connection, path):
+    '''Sends a GET and reads the whole body; returns (status, body bytes)'''
+    connection.request('GET', path, headers={'Accept-Encoding': 'gzip'})
+    response = connection.getresponse()
+    size = 0
+    while True:
+        chunk = response.read(65536)
+        if not chunk:
+            break
+        size += len(chunk)
+    return response.status, size
+
+def dimensions(url):
+    '''The areas, types and months the server lists'''
+    parts = urlsplit(url)
+    connection = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=60)
+    dims = {}
+    for name, path in (('areas', '/api/areas'), ('types', '/api/types'), ('months', '/api/dates')):
+        connection.request('GET', path)
+        response = connection.getresponse()
+        body = response.read()
+        if response.status != 200:
+            raise RuntimeError(f"{path} answered {response.status}")
+        dims[name] = json.loads(body)
+    connection.close()
+    return dims
+
+def client(url, mix, dims, seed, warmup_until, stop_at, samples, timeout):
+    '''One client thread: sends requests until stop_at, recording those after warmup_until'''
+    parts = urlsplit(url)
+    rng = random.Random(seed)
+    names = [name for name, _, _ in mix]
+    weights = [weight for _, weight, _ in mix]
+    requests = {name: request for name, _, request in mix}
+    connection = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=timeout)
+    while True:
+        name = rng.choices(names, weights)[0]
+        path = requests[name](rng, dims)
+        started = time.perf_counter()
+        if started >= stop_at:
+            break
+        try:
+            status, size = fetch(connection, path)
+        except (OSError, http.client.HTTPException):
+            status, size = None, 0
+            connection.close()
+            connection = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=timeout)
+        if started >= warmup_until:
+            samples.append((name, time.perf_counter() - started, status, size))
+    connection.close()
+
+def percentiles(latencies):
+    '''p50, p95, p99 and max of a list of seconds, in milliseconds (nearest rank)'''
+    ordered = sorted(latencies)
+    if not ordered:
+        return {}
+
+    def rank(p):
+        return ordered[min(len(ordered) - 1, max(0, int(round(p / 100 * len(ordered))) - 1))]
+    return {"p50": round(1000 * rank(50), 2), "p95": round(1000 * rank(95), 2),
+            "p99": round(1000 * rank(99), 2), "max": round(1000 * ordered[-1], 2)}
+
+def run_level(url, mix, dims, concurrency, warmup, duration, pid, timeout):
+    '''Runs one concurrency level; returns its results'''
+    samples = []
+    sampler = MemorySampler(pid) if pid else None
+    warmup_until = time.perf_counter() + warmup
+    stop_at = warmup_until + duration
+    threads = [threading.Thread(target=client, args=(url, mix, dims, i, warmup_until, stop_at, samples, timeout))
+               for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    if sampler:
+        time.sleep(warmup)
+        sampler.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - warmup_until
+
+    errors = sum(1 for _, _, status, _ in samples if status is None or status >= 500)
+    routes = {}
+    for name, _, _ in mix:
+        timed = [latency for route, latency, _, _ in samples if route == name]
+        if timed:
+            routes[name] = {"requests": len(timed), **percentiles(timed)}
+    result = {
+        "concurrency": concurrency,
+        "requests": len(samples),
+        "errors": errors,
+        "throughput_rps": round(len(samples) / elapsed, 2),
+        "bytes": sum(size for _, _, _, size in samples),
+        "latency_ms": percentiles([latency for _, latency, _, _ in samples]),
+        "routes": routes,
+    }
+    if sampler:
+        result["server_peak_rss_mb"] = round(sampler.stop() / 2 ** 20, 1)
+    return result
+
+def start_server(command, url, schema):
+    '''Starts command in webapp/ (with search_path set to schema) and waits until it answers'''
+    environment = dict(os.environ)
+    if schema:
+        environment['PGOPTIONS'] = f"{environment.get('PGOPTIONS', '')} -c search_path={schema}".strip()
+    server = subprocess.Popen(shlex.split(command), cwd=WEBAPP_DIR, env=environment, start_new_session=True)
+    parts = urlsplit(url)
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"server exited with status {server.returncode}")
+        try:
+            connection = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=5)
+            connection.request('GET', '/api/areas')
+            connection.getresponse().read()
+            connection.close()
+            return server
+        except OSError:
+            time.sleep(0.5)
+    stop_server(server)
+    raise RuntimeError("server did not answer within 60s")
+
+def stop_server(server):
+    os.killpg(server.pid, signal.SIGTERM)
+    try:
+        server.wait(10)
+    except subprocess.TimeoutExpired:
+        os.killpg(server.pid, signal.SIGKILL)
+
+def compare(results, baseline, tolerance):
+    '''Prints p95 and throughput against a baseline run; returns whether any p95 regressed'''
+    before = {level['concurrency']: level for level in baseline['levels']}
+    regressed = False
+    print(f"\n{'vs baseline':>12} {'p95 ms':>18} {'req/s':>18}")
+    for level in results['levels']:
+        old = before.get(level['concurrency'])
+        if old is None or not level['latency_ms'] or not old['latency_ms']:
+            continue
+        p95, old_p95 = level['latency_ms']['p95'], old['latency_ms']['p95']
+        worse = p95 > old_p95 * (1 + tolerance)
+        regressed = regressed or worse
+        print(f"{'c=' + str(level['concurrency']):>12} {old_p95:>8.1f} -> {p95:<8.1f}"
+              f"{old['throughput_rps']:>9.1f} -> {level['throughput_rps']:<8.1f}{'  REGRESSION' if worse else ''}")
+    return regressed
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test the webapp API.')
+    parser.add_argument('--url', default='http://localhost:5000', help='server to test (default http://localhost:5000)')
+    parser.add_argument('--mix', choices=sorted(MIXES), default='browse', help='request mix (default browse)')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 8, 32],
+                        help='client threads, one run per value (default 1 8 32)')
+    parser.add_argument('--duration', type=float, default=30, help='seconds measured per level (default 30)')
+    parser.add_argument('--warmup', type=float, default=5, help='seconds run before measuring each level (default 5)')
+    parser.add_argument('--timeout', type=float, default=120, help='seconds before a request fails (default 120)')
+    parser.add_argument('--server', help='command starting the server in webapp/, e.g. "python3 app.py localhost 5000"')
+    parser.add_argument('--schema', help='with --server, the schema (from synthetic_data.py) its connections use')
+    parser.add_argument('--pid', type=int, help='process id of a running server whose memory to sample')
+    parser.add_argument('--json', help='also write the results to this JSON file')
+    parser.add_argument('--baseline', help='results JSON of an earlier run to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='p95 growth over the baseline counted as a regression (default 0.2)')
+    args = parser.parse_args()
+
+    server = start_server(args.server, args.url, args.schema) if args.server else None
+    try:
+        dims = dimensions(args.url)
+        results = {"url": args.url, "mix": args.mix, "schema": args.schema, "duration": args.duration,
+                   "started_at": time.strftime('%Y-%m-%dT%H:%M:%S'), "levels": []}
+        print(f"{'concurrency':>11} {'requests':>9} {'errors':>7} {'req/s':>9} "
+              f"{'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'peak RSS MB':>12}")
+        for concurrency in args.concurrency:
+            level = run_level(args.url, MIXES[args.mix], dims, concurrency, args.warmup, args.duration,
+                              server.pid if server else args.pid, args.timeout)
+            results["levels"].append(level)
+            latency = level['latency_ms'] or {"p50": 0, "p95": 0, "p99": 0}
+            print(f"{concurrency:>11} {level['requests']:>9} {level['errors']:>7} {level['throughput_rps']:>9.1f} "
+                  f"{latency['p50']:>9.1f} {latency['p95']:>9.1f} {latency['p99']:>9.1f} "
+                  f"{level.get('server_peak_rss_mb', ''):>12}")
+    finally:
+        if server:
+            stop_server(server)
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.tolerance):
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
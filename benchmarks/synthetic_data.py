@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+"""
+synthetic_data.py
+Author: Chloe Xufeng, Owen Xu
+
+Generates a synthetic crime database of any size for load testing the
+webapp (see load_test.py). The tables are created in a scratch schema
+("loadtest" by default) from data/database-schema.sql and data/rollup.sql,
+so they have the same columns, keys and indexes as the real ones, and are
+filled by the server with generate_series:
+
+- areas: the 21 LAPD area names, some much busier than others
+- types: the 8 crime categories, theft the most common
+- months: --months of them from --first-month, events spread evenly over
+  them in load order, as convert.py loads them
+- crimes: one victim per event; a quarter have no age, the sex is mostly M or F
+
+    python3 benchmarks/synthetic_data.py --dsn "dbname=crime" --events 10M
+
+The secondary indexes and foreign keys of crime_events are created after
+the rows are loaded, then data/rollup.sql builds the rollup and the tables are analyzed. The
+webapp reads the schema when its connections set search_path to it:
+
+    PGOPTIONS="-c search_path=loadtest" python3 app.py localhost 5000
+"""
+
+import os
+import sys
+import time
+import argparse
+
+import psycopg2
+from psycopg2 import sql
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data')
+SCHEMA_FILE = os.path.join(DATA_DIR, 'database-schema.sql')
+ROLLUP_FILE = os.path.join(DATA_DIR, 'rollup.sql')
+
+AREAS = ['77th Street', 'Southwest', 'Central', 'Pacific', 'N Hollywood', 'Southeast', 'Hollywood',
+         'Olympic', 'Newton', 'Wilshire', 'Rampart', 'West LA', 'Van Nuys', 'Northeast', 'Mission',
+         'Topanga', 'West Valley', 'Devonshire', 'Harbor', 'Hollenbeck', 'Foothill']
+TYPES = ['theft', 'assault', 'vandalism', 'robbery', 'other crime', 'criminal threats', 'sex crime', 'child crime']
+
+# Events are inserted in chunks of this many rows, each in its own transaction.
+CHUNK_ROWS = 1000000
+
+# Earlier areas and types are picked more often: the position is
+# floor(random() ^ skew * count), so skew 1 is uniform.
+AREA_SKEW = 1.5
+TYPE_SKEW = 2.5
+
+EVENTS_INSERT = '''
+    INSERT INTO crime_events (crime_id, type_id, month_id, area_id, id)
+    SELECT i,
+           1 + floor(power(random(), %(type_skew)s) * %(types)s)::int,
+           1 + ((i - 1) * %(months)s / %(events)s)::int,
+           1 + floor(power(random(), %(area_skew)s) * %(areas)s)::int,
+           i
+    FROM generate_series(%(first)s::bigint, %(last)s::bigint) AS i
+'''
+
+CRIMES_INSERT = '''
+    INSERT INTO crimes (id, vict_age, vict_sex)
+    SELECT i,
+           CASE WHEN random() < 0.25 THEN 0 ELSE 16 + floor(power(random(), 1.4) * 70)::int END,
+           (ARRAY['M', 'M', 'M', 'M', 'M', 'F', 'F', 'F', 'F', 'X', ''])[1 + floor(random() * 11)::int]
+    FROM generate_series(%(first)s::int, %(last)s::int) AS i
+'''
+
+def parse_count(text):
+    '''Returns a row count written as 50000, 500K, 10M or 1.5M'''
+    multiplier = {'K': 1000, 'M': 1000000}.get(text[-1:].upper(), 1)
+    try:
+        value = int(float(text[:-1] if multiplier > 1 else text) * multiplier)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid row count '{text}'")
+    if value < 1:
+        raise argparse.ArgumentTypeError("the row count must be positive")
+    return value
+
+def deferred_definitions(cursor):
+    '''
+    Drops the secondary indexes and foreign keys of crime_events, returning
+    the statements that recreate them.
+    '''
+    cursor.execute('''
+        SELECT indexname, indexdef FROM pg_indexes
+        WHERE schemaname = current_schema() AND tablename = 'crime_events'
+          AND indexname <> 'crime_events_pkey'
+    ''')
+    indexes = cursor.fetchall()
+    cursor.execute('''
+        SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint
+        WHERE conrelid = 'crime_events'::regclass AND contype = 'f'
+    ''')
+    keys = cursor.fetchall()
+
+    statements = []
+    for name, definition in indexes:
+        cursor.execute(sql.SQL('DROP INDEX {}').format(sql.Identifier(name)))
+        statements.append(definition)
+    for name, definition in keys:
+        cursor.execute(sql.SQL('ALTER TABLE crime_events DROP CONSTRAINT {}').format(sql.Identifier(name)))
+        statements.append(sql.SQL('ALTER TABLE crime_events ADD CONSTRAINT {} ').format(sql.Identifier(name))
+                          + sql.SQL(definition))
+    return statements
+
+def generate(connection, schema, events, months, first_month):
+    cursor = connection.cursor()
+    cursor.execute(sql.SQL('DROP SCHEMA IF EXISTS {0} CASCADE; CREATE SCHEMA {0}').format(sql.Identifier(schema)))
+    cursor.execute(sql.SQL('SET search_path TO {}').format(sql.Identifier(schema)))
+    with open(SCHEMA_FILE, encoding='utf-8') as f:
+        cursor.execute(f.read())
+    recreate = deferred_definitions(cursor)
+
+    cursor.execute('INSERT INTO areas (area) SELECT unnest(%s::text[])', (AREAS,))
+    cursor.execute('INSERT INTO types (id, type) SELECT n, type FROM unnest(%s::text[]) WITH ORDINALITY AS t(type, n)',
+                   (TYPES,))
+    cursor.execute('''
+        INSERT INTO months (month)
+        SELECT to_char(%s::date + make_interval(months => n), 'YYYY-MM') FROM generate_series(0, %s - 1) AS n
+    ''', (f'{first_month}-01', months))
+    connection.commit()
+
+    started = time.perf_counter()
+    for first in range(1, events + 1, CHUNK_ROWS):
+        last = min(first + CHUNK_ROWS - 1, events)
+        params = {"first": first, "last": last, "events": events, "months": months,
+                  "areas": len(AREAS), "types": len(TYPES), "area_skew": AREA_SKEW, "type_skew": TYPE_SKEW}
+        cursor.execute(CRIMES_INSERT, params)
+        cursor.execute(EVENTS_INSERT, params)
+        connection.commit()
+        print(f"{last} of {events} events ({time.perf_counter() - started:.0f}s)", file=sys.stderr)
+
+    cursor.execute("SELECT setval(pg_get_serial_sequence('crimes', 'id'), %s)", (events,))
+    cursor.execute("SELECT setval(pg_get_serial_sequence('crime_events', 'id'), %s)", (events,))
+    for statement in recreate:
+        cursor.execute(statement)
+    connection.commit()
+    print(f"Indexes and keys created ({time.perf_counter() - started:.0f}s)", file=sys.stderr)
+
+    with open(ROLLUP_FILE, encoding='utf-8') as f:
+        cursor.execute(f.read())
+    connection.commit()
+    connection.autocommit = True
+    cursor.execute('ANALYZE')
+    print(f"Rollup built and tables analyzed ({time.perf_counter() - started:.0f}s)", file=sys.stderr)
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate a synthetic crime database for load testing.')
+    parser.add_argument('--dsn', default='', help='PostgreSQL connection string (default: the PG* environment variables)')
+    parser.add_argument('--events', type=parse_count, default=1000000,
+                        help='number of crime events, e.g. 1M, 10M or 50M (default 1M)')
+    parser.add_argument('--schema', default='loadtest', help='schema to create the tables in (default loadtest; dropped and recreated)')
+    parser.add_argument('--months', type=int, default=60, help='number of months (default 60)')
+    parser.add_argument('--first-month', default='2020-01', help='first month of the data, yyyy-mm (default 2020-01)')
+    args = parser.parse_args()
+
+    connection = psycopg2.connect(args.dsn)
+    try:
+        generate(connection, args.schema, args.events, args.months, args.first_month)
+    finally:
+        connection.close()
+    print(f"Schema {args.schema}: {args.events} events over {args.months} months, "
+          f"{len(AREAS)} areas and {len(TYPES)} types")
+
+if __name__ == '__main__':
+    main()
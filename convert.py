@@ -7,188 +7,799 @@ Reads crimeData2025.csv and writes:
 - crime_times.csv
 - areas.csv
 - crimes.csv
+- crime_events.csv
+
+The input is streamed: rows are read, converted and written in chunks of
+CHUNK_ROWS, so memory use depends on the number of distinct types, months,
+areas and victims, not on the number of rows.
+
+With --jobs N the conversion runs in N processes. The input is split into
+byte ranges that start at row boundaries, and each range is converted with
+its own local ids into a binary part file. Merging the ranges' dimension
+values in file order numbers them exactly as a serial run would; a second
+pass maps each part's local ids to those and appends it to crime_events.csv.
+
+With --load it instead streams the converted rows straight into PostgreSQL
+with COPY, in a single transaction: the tables are built in a staging schema,
+indexed, and then swapped in for the public ones, after which crime_rollup
+is rebuilt and running webapps are told to drop their caches. Readers see
+either the old data or the new, never a partial load.
+
+With --append it adds only the input rows that occurred after the last date
+already loaded (the watermark in ingest_watermark), keeping the existing
+dimension ids and inserting only new types, months, areas and victims. The
+rollup is refreshed for the months it touched.
+
+With --snapshot DIR it also writes a columnar snapshot of the input (see
+snapshot.py) to DIR, for tools that should not have to parse the CSV.
+
+With --refresh-rollup it instead refreshes the crime_rollup table (see
+data/rollup.sql) for the months in the input, once those months have been
+loaded into the database.
 """
 
+import io
+import os
 import csv
+import time
+import shutil
+import argparse
+import itertools
+import multiprocessing
+from array import array
 from datetime import datetime
 
 # Input and output paths
 INPUT_FILE = 'data/2024&2025data.csv'
+OUTPUT_DIR = 'data'
 
-def main():
-    crime_types = {}
-    crime_times = {}
-    areas = {}
-    crimes = {}
-    crime_type_id = 0
-    time_id = 0
-    area_id = 0
-    crime_id = 0
-    crimes_crime_types_crimes_times_areas = []
-
-    with open(INPUT_FILE, newline='', encoding='utf-8') as f:
+# Rows converted between writes of crime_events.csv
+CHUNK_ROWS = 65536
+
+# --load builds the new tables in STAGING_SCHEMA and moves the tables they
+# replace to RETIRED_SCHEMA before dropping them
+STAGING_SCHEMA = 'crime_staging'
+RETIRED_SCHEMA = 'crime_retired'
+LOAD_TABLES = ['crime_events', 'crimes', 'types', 'months', 'areas']
+
+# Tables as in data/database.sql; keys and indexes are added after the COPY
+STAGING_TABLES = '''
+    CREATE TABLE {schema}.crimes (id serial, vict_age integer, vict_sex text);
+    CREATE TABLE {schema}.types (id integer, type text);
+    CREATE TABLE {schema}.months (id serial, month text);
+    CREATE TABLE {schema}.areas (id serial, area text);
+    CREATE TABLE {schema}.crime_events (
+        crime_id integer NOT NULL,
+        type_id integer NOT NULL,
+        month_id integer NOT NULL,
+        area_id integer NOT NULL,
+        id bigserial
+    );
+'''
+
+# Keys and indexes from data/crime-events-keys.sql and data/crime-events-keyset.sql
+STAGING_KEYS = '''
+    ALTER TABLE {schema}.crimes ADD CONSTRAINT crimes_pkey PRIMARY KEY (id);
+    ALTER TABLE {schema}.types ADD CONSTRAINT types_pkey PRIMARY KEY (id);
+    ALTER TABLE {schema}.months ADD CONSTRAINT months_pkey PRIMARY KEY (id);
+    ALTER TABLE {schema}.areas ADD CONSTRAINT areas_pkey PRIMARY KEY (id);
+    ALTER TABLE {schema}.types ADD CONSTRAINT types_type_key UNIQUE (type);
+    ALTER TABLE {schema}.months ADD CONSTRAINT months_month_key UNIQUE (month);
+    ALTER TABLE {schema}.areas ADD CONSTRAINT areas_area_key UNIQUE (area);
+    ALTER TABLE {schema}.crime_events
+        ADD CONSTRAINT crime_events_pkey PRIMARY KEY (id),
+        ADD CONSTRAINT crime_events_crime_id_fkey FOREIGN KEY (crime_id) REFERENCES {schema}.crimes (id),
+        ADD CONSTRAINT crime_events_type_id_fkey FOREIGN KEY (type_id) REFERENCES {schema}.types (id),
+        ADD CONSTRAINT crime_events_month_id_fkey FOREIGN KEY (month_id) REFERENCES {schema}.months (id),
+        ADD CONSTRAINT crime_events_area_id_fkey FOREIGN KEY (area_id) REFERENCES {schema}.areas (id);
+    CREATE INDEX crime_events_month_area_type_idx
+        ON {schema}.crime_events (month_id, area_id, type_id) INCLUDE (crime_id);
+    CREATE INDEX crime_events_area_type_idx
+        ON {schema}.crime_events (area_id, type_id) INCLUDE (month_id, crime_id);
+    CREATE INDEX crime_events_month_id_idx
+        ON {schema}.crime_events (month_id, id);
+'''
+
+# The latest DATE OCC loaded so far; --append skips rows up to and including it
+WATERMARK_TABLE = '''
+    CREATE TABLE IF NOT EXISTS ingest_watermark (
+        id boolean PRIMARY KEY DEFAULT true CHECK (id),
+        last_date_occ date NOT NULL,
+        updated_at timestamptz NOT NULL DEFAULT now()
+    )
+'''
+
+# --jobs splits the input into this many byte ranges per process, so a slow
+# range does not leave the other processes idle
+RANGES_PER_JOB = 4
+
+# Channel the webapp LISTENs on to invalidate its caches (see webapp/cache.py)
+RELOAD_CHANNEL = 'crime_data_reloaded'
+
+CRIME_CATEGORIES = {
+    "theft": [
+        "VEHICLE - STOLEN",
+        "VEHICLE, STOLEN - OTHER (MOTORIZED SCOOTERS, BIKES, ETC)",
+        "THEFT FROM MOTOR VEHICLE - PETTY ($950 & UNDER)",
+        "VEHICLE - ATTEMPT STOLEN",
+        "THEFT-GRAND ($950.01 & OVER)EXCPT,GUNS,FOWL,LIVESTK,PROD",
+        "THEFT OF IDENTITY",
+        "THEFT PLAIN - PETTY ($950 & UNDER)",
+        "THEFT FROM MOTOR VEHICLE - GRAND ($950.01 AND OVER)",
+        "THEFT FROM PERSON - ATTEMPT",
+        "SHOPLIFTING - PETTY THEFT ($950 & UNDER)",
+        "SHOPLIFTING-GRAND THEFT ($950.01 & OVER)",
+        "BIKE - STOLEN",
+        "DEFRAUDING INNKEEPER/THEFT OF SERVICES, $950 & UNDER",
+        "THEFT, PERSON",
+        "DEFRAUDING INNKEEPER/THEFT OF SERVICES, OVER $950.01",
+        "EMBEZZLEMENT, PETTY THEFT ($950 & UNDER)",
+        "EMBEZZLEMENT, GRAND THEFT ($950.01 & OVER)"
+    ],
+    "vandalism": [
+        "VANDALISM - MISDEAMEANOR ($399 OR UNDER)",
+        "VANDALISM - FELONY ($400 & OVER, ALL CHURCH VANDALISMS)",
+        "ARSON"
+    ],
+    "robbery": [
+        "BURGLARY",
+        "BURGLARY FROM VEHICLE",
+        "SHOPLIFTING - ATTEMPT",
+        "BURGLARY FROM VEHICLE, ATTEMPTED",
+        "BURGLARY, ATTEMPTED",
+        "ATTEMPTED ROBBERY",
+        "ROBBERY"
+    ],
+    "assault": [
+        "BATTERY - SIMPLE ASSAULT",
+        "ASSAULT WITH DEADLY WEAPON, AGGRAVATED ASSAULT",
+        "SEX,UNLAWFUL(INC MUTUAL CONSENT, PENETRATION W/ FRGN OBJ",
+        "ASSAULT WITH DEADLY WEAPON ON POLICE OFFICER",
+        "INTIMATE PARTNER - AGGRAVATED ASSAULT",
+        "INTIMATE PARTNER - SIMPLE ASSAULT",
+        "BATTERY POLICE (SIMPLE)",
+        "OTHER ASSAULT"
+    ],
+    "sex crime": [
+        "RAPE, FORCIBLE",
+        "INDECENT EXPOSURE",
+        "BATTERY WITH SEXUAL CONTACT",
+        "LEWD CONDUCT",
+        "ORAL COPULATION",
+        "PIMPING"
+    ],
+    "criminal threats": [
+        "CRIMINAL THREATS - NO WEAPON DISPLAYED",
+        "BRANDISH WEAPON",
+        "STALKING"
+    ],
+    "child crime": [
+        "CHILD ANNOYING (17YRS & UNDER)",
+        "CHILD NEGLECT (SEE 300 W.I.C.)",
+        "CHILD PORNOGRAPHY"
+    ],
+    "other crime": [
+        "OTHER MISCELLANEOUS CRIME",
+        "TRESPASSING",
+        "VIOLATION OF COURT ORDER",
+        "EXTORTION",
+        "ILLEGAL DUMPING",
+        "DRIVING WITHOUT OWNER CONSENT (DWOC)",
+        "LETTERS, LEWD  -  TELEPHONE CALLS, LEWD",
+        "PICKPOCKET",
+        "DISCHARGE FIREARMS/SHOTS FIRED",
+        "DOCUMENT FORGERY / STOLEN FELONY",
+        "FAILURE TO YIELD",
+        "DRUNK ROLL",
+        "CONTEMPT OF COURT",
+        "FALSE IMPRISONMENT",
+        "VIOLATION OF RESTRAINING ORDER",
+        "RESISTING ARREST",
+        "KIDNAPPING",
+        "FALSE POLICE REPORT"
+    ]
+}
+
+# Description -> category, built once instead of searching the lists per row
+CATEGORY_BY_DESCRIPTION = {
+    description: category
+    for category, descriptions in CRIME_CATEGORIES.items()
+    for description in descriptions
+}
+
+def convert_type(crm_cd_desc):
+    '''Returns the category of a crime description, or the description itself if it has none'''
+    return CATEGORY_BY_DESCRIPTION.get(crm_cd_desc, crm_cd_desc)
+
+# 'MM/DD/YYYY' prefix of DATE OCC -> 'yyyy-mm'
+_month_by_day = {}
+
+def year_month(date_occ):
+    '''
+    Returns the 'yyyy-mm' of a DATE OCC value such as '06/01/2024 12:00:00 AM'.
+    The first time a day is seen it is parsed with strptime, which validates
+    it; after that its month comes from a dict lookup on the date part.
+    '''
+    month = _month_by_day.get(date_occ[:10])
+    if month is None:
+        dt = datetime.strptime(date_occ, "%m/%d/%Y %I:%M:%S %p")
+        month = dt.strftime("%Y-%m")
+        _month_by_day[date_occ[:10]] = month
+    return month
+
+# 'MM/DD/YYYY' prefix of DATE OCC -> 'yyyy-mm-dd'
+_iso_by_day = {}
+
+def occurred_on(date_occ):
+    '''Returns the 'yyyy-mm-dd' of a DATE OCC value, parsing each day once'''
+    day = _iso_by_day.get(date_occ[:10])
+    if day is None:
+        dt = datetime.strptime(date_occ, "%m/%d/%Y %I:%M:%S %p")
+        day = dt.strftime("%Y-%m-%d")
+        _iso_by_day[date_occ[:10]] = day
+    return day
+
+class Dimensions:
+    '''
+    The id assigned to each crime type, month, area and (age, sex) victim,
+    numbered from 0 in the order they are first seen.
+    '''
+
+    def __init__(self):
+        self.types = {}    # crime type -> id
+        self.months = {}   # 'yyyy-mm' -> id
+        self.areas = {}    # area -> id
+        self.crimes = {}   # (vict_age, vict_sex) -> id
+        self.next_ids = {'types': 0, 'months': 0, 'areas': 0, 'crimes': 0}
+
+    def add(self, dimension, key):
+        '''Gives key the next id in dimension and returns it'''
+        id = self.next_ids[dimension]
+        self.next_ids[dimension] = id + 1
+        getattr(self, dimension)[key] = id
+        return id
+
+# Existing dimension members, keyed as convert_rows() keys the input
+DIMENSION_QUERIES = {
+    'types': 'SELECT id, type FROM types',
+    'months': 'SELECT id, month FROM months',
+    'areas': 'SELECT id, area FROM areas',
+    'crimes': 'SELECT id, vict_age, vict_sex FROM crimes',
+}
+
+def load_dimensions(cursor):
+    '''
+    Reads the dimension tables into a Dimensions. Members added to it later
+    are numbered after the highest id already in their table.
+    '''
+    dims = Dimensions()
+    for dimension, query in DIMENSION_QUERIES.items():
+        cursor.execute(query)
+        members = getattr(dims, dimension)
+        next_id = 0
+        for id, *key in cursor.fetchall():
+            if dimension == 'crimes':
+                vict_age, vict_sex = key
+                key = ('' if vict_age is None else str(vict_age), vict_sex or '')
+            else:
+                key = key[0]
+            members.setdefault(key, id)
+            next_id = max(next_id, id + 1)
+        dims.next_ids[dimension] = next_id
+    return dims
+
+def read_rows(path):
+    '''Yields the (DATE OCC, AREA NAME, Crm Cd Desc, Vict Age, Vict Sex) rows of the input file'''
+    with open(path, newline='', encoding='utf-8') as f:
         reader = csv.reader(f)
-        headers = next(reader)  # Skip header row
-
-        for row in reader:
-            # Column positions based on file format
-            date_occ = row[0]
-            area = row[1]
-            crm_cd_desc = row[2]
-            vict_age = row[3]
-            vict_sex = row[4]
-            crime_type = convert_type(crm_cd_desc)
-
-            # Handle crime_types
-            if crime_type not in crime_types:
-                crime_types[crime_type] = crime_type_id
-                crime_type_id += 1
-            ct_id = crime_types[crime_type]
-
-            # Handle crime_times
-            dt = datetime.strptime(date_occ, "%m/%d/%Y %I:%M:%S %p")
-            year_month = dt.strftime("%Y-%m")
-            if year_month not in crime_times:
-                crime_times[year_month] = time_id
-                time_id += 1
-            t_id = crime_times[year_month]
-
-            # Handle locations
-            #loc_key = (location, lat, lon)
-            if area not in areas:
-                areas[area] = area_id
-                area_id += 1
-            a_id = areas[area]
-            
-            crime_key = (vict_age, vict_sex)
-            if crime_key not in crimes:
-                crimes[crime_key] = crime_id
-                crime_id += 1
-            c_id = crimes[crime_key]
-            
-
-            # Add to main crime table
-            crimes_crime_types_crimes_times_areas.append([c_id, ct_id, t_id, a_id])
-
-    # Write files
-    with open('data/crime_types.csv', 'w', newline='', encoding='utf-8') as f:
-        writer = csv.writer(f)
-        for desc, id in crime_types.items():
-            print(f'this is crime: {desc}')
-            writer.writerow([id, desc])
+        next(reader, None)  # Skip header row
+        yield from reader
 
-    with open('data/crime_times.csv', 'w', newline='', encoding='utf-8') as f:
-        writer = csv.writer(f)
-        for (year_month), id in crime_times.items():
-            writer.writerow([id, year_month])
+def convert_rows(rows, dims, chunk_rows=CHUNK_ROWS):
+    '''
+    Converts input rows to crime_events rows [crime_id, type_id, month_id,
+    area_id], adding new dimension values to dims as they appear. Yields the
+    events in lists of up to chunk_rows.
+    '''
+    # Local names keep the per-row work to a few dict lookups.
+    types, months, areas, crimes = dims.types, dims.months, dims.areas, dims.crimes
+    add = dims.add
+    categories = CATEGORY_BY_DESCRIPTION
+    month_by_day = _month_by_day
 
-    with open('data/areas.csv', 'w', newline='', encoding='utf-8') as f:
-        writer = csv.writer(f)
-        '''
-        for (loc, lat, lon), id in locations.items():
-            writer.writerow([id, loc, lat, lon])
-        '''
-        for (area, id) in areas.items():
-            writer.writerow([id, area])
-
-    with open('data/crimes.csv', 'w', newline='', encoding='utf-8') as f:
-        writer = csv.writer(f)
-        for (vict_age, vict_sex), id in crimes.items():
-            writer.writerow([id, vict_age, vict_sex])
+    chunk = []
+    append = chunk.append
+    for date_occ, area, crm_cd_desc, vict_age, vict_sex in rows:
+        crime_type = categories.get(crm_cd_desc, crm_cd_desc)
+        ct_id = types.get(crime_type)
+        if ct_id is None:
+            ct_id = add('types', crime_type)
+
+        month = month_by_day.get(date_occ[:10])
+        if month is None:
+            month = year_month(date_occ)
+        t_id = months.get(month)
+        if t_id is None:
+            t_id = add('months', month)
+
+        a_id = areas.get(area)
+        if a_id is None:
+            a_id = add('areas', area)
+
+        crime_key = (vict_age, vict_sex)
+        c_id = crimes.get(crime_key)
+        if c_id is None:
+            c_id = add('crimes', crime_key)
+
+        append((c_id, ct_id, t_id, a_id))
+        if len(chunk) >= chunk_rows:
+            yield chunk
+            chunk = []
+            append = chunk.append
+    if chunk:
+        yield chunk
+
+def rows_after(rows, watermark, days):
+    '''
+    Yields the input rows that occurred after watermark ('yyyy-mm-dd', or
+    None for every row), adding the date of each one to the set days.
+    '''
+    for row in rows:
+        day = occurred_on(row[0])
+        if watermark is None or day > watermark:
+            days.add(day)
+            yield row
+
+def dimension_rows(dims, first_ids=None):
+    '''
+    Returns (CSV file name, table and columns, rows) for each dimension table.
+    With first_ids ({dimension: id}) only members numbered from those ids on
+    are included.
+    '''
+    first_ids = first_ids or {}
+
+    def members(dimension):
+        first = first_ids.get(dimension, 0)
+        return ((id, key) for key, id in getattr(dims, dimension).items() if id >= first)
+
+    return [
+        ('crime_types.csv', 'types (id, type)',
+         ([id, desc] for id, desc in members('types'))),
+        ('crime_times.csv', 'months (id, month)',
+         ([id, year_month] for id, year_month in members('months'))),
+        ('areas.csv', 'areas (id, area)',
+         ([id, area] for id, area in members('areas'))),
+        ('crimes.csv', 'crimes (id, vict_age, vict_sex)',
+         ([id, vict_age, vict_sex] for id, (vict_age, vict_sex) in members('crimes'))),
+    ]
 
-    with open('data/crime_events.csv', 'w', newline='', encoding='utf-8') as f:
+def write_dimensions(dims, output_dir):
+    '''Writes the crime_types, crime_times, areas and crimes CSV files'''
+    for name, _, rows in dimension_rows(dims):
+        with open(os.path.join(output_dir, name), 'w', newline='', encoding='utf-8') as f:
+            csv.writer(f).writerows(rows)
+
+def snapshot_rows(input_file, snapshot_dir):
+    '''
+    Returns the input rows, and a function that saves the snapshot built
+    from them once they have all been read (a no-op without snapshot_dir).
+    '''
+    rows = read_rows(input_file)
+    if not snapshot_dir:
+        return rows, lambda: None
+    import snapshot
+    writer = snapshot.SnapshotWriter()
+    return writer.feed(rows), lambda: writer.save(snapshot_dir, source=input_file)
+
+def build_snapshot(input_file, snapshot_dir):
+    '''Writes a snapshot of input_file in a pass of its own'''
+    import snapshot
+    return snapshot.build(input_file, snapshot_dir)
+
+def convert(input_file=INPUT_FILE, output_dir=OUTPUT_DIR, snapshot_dir=None):
+    '''
+    Converts input_file into the five table CSVs in output_dir, and into a
+    snapshot in snapshot_dir if given; returns the Dimensions
+    '''
+    dims = Dimensions()
+    os.makedirs(output_dir, exist_ok=True)
+    rows, save_snapshot = snapshot_rows(input_file, snapshot_dir)
+    with open(os.path.join(output_dir, 'crime_events.csv'), 'w', newline='', encoding='utf-8') as f:
         writer = csv.writer(f)
-        for ids in crimes_crime_types_crimes_times_areas:
-            writer.writerow(ids)
+        for chunk in convert_rows(rows, dims):
+            writer.writerows(chunk)
+    write_dimensions(dims, output_dir)
+    save_snapshot()
+    return dims
 
-def convert_type(crm_cd_desc):
-    crime_categories = {
-        "theft": [
-            "VEHICLE - STOLEN",
-            "VEHICLE, STOLEN - OTHER (MOTORIZED SCOOTERS, BIKES, ETC)",
-            "THEFT FROM MOTOR VEHICLE - PETTY ($950 & UNDER)",
-            "VEHICLE - ATTEMPT STOLEN",
-            "THEFT-GRAND ($950.01 & OVER)EXCPT,GUNS,FOWL,LIVESTK,PROD",
-            "THEFT OF IDENTITY",
-            "THEFT PLAIN - PETTY ($950 & UNDER)",
-            "THEFT FROM MOTOR VEHICLE - GRAND ($950.01 AND OVER)",
-            "THEFT FROM PERSON - ATTEMPT",
-            "SHOPLIFTING - PETTY THEFT ($950 & UNDER)",
-            "SHOPLIFTING-GRAND THEFT ($950.01 & OVER)",
-            "BIKE - STOLEN",
-            "DEFRAUDING INNKEEPER/THEFT OF SERVICES, $950 & UNDER",
-            "THEFT, PERSON",
-            "DEFRAUDING INNKEEPER/THEFT OF SERVICES, OVER $950.01",
-            "EMBEZZLEMENT, PETTY THEFT ($950 & UNDER)",
-            "EMBEZZLEMENT, GRAND THEFT ($950.01 & OVER)"
-        ],
-        "vandalism": [
-            "VANDALISM - MISDEAMEANOR ($399 OR UNDER)",
-            "VANDALISM - FELONY ($400 & OVER, ALL CHURCH VANDALISMS)",
-            "ARSON"
-        ],
-        "robbery": [
-            "BURGLARY",
-            "BURGLARY FROM VEHICLE",
-            "SHOPLIFTING - ATTEMPT",
-            "BURGLARY FROM VEHICLE, ATTEMPTED",
-            "BURGLARY, ATTEMPTED",
-            "ATTEMPTED ROBBERY",
-            "ROBBERY"
-        ],
-        "assault": [
-            "BATTERY - SIMPLE ASSAULT",
-            "ASSAULT WITH DEADLY WEAPON, AGGRAVATED ASSAULT",
-            "SEX,UNLAWFUL(INC MUTUAL CONSENT, PENETRATION W/ FRGN OBJ",
-            "ASSAULT WITH DEADLY WEAPON ON POLICE OFFICER",
-            "INTIMATE PARTNER - AGGRAVATED ASSAULT",
-            "INTIMATE PARTNER - SIMPLE ASSAULT",
-            "BATTERY POLICE (SIMPLE)",
-            "OTHER ASSAULT"
-        ],
-        "sex crime": [
-            "RAPE, FORCIBLE",
-            "INDECENT EXPOSURE",
-            "BATTERY WITH SEXUAL CONTACT",
-            "LEWD CONDUCT",
-            "ORAL COPULATION",
-            "PIMPING"
-        ],
-        "criminal threats": [
-            "CRIMINAL THREATS - NO WEAPON DISPLAYED",
-            "BRANDISH WEAPON",
-            "STALKING"
-        ],
-        "child crime": [
-            "CHILD ANNOYING (17YRS & UNDER)",
-            "CHILD NEGLECT (SEE 300 W.I.C.)",
-            "CHILD PORNOGRAPHY"
-        ],
-        "other crime": [
-            "OTHER MISCELLANEOUS CRIME",
-            "TRESPASSING",
-            "VIOLATION OF COURT ORDER",
-            "EXTORTION",
-            "ILLEGAL DUMPING",
-            "DRIVING WITHOUT OWNER CONSENT (DWOC)",
-            "LETTERS, LEWD  -  TELEPHONE CALLS, LEWD",
-            "PICKPOCKET",
-            "DISCHARGE FIREARMS/SHOTS FIRED",
-            "DOCUMENT FORGERY / STOLEN FELONY",
-            "FAILURE TO YIELD",
-            "DRUNK ROLL",
-            "CONTEMPT OF COURT",
-            "FALSE IMPRISONMENT",
-            "VIOLATION OF RESTRAINING ORDER",
-            "RESISTING ARREST",
-            "KIDNAPPING",
-            "FALSE POLICE REPORT"
-        ]
-    }
-    for category, crimes in crime_categories.items():
-        if crm_cd_desc in crimes:
-            return category
-    return crm_cd_desc
+def row_starts(path, ranges, block_size=1 << 20):
+    '''
+    Returns the offsets at which to split path into about `ranges` byte ranges,
+    each starting at the beginning of a row. A newline inside a quoted field
+    does not end a row: the quotes before it are counted from the start of the
+    file, and only a newline after an even number of them is a row boundary.
+    '''
+    size = os.path.getsize(path)
+    targets = [size * i // ranges for i in range(1, ranges)]
+    starts = [0]
+    inside = False  # whether the scan position is inside a quoted field
+    offset = 0      # file offset of the current block
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            pos = 0
+            while targets and targets[0] < offset + len(block):
+                target = targets[0] - offset
+                if target > pos:
+                    inside ^= block.count(b'"', pos, target) & 1
+                    pos = target
+                newline = block.find(b'\n', pos)
+                if newline < 0:
+                    break  # the row continues in the next block
+                inside ^= block.count(b'"', pos, newline) & 1
+                pos = newline + 1
+                if not inside:
+                    start = offset + pos
+                    if starts[-1] < start < size:
+                        starts.append(start)
+                    while targets and targets[0] < start:
+                        targets.pop(0)
+            inside ^= block.count(b'"', pos) & 1
+            offset += len(block)
+            if not targets:
+                break
+    return starts
+
+def read_range(path, start, end):
+    '''
+    Yields the rows of path that start in the byte range [start, end), which
+    must begin at a row boundary. The header row (at offset 0) is skipped.
+    '''
+    with open(path, 'rb') as f:
+        f.seek(start)
+
+        def lines():
+            pos = start
+            for line in f:
+                if pos >= end:
+                    return
+                pos += len(line)
+                yield line.decode('utf-8')
+
+        reader = csv.reader(lines())
+        if start == 0:
+            next(reader, None)  # Skip header row
+        yield from reader
+
+def convert_range(task):
+    '''
+    Pool task: converts one byte range of the input using ids local to the
+    range, writing the events to part_path as a flat array of ints. Returns
+    {dimension: [key, ...]}, each list indexed by local id.
+    '''
+    path, start, end, part_path = task
+    dims = Dimensions()
+    with open(part_path, 'wb') as f:
+        for chunk in convert_rows(read_range(path, start, end), dims):
+            array('i', itertools.chain.from_iterable(chunk)).tofile(f)
+    return {dimension: list(getattr(dims, dimension)) for dimension in dims.next_ids}
+
+def write_range(task):
+    '''
+    Pool task: rewrites a part file from convert_range() as crime_events CSV
+    rows, mapping its local ids to global ones with the given lists.
+    '''
+    part_path, crime_ids, type_ids, month_ids, area_ids, csv_path = task
+    events = array('i')
+    with open(part_path, 'rb') as f:
+        events.frombytes(f.read())
+    rows = zip(map(crime_ids.__getitem__, events[0::4]),
+               map(type_ids.__getitem__, events[1::4]),
+               map(month_ids.__getitem__, events[2::4]),
+               map(area_ids.__getitem__, events[3::4]))
+    with open(csv_path, 'w', newline='', encoding='utf-8') as f:
+        csv.writer(f).writerows(rows)
+    return csv_path
+
+def convert_parallel(input_file=INPUT_FILE, output_dir=OUTPUT_DIR, jobs=None):
+    '''
+    Does what convert() does using `jobs` processes (default: one per CPU)
+    and writes the same files. Returns the Dimensions.
+    '''
+    jobs = jobs or os.cpu_count() or 1
+    os.makedirs(output_dir, exist_ok=True)
+    starts = row_starts(input_file, jobs * RANGES_PER_JOB)
+    ends = starts[1:] + [os.path.getsize(input_file)]
+    parts = [os.path.join(output_dir, f'crime_events.csv.part{i}') for i in range(len(starts))]
+
+    try:
+        with multiprocessing.Pool(jobs) as pool:
+            ranges = [(input_file, start, end, part + '.bin')
+                      for start, end, part in zip(starts, ends, parts)]
+            range_keys = pool.map(convert_range, ranges)
+
+            # Merging the ranges in file order gives every value the id of its
+            # first appearance in the file, as in a serial run.
+            dims = Dimensions()
+            tasks = []
+            for keys, part in zip(range_keys, parts):
+                global_ids = {}
+                for dimension, members in keys.items():
+                    known = getattr(dims, dimension)
+                    global_ids[dimension] = [known[key] if key in known else dims.add(dimension, key)
+                                             for key in members]
+                tasks.append((part + '.bin', global_ids['crimes'], global_ids['types'],
+                              global_ids['months'], global_ids['areas'], part))
+            pool.map(write_range, tasks)
+
+        with open(os.path.join(output_dir, 'crime_events.csv'), 'wb') as out:
+            for part in parts:
+                with open(part, 'rb') as f:
+                    shutil.copyfileobj(f, out, 1 << 20)
+    finally:
+        for part in parts:
+            for path in (part, part + '.bin'):
+                if os.path.exists(path):
+                    os.remove(path)
+
+    write_dimensions(dims, output_dir)
+    return dims
+
+class CopyStream:
+    '''
+    A read-only file over chunks of rows, formatted as CSV as COPY reads it,
+    so cursor.copy_expert() can stream rows that are still being converted.
+    Only the current chunk is held as text.
+    '''
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._text = ''
+        self._pos = 0
+
+    def read(self, size=-1):
+        while self._pos >= len(self._text):
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                return ''
+            out = io.StringIO()
+            csv.writer(out, lineterminator='\n').writerows(chunk)
+            self._text = out.getvalue()
+            self._pos = 0
+        end = len(self._text) if size is None or size < 0 else self._pos + size
+        data = self._text[self._pos:end]
+        self._pos += len(data)
+        return data
+
+def copy_rows(cursor, table, chunks, options=''):
+    '''COPYs chunks of rows into table, given as "name (columns)"'''
+    cursor.copy_expert(f'COPY {table} FROM STDIN WITH (FORMAT csv{options})',
+                       CopyStream(chunks), size=1 << 20)
+
+def copy_dimensions(cursor, dims, schema, first_ids=None):
+    '''COPYs the dimension members (see dimension_rows()) into the tables in schema'''
+    for _, table, rows in dimension_rows(dims, first_ids):
+        # Keep empty vict_sex values as '' rather than NULL, as in data/database.sql
+        options = ', FORCE_NOT_NULL (vict_sex)' if table.startswith('crimes ') else ''
+        copy_rows(cursor, f'{schema}.{table}', [list(rows)], options)
+    for table in ('crimes', 'months', 'areas'):
+        cursor.execute(f"SELECT setval(pg_get_serial_sequence('{schema}.{table}', 'id'), "
+                       f"COALESCE(MAX(id) + 1, 1), false) FROM {schema}.{table}")
+
+def read_watermark(cursor):
+    '''
+    Returns the last loaded DATE OCC as 'yyyy-mm-dd'. Databases loaded before
+    the watermark existed fall back to the end of their latest month; an
+    empty database gives None.
+    '''
+    cursor.execute(WATERMARK_TABLE)
+    cursor.execute('SELECT last_date_occ::text FROM ingest_watermark')
+    row = cursor.fetchone()
+    if row is not None:
+        return row[0]
+    cursor.execute('SELECT MAX(month) FROM months')
+    month = cursor.fetchone()[0]
+    return None if month is None else f'{month}-31'
+
+def write_watermark(cursor, last_date_occ):
+    cursor.execute(WATERMARK_TABLE)
+    cursor.execute('''
+        INSERT INTO ingest_watermark (last_date_occ) VALUES (%s)
+        ON CONFLICT (id) DO UPDATE SET last_date_occ = EXCLUDED.last_date_occ, updated_at = now()
+    ''', (last_date_occ,))
+
+def rollup_exists(cursor):
+    cursor.execute("SELECT to_regclass('public.crime_rollup')")
+    return cursor.fetchone()[0] is not None
+
+def swap_in_staging(cursor):
+    '''
+    Moves the staged tables into public, and the public tables they replace
+    out to RETIRED_SCHEMA, which is then dropped. Takes exclusive locks on
+    the public tables until the caller commits.
+    '''
+    cursor.execute(f'DROP SCHEMA IF EXISTS {RETIRED_SCHEMA} CASCADE')
+    cursor.execute(f'CREATE SCHEMA {RETIRED_SCHEMA}')
+    for table in LOAD_TABLES:
+        cursor.execute('SELECT to_regclass(%s)', (f'public.{table}',))
+        if cursor.fetchone()[0] is not None:
+            cursor.execute(f'ALTER TABLE public.{table} SET SCHEMA {RETIRED_SCHEMA}')
+        cursor.execute(f'ALTER TABLE {STAGING_SCHEMA}.{table} SET SCHEMA public')
+    cursor.execute(f'DROP SCHEMA {RETIRED_SCHEMA} CASCADE')
+    cursor.execute(f'DROP SCHEMA {STAGING_SCHEMA}')
+
+def load(connection, input_file=INPUT_FILE, snapshot_dir=None):
+    '''
+    Converts input_file straight into the database, replacing the crime
+    tables in one transaction (see the module docstring), and commits. Also
+    writes a snapshot to snapshot_dir if given. Returns the Dimensions.
+    '''
+    cursor = connection.cursor()
+    cursor.execute(f'DROP SCHEMA IF EXISTS {STAGING_SCHEMA} CASCADE')
+    cursor.execute(f'CREATE SCHEMA {STAGING_SCHEMA}')
+    cursor.execute(STAGING_TABLES.format(schema=STAGING_SCHEMA))
+
+    dims = Dimensions()
+    days = set()
+    rows, save_snapshot = snapshot_rows(input_file, snapshot_dir)
+    copy_rows(cursor, f'{STAGING_SCHEMA}.crime_events (crime_id, type_id, month_id, area_id)',
+              convert_rows(rows_after(rows, None, days), dims))
+    copy_dimensions(cursor, dims, STAGING_SCHEMA)
+
+    cursor.execute(STAGING_KEYS.format(schema=STAGING_SCHEMA))
+    for table in LOAD_TABLES:
+        cursor.execute(f'ANALYZE {STAGING_SCHEMA}.{table}')
+
+    swap_in_staging(cursor)
+    if days:
+        write_watermark(cursor, max(days))
+    if rollup_exists(cursor):
+        refresh_rollup(connection, None)
+    notify_reload(connection)
+    cursor.close()
+    connection.commit()
+    save_snapshot()
+    return dims
+
+def append(connection, input_file=INPUT_FILE):
+    '''
+    Adds the rows of input_file that occurred after the watermark to the
+    loaded tables, in one transaction, and commits. Returns the number of
+    events added and the sorted months they fall in.
+    '''
+    cursor = connection.cursor()
+    # One loader at a time; readers are not blocked.
+    cursor.execute('LOCK TABLE crime_events IN SHARE ROW EXCLUSIVE MODE')
+    watermark = read_watermark(cursor)
+    dims = load_dimensions(cursor)
+    first_ids = dict(dims.next_ids)
+
+    # Events reference dimension members that are only known once the input
+    # has been read, so they wait in a temporary table until those exist.
+    cursor.execute('''
+        CREATE TEMPORARY TABLE new_events (
+            crime_id integer, type_id integer, month_id integer, area_id integer
+        ) ON COMMIT DROP
+    ''')
+    days = set()
+    copy_rows(cursor, 'new_events (crime_id, type_id, month_id, area_id)',
+              convert_rows(rows_after(read_rows(input_file), watermark, days), dims))
+    if not days:
+        connection.rollback()
+        return 0, []
+
+    copy_dimensions(cursor, dims, 'public', first_ids)
+    cursor.execute('''
+        INSERT INTO crime_events (crime_id, type_id, month_id, area_id)
+        SELECT crime_id, type_id, month_id, area_id FROM new_events
+    ''')
+    added = cursor.rowcount
+    cursor.execute('ANALYZE crime_events')
+
+    months = sorted({day[:7] for day in days})
+    write_watermark(cursor, max(days))
+    if rollup_exists(cursor):
+        refresh_rollup(connection, months)
+    notify_reload(connection)
+    cursor.close()
+    connection.commit()
+    return added, months
+
+def input_months(input_file=INPUT_FILE):
+    '''Returns the sorted year-months ('yyyy-mm') that occur in the input file'''
+    return sorted({year_month(row[0]) for row in read_rows(input_file)})
+
+def refresh_rollup(connection, months=None):
+    '''
+    Rebuilds the crime_rollup rows for the given months, or for every month
+    when months is None. The caller commits.
+    '''
+    cursor = connection.cursor()
+    cursor.execute('SELECT refresh_crime_rollup(%s::text[])', (months,))
+    cursor.close()
+
+def notify_reload(connection):
+    '''
+    Tells running webapp processes to drop their cached responses. PostgreSQL
+    delivers the notification when the caller commits.
+    '''
+    cursor = connection.cursor()
+    cursor.execute(f'NOTIFY {RELOAD_CHANNEL}')
+    cursor.close()
+
+def job_count(text):
+    '''Returns a --jobs value: a process count, or 0 for one per CPU'''
+    try:
+        jobs = int(text)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid job count '{text}'")
+    if jobs < 0:
+        raise argparse.ArgumentTypeError("the job count must be 0 or more")
+    return jobs
+
+def main():
+    parser = argparse.ArgumentParser(description='Convert the crime data CSV into the database tables.')
+    parser.add_argument('--refresh-rollup', action='store_true',
+                        help='refresh crime_rollup for the months in the input instead of writing CSVs; '
+                             'run this after loading new months into the database')
+    parser.add_argument('--load', action='store_true',
+                        help='load the converted rows straight into the database with COPY, '
+                             'replacing the crime tables, instead of writing CSVs')
+    parser.add_argument('--append', action='store_true',
+                        help='add only the input rows newer than the last load to the database, '
+                             'keeping existing ids, instead of writing CSVs')
+    parser.add_argument('--input', default=INPUT_FILE,
+                        help=f'source CSV file (default {INPUT_FILE})')
+    parser.add_argument('--output-dir', default=OUTPUT_DIR,
+                        help=f'directory to write the table CSVs to (default {OUTPUT_DIR})')
+    parser.add_argument('--jobs', type=job_count, default=1,
+                        help='processes to convert with; 0 means one per CPU (default 1)')
+    parser.add_argument('--snapshot', metavar='DIR',
+                        help='also write a columnar snapshot of the input to DIR (requires NumPy)')
+    parser.add_argument('--dsn', default='',
+                        help='PostgreSQL connection string (default: the PG* environment variables)')
+    args = parser.parse_args()
+
+    if args.refresh_rollup:
+        import psycopg2
+        months = input_months(args.input)
+        connection = psycopg2.connect(args.dsn)
+        try:
+            refresh_rollup(connection, months)
+            notify_reload(connection)
+            connection.commit()
+        finally:
+            connection.close()
+        print(f"Refreshed crime_rollup for {len(months)} months")
+    elif args.load:
+        import psycopg2
+        started = time.perf_counter()
+        connection = psycopg2.connect(args.dsn)
+        try:
+            dims = load(connection, args.input, args.snapshot)
+        finally:
+            connection.close()
+        print(f"Loaded {len(dims.crimes)} victims, {len(dims.types)} types, {len(dims.months)} months "
+              f"and {len(dims.areas)} areas in {time.perf_counter() - started:.1f}s")
+    elif args.append:
+        import psycopg2
+        connection = psycopg2.connect(args.dsn)
+        try:
+            added, months = append(connection, args.input)
+        finally:
+            connection.close()
+        if added:
+            print(f"Appended {added} events in {', '.join(months)}")
+        else:
+            print("No rows newer than the last load")
+        if args.snapshot:
+            # The snapshot covers the whole input, not just the appended rows.
+            build_snapshot(args.input, args.snapshot)
+    elif args.jobs != 1:
+        convert_parallel(args.input, args.output_dir, args.jobs)
+        if args.snapshot:
+            build_snapshot(args.input, args.snapshot)
+    else:
+        convert(args.input, args.output_dir, args.snapshot)
 
 if __name__ == '__main__':
     main()
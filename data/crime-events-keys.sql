@@ -0,0 +1,58 @@
+--
+-- crime-events-keys.sql
+-- Authors: Chloe Xufeng, Owen Xu
+--
+-- Migration for a database loaded from data/database.sql. It gives the
+-- crime_events fact table a surrogate key, foreign keys to its dimension
+-- tables and a composite index matching the API's filters (a month range
+-- plus a list of areas plus a list of types).
+--
+--     psql -d crime -f data/crime-events-keys.sql
+--
+-- Everything runs in one transaction, so a failure leaves the schema as it was.
+--
+
+BEGIN;
+
+-- types is the only dimension table the dump leaves without a primary key.
+ALTER TABLE types ADD CONSTRAINT types_pkey PRIMARY KEY (id);
+
+-- Each dimension value is stored once; the API looks months up by name.
+ALTER TABLE months ADD CONSTRAINT months_month_key UNIQUE (month);
+ALTER TABLE areas ADD CONSTRAINT areas_area_key UNIQUE (area);
+ALTER TABLE types ADD CONSTRAINT types_type_key UNIQUE (type);
+
+-- Surrogate event id, numbered in the current physical (load) order.
+ALTER TABLE crime_events ADD COLUMN id bigserial;
+ALTER TABLE crime_events ADD CONSTRAINT crime_events_pkey PRIMARY KEY (id);
+
+ALTER TABLE crime_events
+    ALTER COLUMN crime_id SET NOT NULL,
+    ALTER COLUMN type_id SET NOT NULL,
+    ALTER COLUMN month_id SET NOT NULL,
+    ALTER COLUMN area_id SET NOT NULL;
+
+ALTER TABLE crime_events
+    ADD CONSTRAINT crime_events_crime_id_fkey FOREIGN KEY (crime_id) REFERENCES crimes (id),
+    ADD CONSTRAINT crime_events_month_id_fkey FOREIGN KEY (month_id) REFERENCES months (id),
+    ADD CONSTRAINT crime_events_area_id_fkey FOREIGN KEY (area_id) REFERENCES areas (id);
+
+-- The dump has events whose type_id has no row in types (descriptions that
+-- were never given a category); the API's joins already leave them out.
+-- NOT VALID keeps those rows but enforces the key for everything loaded later.
+ALTER TABLE crime_events
+    ADD CONSTRAINT crime_events_type_id_fkey FOREIGN KEY (type_id) REFERENCES types (id) NOT VALID;
+
+-- Month range first (the one filter every query has), then the area and type
+-- lists. crime_id is carried in the index so filtered scans never visit the heap.
+CREATE INDEX crime_events_month_area_type_idx
+    ON crime_events (month_id, area_id, type_id) INCLUDE (crime_id);
+
+-- Area/type lookups without a month range ("all of Central's thefts").
+CREATE INDEX crime_events_area_type_idx
+    ON crime_events (area_id, type_id) INCLUDE (month_id, crime_id);
+
+COMMIT;
+
+ANALYZE crime_events;
+ANALYZE types;
@@ -0,0 +1,13 @@
+--
+-- crime-events-keyset.sql
+-- Authors: Chloe Xufeng, Owen Xu
+--
+-- Migration, run after crime-events-keys.sql. /crimes?limit= pages through a
+-- month's events in id order, starting just after the previous page; this
+-- index turns each page into a short range scan.
+--
+--     psql -d crime -f data/crime-events-keyset.sql
+--
+
+CREATE INDEX IF NOT EXISTS crime_events_month_id_idx
+    ON crime_events (month_id, id);
@@ -5,23 +5,42 @@ CREATE TABLE crimes (
 );
 
 CREATE TABLE types (
-    id integer NOT NULL,
-    type TEXT
+    id integer PRIMARY KEY,
+    type TEXT UNIQUE
 );
 
 CREATE TABLE months (
     id SERIAL PRIMARY KEY,
-    month TEXT
+    month TEXT UNIQUE
 );
 
 CREATE TABLE areas (
     id SERIAL PRIMARY KEY,
-    area TEXT
+    area TEXT UNIQUE
 );
 
+-- Keys and indexes as added by crime-events-keys.sql
 CREATE TABLE crime_events (
-    crime_id integer,
-    type_id integer,
-    month_id integer,
-    area_id integer
-);
\ No newline at end of file
+    crime_id integer NOT NULL REFERENCES crimes (id),
+    type_id integer NOT NULL REFERENCES types (id),
+    month_id integer NOT NULL REFERENCES months (id),
+    area_id integer NOT NULL REFERENCES areas (id),
+    id BIGSERIAL PRIMARY KEY
+);
+
+CREATE INDEX crime_events_month_area_type_idx
+    ON crime_events (month_id, area_id, type_id) INCLUDE (crime_id);
+
+CREATE INDEX crime_events_area_type_idx
+    ON crime_events (area_id, type_id) INCLUDE (month_id, crime_id);
+
+-- Added by crime-events-keyset.sql
+CREATE INDEX crime_events_month_id_idx
+    ON crime_events (month_id, id);
+
+-- Created by convert.py --load / --append: the latest DATE OCC loaded
+CREATE TABLE ingest_watermark (
+    id boolean PRIMARY KEY DEFAULT true CHECK (id),
+    last_date_occ date NOT NULL,
+    updated_at timestamptz NOT NULL DEFAULT now()
+);
@@ -0,0 +1,55 @@
+--
+-- rollup.sql
+-- Authors: Chloe Xufeng, Owen Xu
+--
+-- Precomputed event counts for every (month, area, type, victim age bucket,
+-- victim sex) combination. The /charts/* API routes read from this table
+-- instead of joining crime_events against crimes, months, areas and types on
+-- every request.
+--
+-- Load it once after data/database.sql:
+--     psql -d crime -f data/rollup.sql
+--
+-- After new months are loaded, refresh only those months:
+--     SELECT refresh_crime_rollup(ARRAY['2025-04']);
+-- or rebuild everything:
+--     SELECT refresh_crime_rollup();
+-- (python3 convert.py --refresh-rollup does this for the months in its input.)
+--
+
+CREATE TABLE IF NOT EXISTS crime_rollup (
+    month_id integer NOT NULL,
+    area_id integer NOT NULL,
+    type_id integer NOT NULL,
+    age_bucket integer,      -- lower bound of the 10-year age bucket, NULL when the age is 0 or less
+    vict_sex text,
+    event_count bigint NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS crime_rollup_month_area_type_idx
+    ON crime_rollup (month_id, area_id, type_id);
+
+CREATE OR REPLACE FUNCTION refresh_crime_rollup(refresh_months text[] DEFAULT NULL)
+RETURNS void AS $$
+BEGIN
+    -- Rebuild the rows for the given months ('yyyy-mm'), or for all months when NULL.
+    DELETE FROM crime_rollup
+    WHERE refresh_months IS NULL
+       OR month_id IN (SELECT id FROM months WHERE month = ANY(refresh_months));
+
+    INSERT INTO crime_rollup (month_id, area_id, type_id, age_bucket, vict_sex, event_count)
+    SELECT crime_events.month_id, crime_events.area_id, crime_events.type_id,
+           CASE WHEN crimes.vict_age > 0 THEN crimes.vict_age / 10 * 10 END,
+           crimes.vict_sex,
+           COUNT(*)
+    FROM crime_events
+    JOIN crimes ON crimes.id = crime_events.crime_id
+    WHERE refresh_months IS NULL
+       OR crime_events.month_id IN (SELECT id FROM months WHERE month = ANY(refresh_months))
+    GROUP BY 1, 2, 3, 4, 5;
+
+    ANALYZE crime_rollup;
+END;
+$$ LANGUAGE plpgsql;
+
+SELECT refresh_crime_rollup();
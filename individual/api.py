@@ -7,15 +7,50 @@ Date: 2025-04-16
 Citation: Based on flask_sample.py provided in course materials.
 """
 
+import os
+import sys
 import flask
 import csv
 import json
 import argparse
 
+import csvindex
+
+# snapshot.py lives at the top of the repository
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+try:
+    import numpy as np
+    import snapshot
+except ImportError:
+    snapshot = None
+
 app = flask.Flask(__name__)
 
 DATA_FILE = "../data/crime-data.csv"
 
+_index = None
+_snapshot = None
+
+def get_index():
+    """Returns the area index of DATA_FILE (see csvindex.py), rebuilt if the file changed, or None"""
+    global _index
+    if _index is None or not _index.is_current():
+        try:
+            _index = csvindex.open_index(DATA_FILE)
+        except (OSError, ValueError, csv.Error) as e:
+            print(f"Area index unavailable, scanning {DATA_FILE}: {e}", file=sys.stderr)
+            _index = None
+    return _index
+
+def get_snapshot():
+    """Returns the columnar snapshot of DATA_FILE if one is up to date (see snapshot.py), or None"""
+    global _snapshot
+    if snapshot is None:
+        return None
+    if _snapshot is None or not _snapshot.is_current(DATA_FILE):
+        _snapshot = snapshot.open_for(DATA_FILE)
+    return _snapshot
+
 # -- Root --
 @app.route('/')
 def index():
@@ -30,15 +65,27 @@ def crimes_by_area():
 
     results = []
     try:
-        with open(DATA_FILE, newline='', encoding='utf-8') as csvfile:
-            reader = csv.DictReader(csvfile)
-            reader.fieldnames = [name.strip() for name in reader.fieldnames]
-            for row in reader:
-                if row['AREA NAME'].strip().lower() == area.lower():
-                    results.append({
-                        "date": row['DATE OCC'],
-                        "description": row['Crm Cd Desc']
-                    })
+        index = get_index()
+        snap = get_snapshot() if index is None else None
+        if index is not None:
+            results = [{"date": row['DATE OCC'], "description": row['Crm Cd Desc']}
+                       for row in index.rows(area)]
+        elif snap is not None:
+            rows = np.flatnonzero(snap.mask('area', [area]))
+            dates = snap.date_occ(snap['date'][rows])
+            descriptions = snap.decode('description', snap['description'][rows])
+            results = [{"date": date, "description": description}
+                       for date, description in zip(dates, descriptions)]
+        else:
+            with open(DATA_FILE, newline='', encoding='utf-8') as csvfile:
+                reader = csv.DictReader(csvfile)
+                reader.fieldnames = [name.strip() for name in reader.fieldnames]
+                for row in reader:
+                    if row['AREA NAME'].strip().lower() == area.lower():
+                        results.append({
+                            "date": row['DATE OCC'],
+                            "description": row['Crm Cd Desc']
+                        })
     except Exception as e:
         return json.dumps({"error": str(e)}), 500, {'Content-Type': 'application/json'}
 
@@ -79,4 +126,5 @@ if __name__ == "__main__":
     parser.add_argument("port", type=int, help="Port to run the server on (e.g. 9999)")
     args = parser.parse_args()
 
+    get_index()
     app.run(host=args.host, port=args.port, debug=True)
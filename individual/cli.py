@@ -5,43 +5,160 @@ NAME: cli.py
 AUTHOR: Chloe Xufeng
 
 SYNOPSIS:
-    python3 cli.py crimesbyareaname AREANAME
+    python3 cli.py crimesbyareaname AREANAME [AREANAME ...] [--data CSV] [--dates FROM..TO ...]
 
 DESCRIPTION:
-    Shows a list of crimes reported in the specified AREA NAME (case-insensitive),
-    based on the Crime Data from 2020 to Present dataset.
+    Shows a list of crimes reported in each specified AREA NAME (case-insensitive),
+    based on the Crime Data from 2020 to Present dataset. --dates keeps only
+    crimes that occurred in one of the given ranges; either end may be left
+    out, and dates are written YYYY-MM-DD or MM/DD/YYYY.
+
+    The data is read from the columnar snapshot of the CSV (see snapshot.py)
+    or its area index (see csvindex.py) when one is up to date, and
+    otherwise from the CSV itself in a single pass for all areas.
 """
 
-import argparse
+import os
+import sys
 import csv
+import argparse
+from datetime import datetime
+
+import csvindex
+
+# snapshot.py lives at the top of the repository
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+try:
+    import numpy as np
+    import snapshot
+except ImportError:
+    snapshot = None
+
+DATA_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "crime-data.csv")
+
+def parse_date(text):
+    '''Returns YYYY-MM-DD or MM/DD/YYYY as a yyyymmdd number'''
+    for date_format in ("%Y-%m-%d", "%m/%d/%Y"):
+        try:
+            date = datetime.strptime(text, date_format)
+            return date.year * 10000 + date.month * 100 + date.day
+        except ValueError:
+            pass
+    raise argparse.ArgumentTypeError(f"invalid date '{text}', use YYYY-MM-DD or MM/DD/YYYY")
+
+def parse_range(text):
+    '''Returns FROM..TO (either end optional) as an inclusive (first, last) yyyymmdd pair'''
+    first, separator, last = text.partition('..')
+    if not separator:
+        first = last = text
+    return (parse_date(first) if first else 0, parse_date(last) if last else 99999999)
+
+def date_number(date_occ):
+    '''Returns the yyyymmdd of a DATE OCC value ('MM/DD/YYYY ...')'''
+    return int(date_occ[6:10]) * 10000 + int(date_occ[0:2]) * 100 + int(date_occ[3:5])
 
-def crimes_by_area(area_name):
-    data_file = "/Users/chloe/Downloads/CS 257/cs257/data/crime-data.csv"
+def in_ranges(date_occ, ranges):
+    '''Whether DATE OCC falls in one of ranges; always true when there are none'''
+    if not ranges:
+        return True
+    date = date_number(date_occ)
+    return any(first <= date <= last for first, last in ranges)
+
+def from_snapshot(snap, areas, ranges):
+    '''Returns {area: [(DATE OCC, Crm Cd Desc)]} read from a snapshot'''
+    dates = snap['date']
+    in_range = None
+    if ranges:
+        in_range = np.zeros(len(snap), dtype=bool)
+        for first, last in ranges:
+            in_range |= (dates >= first) & (dates <= last)
+    results = {}
+    for area in areas:
+        mask = snap.mask('area', [area])
+        if in_range is not None:
+            mask &= in_range
+        rows = np.flatnonzero(mask)
+        results[area] = list(zip(snap.date_occ(dates[rows]),
+                                 snap.decode('description', snap['description'][rows])))
+    return results
+
+def from_index(index, areas, ranges):
+    '''Returns {area: [(DATE OCC, Crm Cd Desc)]} read through an area index'''
+    results = {}
+    for area in areas:
+        results[area] = [row for row in index.rows(area, ('DATE OCC', 'Crm Cd Desc'))
+                         if in_ranges(row[0], ranges)]
+    return results
+
+def from_csv(data_file, areas, ranges):
+    '''Returns {area: [(DATE OCC, Crm Cd Desc)]} from one scan of the CSV'''
+    results = {area: [] for area in areas}
+    wanted = {area.strip().lower(): results[area] for area in areas}
+    with open(data_file, newline='', encoding='utf-8-sig') as csvfile:
+        reader = csv.reader(csvfile)
+        header = [name.strip() for name in next(reader)]
+        area_at, date_at, description_at = (header.index(name) for name in
+                                            ('AREA NAME', 'DATE OCC', 'Crm Cd Desc'))
+        for row in reader:
+            found = wanted.get(row[area_at].strip().lower())
+            if found is not None and in_ranges(row[date_at], ranges):
+                found.append((row[date_at], row[description_at]))
+    return results
+
+def saved_index(data_file):
+    '''Returns the saved area index of data_file if it is up to date, or None'''
+    path = csvindex.default_path(data_file)
+    if not os.path.exists(path):
+        return None
     try:
-        with open(data_file, newline='', encoding='utf-8') as csvfile:
-            reader = csv.DictReader(csvfile)
-            print(f"Crimes in area: {area_name}\n")
-            found = False
-            for row in reader:
-                if row['AREA NAME'].lower() == area_name.lower():
-                    found = True
-                    print(f"- {row['DATE OCC']}: {row['Crm Cd Desc']}")
-            if not found:
-                print("No records found for that area.")
-    except FileNotFoundError:
-        print("Data file not found. Please make sure the path is correct.")
+        index = csvindex.CsvIndex.load(data_file, path)
+        if index.column == csvindex.DEFAULT_COLUMN and index.is_current():
+            return index
+    except (OSError, ValueError, KeyError) as e:
+        print(f"Ignoring unreadable index {path}: {e}", file=sys.stderr)
+    return None
+
+def crimes_by_area(data_file, areas, ranges=()):
+    # Each area once, in the order given
+    unique = {}
+    for area in areas:
+        unique.setdefault(area.strip().lower(), area)
+    areas = list(unique.values())
+
+    snap = snapshot.open_for(data_file) if snapshot is not None else None
+    if snap is not None:
+        results = from_snapshot(snap, areas, ranges)
+    else:
+        index = saved_index(data_file)
+        results = from_index(index, areas, ranges) if index is not None else from_csv(data_file, areas, ranges)
+
+    # One write instead of a print per crime
+    sections = []
+    for area in areas:
+        lines = [f"Crimes in area: {area}\n"]
+        lines.extend(f"- {date}: {description}" for date, description in results[area])
+        if not results[area]:
+            lines.append("No records found for that area.")
+        sections.append("\n".join(lines))
+    sys.stdout.write("\n\n".join(sections) + "\n")
 
 def main():
     parser = argparse.ArgumentParser(description="Query crimes by area name.")
     subparsers = parser.add_subparsers(dest="command")
 
-    area_parser = subparsers.add_parser("crimesbyareaname", help="Show all crimes in a given AREA NAME")
-    area_parser.add_argument("areaname", type=str, help="The AREA NAME to search for (e.g., Wilshire)")
+    area_parser = subparsers.add_parser("crimesbyareaname", help="Show all crimes in the given AREA NAMEs")
+    area_parser.add_argument("areaname", type=str, nargs="+", help="The AREA NAMEs to search for (e.g., Wilshire)")
+    area_parser.add_argument("--data", default=DATA_FILE, help="crime data CSV (default: crime-data.csv next to cli.py)")
+    area_parser.add_argument("--dates", type=parse_range, action="append", default=[], metavar="FROM..TO",
+                             help="only crimes that occurred in this range; may be given several times")
 
     args = parser.parse_args()
 
     if args.command == "crimesbyareaname":
-        crimes_by_area(args.areaname)
+        try:
+            crimes_by_area(args.data, args.areaname, args.dates)
+        except FileNotFoundError:
+            print("Data file not found. Please make sure the path is correct.")
     else:
         parser.print_help()
 
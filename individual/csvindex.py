@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+"""
+csvindex.py
+Author: Chloe Xufeng
+
+An index from the values of one column of a crime data CSV (AREA NAME by
+default) to the byte offset and length of each record that holds them, so
+the records of one area can be read by seeking straight to them instead of
+parsing the whole file.
+
+Values are matched stripped and lowercased, like the CSV scan in api.py.
+The index is saved next to the CSV (crime-data.csv -> crime-data.area-index.json)
+together with the CSV's size and modification time, and is rebuilt when
+the CSV changes:
+
+    python3 csvindex.py crime-data.csv
+"""
+
+import os
+import io
+import sys
+import csv
+import json
+import argparse
+
+FORMAT_VERSION = 1
+DEFAULT_COLUMN = 'AREA NAME'
+
+def default_path(csv_path):
+    '''Returns where the index of csv_path is saved: foo.csv -> foo.area-index.json'''
+    return os.path.splitext(csv_path)[0] + '.area-index.json'
+
+def source_stamp(csv_path):
+    stat = os.stat(csv_path)
+    return {"size": stat.st_size, "mtime": stat.st_mtime}
+
+def records(f):
+    '''
+    Yields (offset, bytes) for each record of the binary file f after its
+    header line. A record continues onto the next line while it has an odd
+    number of quote characters, i.e. a quoted field holds a line break.
+    '''
+    f.readline()
+    offset = f.tell()
+    record = b''
+    for line in f:
+        record += line
+        if record.count(b'"') % 2:
+            continue
+        if record.strip():
+            yield offset, record
+        offset += len(record)
+        record = b''
+    if record.strip():
+        yield offset, record
+
+def parse(record):
+    '''Returns the fields of one record (bytes)'''
+    text = record.decode('utf-8')
+    if '"' not in text:
+        return text.rstrip('\r\n').split(',')
+    return next(csv.reader(io.StringIO(text, newline='')))
+
+class CsvIndex:
+    '''The offsets of the records of a CSV file, by the value of one column'''
+
+    def __init__(self, csv_path, column, header, offsets, stamp):
+        self.csv_path = csv_path
+        self.column = column
+        self.header = header
+        # value -> [offset, length, offset, length, ...] in file order
+        self.offsets = offsets
+        self.stamp = stamp
+
+    @classmethod
+    def build(cls, csv_path, column=DEFAULT_COLUMN):
+        '''Indexes csv_path by reading it once'''
+        stamp = source_stamp(csv_path)
+        with open(csv_path, newline='', encoding='utf-8-sig') as f:
+            header = [name.strip() for name in next(csv.reader(f), [])]
+        position = header.index(column)
+        offsets = {}
+        with open(csv_path, 'rb') as f:
+            for offset, record in records(f):
+                fields = parse(record)
+                if position < len(fields):
+                    offsets.setdefault(fields[position].strip().lower(), []).extend((offset, len(record)))
+        return cls(csv_path, column, header, offsets, stamp)
+
+    @classmethod
+    def load(cls, csv_path, path):
+        with open(path, encoding='utf-8') as f:
+            saved = json.load(f)
+        if saved.get('version') != FORMAT_VERSION:
+            raise ValueError(f"{path}: unsupported index version {saved.get('version')}")
+        return cls(csv_path, saved['column'], saved['header'], saved['offsets'], saved['source'])
+
+    def save(self, path):
+        '''Writes the index to path, replacing it atomically'''
+        staging = f'{path}.tmp{os.getpid()}'
+        with open(staging, 'w', encoding='utf-8') as f:
+            json.dump({"version": FORMAT_VERSION, "column": self.column, "header": self.header,
+                       "source": self.stamp, "offsets": self.offsets}, f, separators=(',', ':'))
+        os.replace(staging, path)
+
+    def is_current(self):
+        '''Whether the CSV is unchanged since it was indexed'''
+        try:
+            return source_stamp(self.csv_path) == self.stamp
+        except OSError:
+            return False
+
+    def count(self, value):
+        return len(self.offsets.get(value.strip().lower(), ())) // 2
+
+    def rows(self, value, columns=None):
+        '''
+        Yields the records whose column matches value as dicts keyed by the
+        stripped header names, in file order, or as tuples of the given
+        columns. Adjacent records are read in one go, and all of them are
+        parsed in one pass.
+        '''
+        spans = self.offsets.get(value.strip().lower())
+        if not spans:
+            return
+        chunks = []
+        with open(self.csv_path, 'rb') as f:
+            start, end = spans[0], spans[0] + spans[1]
+            for i in range(2, len(spans) + 2, 2):
+                if i < len(spans) and spans[i] == end:
+                    end += spans[i + 1]
+                    continue
+                f.seek(start)
+                chunk = f.read(end - start)
+                chunks.append(chunk if chunk.endswith(b'\n') else chunk + b'\n')
+                if i < len(spans):
+                    start, end = spans[i], spans[i] + spans[i + 1]
+        text = b''.join(chunks).decode('utf-8')
+        reader = csv.reader(io.StringIO(text, newline=''))
+        if columns is None:
+            header = self.header
+            for row in reader:
+                yield dict(zip(header, row))
+        else:
+            positions = [self.header.index(column) for column in columns]
+            for row in reader:
+                yield tuple(row[i] for i in positions)
+
+def open_index(csv_path, column=DEFAULT_COLUMN):
+    '''
+    Returns the index of csv_path: the saved one if it is current, otherwise
+    a new one, which is saved for next time when the directory is writable.
+    '''
+    path = default_path(csv_path)
+    if os.path.exists(path):
+        try:
+            index = CsvIndex.load(csv_path, path)
+            if index.column == column and index.is_current():
+                return index
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Rebuilding unreadable index {path}: {e}", file=sys.stderr)
+    index = CsvIndex.build(csv_path, column)
+    try:
+        index.save(path)
+    except OSError as e:
+        print(f"Could not save index {path}: {e}", file=sys.stderr)
+    return index
+
+def main():
+    parser = argparse.ArgumentParser(description='Index a crime data CSV by area name.')
+    parser.add_argument('csv', help='crime data CSV with a header row')
+    parser.add_argument('--column', default=DEFAULT_COLUMN, help=f'column to index (default {DEFAULT_COLUMN})')
+    args = parser.parse_args()
+
+    index = open_index(args.csv, args.column)
+    print(f"Indexed {sum(len(spans) // 2 for spans in index.offsets.values())} rows "
+          f"({len(index.offsets)} values) in {default_path(args.csv)}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+"""
+snapshot.py
+Author: Chloe Xufeng, Owen Xu
+
+A columnar snapshot of the crime data: one NumPy .npy file per column plus a
+meta.json holding the dictionaries of the text columns. Opening a snapshot
+memory-maps the columns, so tools can use the whole dataset without parsing
+a CSV.
+
+Columns (one entry per crime, in source order):
+    date         int32   yyyymmdd of DATE OCC
+    month        int32   yyyymm of DATE OCC
+    age          int16   Vict Age, -1 when blank or not a number
+    area         uint16  code of AREA NAME
+    description  uint16  code of Crm Cd Desc
+    type         uint16  code of the crime category (see convert.py)
+    sex          uint8   code of Vict Sex
+The codes index the lists in meta.json's "dictionaries". DATE OCC's time of
+day, always 12:00:00 AM in LAPD exports, is not kept.
+
+Snapshots are written by convert.py --snapshot DIR, or from any source CSV
+(the five-column file convert.py reads, or a full LAPD export with a header):
+
+    python3 snapshot.py individual/crime-data.csv
+
+which writes individual/crime-data.snapshot/. Requires NumPy.
+"""
+
+import os
+import sys
+import csv
+import json
+import shutil
+import argparse
+from array import array
+from datetime import datetime
+
+import numpy as np
+
+import convert
+
+FORMAT_VERSION = 1
+
+# column -> (NumPy dtype, array typecode used while writing)
+COLUMNS = {
+    'date': ('int32', 'i'),
+    'month': ('int32', 'i'),
+    'age': ('int16', 'h'),
+    'area': ('uint16', 'H'),
+    'description': ('uint16', 'H'),
+    'type': ('uint16', 'H'),
+    'sex': ('uint8', 'B'),
+}
+DICTIONARY_COLUMNS = ['area', 'description', 'type', 'sex']
+
+# Source columns read from a full LAPD export, in convert.read_rows() order
+LAPD_COLUMNS = ['DATE OCC', 'AREA NAME', 'Crm Cd Desc', 'Vict Age', 'Vict Sex']
+
+def default_path(csv_path):
+    '''Returns where the snapshot of csv_path goes by default: foo.csv -> foo.snapshot'''
+    return os.path.splitext(csv_path)[0] + '.snapshot'
+
+class SnapshotWriter:
+    '''
+    Collects rows of (DATE OCC, AREA NAME, Crm Cd Desc, Vict Age, Vict Sex)
+    into compact column buffers, then saves them as a snapshot.
+    '''
+
+    def __init__(self):
+        self.columns = {name: array(typecode) for name, (_, typecode) in COLUMNS.items()}
+        self.codes = {name: {} for name in DICTIONARY_COLUMNS}
+        self._dates = {}  # 'MM/DD/YYYY' -> yyyymmdd
+
+    def _code(self, column, value):
+        codes = self.codes[column]
+        code = codes.get(value)
+        if code is None:
+            code = codes[value] = len(codes)
+        return code
+
+    def _date(self, date_occ):
+        date = self._dates.get(date_occ[:10])
+        if date is None:
+            dt = datetime.strptime(date_occ, "%m/%d/%Y %I:%M:%S %p")
+            date = self._dates[date_occ[:10]] = dt.year * 10000 + dt.month * 100 + dt.day
+        return date
+
+    def add(self, row):
+        date_occ, area, description, vict_age, vict_sex = row
+        date = self._date(date_occ)
+        self.columns['date'].append(date)
+        self.columns['month'].append(date // 100)
+        try:
+            age = int(vict_age)
+        except ValueError:
+            age = -1
+        self.columns['age'].append(age)
+        self.columns['area'].append(self._code('area', area))
+        self.columns['description'].append(self._code('description', description))
+        self.columns['type'].append(self._code('type', convert.convert_type(description)))
+        self.columns['sex'].append(self._code('sex', vict_sex))
+
+    def feed(self, rows):
+        '''Adds each row as it passes through, so the snapshot can be built alongside another pass'''
+        for row in rows:
+            self.add(row)
+            yield row
+
+    def save(self, path, source=None):
+        '''
+        Writes the snapshot to the directory path, replacing any snapshot
+        already there. source, if given, is the CSV it was built from; its
+        size and modification time are recorded so readers can spot a stale
+        snapshot.
+        '''
+        staging = f'{path}.tmp{os.getpid()}'
+        shutil.rmtree(staging, ignore_errors=True)
+        os.makedirs(staging)
+        for name, (dtype, _) in COLUMNS.items():
+            np.save(os.path.join(staging, name + '.npy'),
+                    np.frombuffer(self.columns[name], dtype=dtype))
+        meta = {
+            "version": FORMAT_VERSION,
+            "rows": len(self.columns['date']),
+            "columns": {name: dtype for name, (dtype, _) in COLUMNS.items()},
+            "dictionaries": {name: list(codes) for name, codes in self.codes.items()},
+        }
+        if source is not None:
+            stat = os.stat(source)
+            meta["source"] = {"path": os.path.abspath(source), "size": stat.st_size, "mtime": stat.st_mtime}
+        with open(os.path.join(staging, 'meta.json'), 'w', encoding='utf-8') as f:
+            json.dump(meta, f)
+
+        # Readers that already have the old snapshot mapped keep their files.
+        retired = f'{path}.old{os.getpid()}'
+        if os.path.exists(path):
+            os.rename(path, retired)
+        os.rename(staging, path)
+        shutil.rmtree(retired, ignore_errors=True)
+        return path
+
+class Snapshot:
+    '''A snapshot opened for reading. Columns are memory-mapped NumPy arrays.'''
+
+    def __init__(self, path, mmap=True):
+        self.path = path
+        with open(os.path.join(path, 'meta.json'), encoding='utf-8') as f:
+            self.meta = json.load(f)
+        if self.meta.get('version') != FORMAT_VERSION:
+            raise ValueError(f"{path}: unsupported snapshot version {self.meta.get('version')}")
+        self.dictionaries = self.meta['dictionaries']
+        self.columns = {name: np.load(os.path.join(path, name + '.npy'), mmap_mode='r' if mmap else None)
+                        for name in self.meta['columns']}
+        # column -> {stripped lowercased value: [codes]}
+        self._lookups = {}
+
+    def __len__(self):
+        return self.meta['rows']
+
+    def __getitem__(self, column):
+        return self.columns[column]
+
+    def is_current(self, source):
+        '''Whether the snapshot was built from source as it is now'''
+        recorded = self.meta.get('source')
+        if recorded is None:
+            return False
+        stat = os.stat(source)
+        return recorded['size'] == stat.st_size and recorded['mtime'] == stat.st_mtime
+
+    def codes(self, column, values):
+        '''Returns the codes of the given values of a dictionary column, ignoring case and surrounding spaces'''
+        lookup = self._lookups.get(column)
+        if lookup is None:
+            lookup = {}
+            for code, value in enumerate(self.dictionaries[column]):
+                lookup.setdefault(value.strip().lower(), []).append(code)
+            self._lookups[column] = lookup
+        return [code for value in values for code in lookup.get(value.strip().lower(), [])]
+
+    def mask(self, column, values):
+        '''Returns a boolean array selecting the rows whose column is one of values (see codes())'''
+        return np.isin(self.columns[column], self.codes(column, values))
+
+    def decode(self, column, codes):
+        '''Returns the values for codes of a dictionary column'''
+        dictionary = self.dictionaries[column]
+        return [dictionary[code] for code in codes]
+
+    def month_names(self, months):
+        '''Returns 'yyyy-mm' strings for yyyymm month values'''
+        return [f'{month // 100:04d}-{month % 100:02d}' for month in months]
+
+    def date_occ(self, dates):
+        '''Returns DATE OCC strings ('MM/DD/YYYY 12:00:00 AM') for yyyymmdd date values'''
+        return [f'{date // 100 % 100:02d}/{date % 100:02d}/{date // 10000:04d} 12:00:00 AM' for date in dates]
+
+def open_snapshot(path, mmap=True):
+    '''Opens the snapshot in directory path'''
+    return Snapshot(path, mmap=mmap)
+
+def open_for(csv_path):
+    '''
+    Returns the snapshot at default_path(csv_path) if there is one and it
+    was built from csv_path as it is now, or None.
+    '''
+    path = default_path(csv_path)
+    if not os.path.exists(os.path.join(path, 'meta.json')):
+        return None
+    try:
+        snapshot = Snapshot(path)
+        if snapshot.is_current(csv_path):
+            return snapshot
+    except (OSError, ValueError, KeyError) as e:
+        print(f"Ignoring unreadable snapshot {path}: {e}", file=sys.stderr)
+    return None
+
+def read_source(path):
+    '''
+    Yields (DATE OCC, AREA NAME, Crm Cd Desc, Vict Age, Vict Sex) rows from
+    either a full LAPD export, recognised by its header, or the five-column
+    file convert.py reads.
+    '''
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        header = [name.strip() for name in next(csv.reader(f), [])]
+    if 'DATE OCC' not in header:
+        yield from convert.read_rows(path)
+        return
+    indexes = [header.index(name) for name in LAPD_COLUMNS]
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        reader = csv.reader(f)
+        next(reader)
+        for row in reader:
+            yield [row[i] for i in indexes]
+
+def build(source, path=None):
+    '''Builds the snapshot of the CSV file source at path (default: default_path(source))'''
+    writer = SnapshotWriter()
+    for row in read_source(source):
+        writer.add(row)
+    return writer.save(path or default_path(source), source=source)
+
+def main():
+    parser = argparse.ArgumentParser(description='Build a columnar snapshot of a crime data CSV.')
+    parser.add_argument('source', help='CSV file: a full LAPD export or the input of convert.py')
+    parser.add_argument('output', nargs='?', help='snapshot directory (default: SOURCE without .csv, plus .snapshot)')
+    args = parser.parse_args()
+
+    path = build(args.source, args.output)
+    snapshot = open_snapshot(path)
+    print(f"Wrote {len(snapshot)} rows to {path}")
+
+if __name__ == '__main__':
+    main()
@@ -10,91 +10,197 @@ import argparse
 import flask
 import json
 import csv
+import base64
+import io
 import config
-import psycopg2
+import cache
+import backends
+import metrics
 from flask import request, Response
 import re
+from collections import namedtuple
+import compress
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 api = flask.Blueprint('api', __name__)
 
-def get_connection():
+def json_default(value):
+    '''Encodes what orjson leaves to us the way json.dumps does: tuple subclasses as lists'''
+    if isinstance(value, tuple):
+        return list(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+def dumps(value):
+    '''Returns value as JSON text, encoded by orjson when it is installed'''
+    if orjson is not None:
+        return orjson.dumps(value, default=json_default, option=orjson.OPT_NON_STR_KEYS).decode('utf-8')
+    return json.dumps(value)
+
+def to_json(value):
+    '''dumps(), timed as the serialize phase of the request (see metrics.py)'''
+    with metrics.phase('serialize'):
+        return dumps(value)
+
+# Large finished responses are compressed for clients that accept it
+api.after_request(compress.compress_response)
+
+def get_session():
     '''
-    Creates and returns a connection to the PostgreSQL database using config parameters.
-    Returns: psycopg2 connection object
+    Opens a session on the configured backend (see backends.py), or returns
+    the batch's shared session while /batch runs its sub-queries.
+    Returns: the session, or None if none could be opened
     '''
+    shared = flask.g.get('batch_session')
+    if shared is not None:
+        return shared
     try:
-        return psycopg2.connect(database=config.database,
-                               user=config.user,
-                               password=config.password)
+        with metrics.phase('connect'):
+            return backends.get_backend().session()
     except Exception as e:
         print(e, file=sys.stderr)
         return None
 
-@api.route('/areas')
-def get_areas():
-    '''Returns a list of all unique areas in the dataset'''
+def release_session(session):
+    '''Closes a session obtained from get_session(), returning its connection to the pool.'''
+    # Streamed responses release theirs after the app context has ended
+    if session is None or (flask.has_app_context() and session is flask.g.get('batch_session')):
+        return
     try:
-        connection = get_connection()
-        if not connection:
-            return json.dumps({"error": "Database connection failed"}), 500
-        
-        cursor = connection.cursor()
-        query = 'SELECT * FROM areas ORDER BY area ASC'
-        cursor.execute(query)
-        areas = [row[1] for row in cursor]
-        connection.close()
-        
-        if not areas:
-            return json.dumps({"error": "No areas found"}), 404
-            
-        return json.dumps(areas)
+        session.close()
     except Exception as e:
         print(e, file=sys.stderr)
-        return json.dumps({"error": "Internal server error"}), 500
+
+@api.route('/pool')
+def get_pool_stats():
+    '''Returns connection pool metrics (open, in use, waiting, checkout latency)'''
+    return to_json(backends.get_backend().stats())
+
+# /areas, /types and /dates rarely change, so their JSON is kept per process
+# for dimension_cache_ttl seconds (or until new data is loaded).
+dimension_cache = cache.TTLCache(getattr(config, 'dimension_cache_ttl', 300))
+cache.register(dimension_cache.clear)
+
+def conditional_response(entry):
+    '''
+    Builds a response for a cached body with ETag and Last-Modified headers,
+    answering 304 Not Modified when the browser's copy is still current.
+    '''
+    response = flask.make_response(entry.body)
+    response.set_etag(entry.etag)
+    response.last_modified = entry.last_modified
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+def get_dimension_list(dimension, not_found_message):
+    '''
+    Returns the response for a dimension list route: the sorted names in
+    dimension as a JSON list, served from dimension_cache when possible.
+    '''
+    entry = dimension_cache.get(dimension)
+    if entry is None:
+        try:
+            session = get_session()
+            if not session:
+                return to_json({"error": "Database connection failed"}), 500
+
+            values = session.dimension_values(dimension)
+            release_session(session)
+
+            if not values:
+                return to_json({"error": not_found_message}), 404
+
+            entry = dimension_cache.set(dimension, cache.make_cached_response(to_json(values)))
+        except Exception as e:
+            print(e, file=sys.stderr)
+            return to_json({"error": "Internal server error"}), 500
+    return conditional_response(entry)
+
+@api.route('/areas')
+def get_areas():
+    '''Returns a list of all unique areas in the dataset'''
+    return get_dimension_list('areas', "No areas found")
 
 @api.route('/types')
 def get_types():
     '''Returns a list of all crime types in the dataset'''
-    try:
-        connection = get_connection()
-        if not connection:
-            return json.dumps({"error": "Database connection failed"}), 500
-            
-        cursor = connection.cursor()
-        query = 'SELECT * FROM types ORDER BY type ASC'
-        cursor.execute(query)
-        types = [row[1] for row in cursor]
-        connection.close()
-        
-        if not types:
-            return json.dumps({"error": "No crime types found"}), 404
-            
-        return json.dumps(types)
-    except Exception as e:
-        print(e, file=sys.stderr)
-        return json.dumps({"error": "Internal server error"}), 500
+    return get_dimension_list('types', "No crime types found")
 
 @api.route('/dates')
 def get_months():
     '''Returns a sorted list of all months in the dataset'''
-    try:
-        connection = get_connection()
-        if not connection:
-            return json.dumps({"error": "Database connection failed"}), 500
-            
-        cursor = connection.cursor()
-        query = 'SELECT month FROM months ORDER BY month ASC'
-        cursor.execute(query)
-        months = [row[0] for row in cursor]
-        connection.close()
-        
-        if not months:
-            return json.dumps({"error": "No dates found"}), 404
-            
-        return json.dumps(months)
-    except Exception as e:
-        print(e, file=sys.stderr)
-        return json.dumps({"error": "Internal server error"}), 500
+    return get_dimension_list('months', "No dates found")
+
+# Rows fetched per round trip from the server-side cursor of a streamed
+# response; each batch becomes one chunk of the response.
+EXPORT_BATCH_ROWS = getattr(config, 'export_batch_rows', 10000)
+
+CSV_HEADER = ['month', 'area', 'type', 'victim_age', 'victim_sex']
+
+def stream_batches(session, batches, encode_batch, mimetype, headers=None, end=''):
+    '''
+    Returns a Response that streams the crime rows of batches (from a
+    session's export_batches()), each batch turned into text by
+    encode_batch(rows, first) and followed by end, so memory use does not
+    grow with the result. The body is compressed on the fly when the client
+    accepts brotli or gzip (see compress.py).
+
+    The Response takes over the session and closes it once sent.
+    '''
+    encoding = None
+    if getattr(config, 'export_gzip', True):
+        encoding = compress.choose_encoding(request.headers.get('Accept-Encoding'))
+
+    def generate():
+        compressor = compress.compressor(encoding) if encoding else None
+        first = True
+        for batch in batches:
+            with metrics.phase('serialize'):
+                chunk = encode_batch(batch, first).encode('utf-8')
+                first = False
+                if compressor:
+                    chunk = compressor.compress(chunk)
+            if chunk:
+                yield chunk
+        with metrics.phase('serialize'):
+            chunk = end.encode('utf-8')
+            if compressor:
+                chunk = compressor.compress(chunk) + compressor.flush()
+        if chunk:
+            yield chunk
+
+    headers = dict(headers or {})
+    headers["Vary"] = "Accept-Encoding"
+    if encoding:
+        headers["Content-Encoding"] = encoding
+    response = Response(generate(), mimetype=mimetype, headers=headers)
+    # Closed (which also drops any server-side cursor) once the body is sent or abandoned
+    session.detach()
+    response.call_on_close(lambda: release_session(session))
+    return response
+
+def encode_csv_batch(rows, first):
+    '''Formats a batch of crime rows as CSV, starting with the header row'''
+    output = io.StringIO()
+    writer = csv.writer(output)
+    if first:
+        writer.writerow(CSV_HEADER)
+    writer.writerows(row[:5] for row in rows)
+    return output.getvalue()
+
+def stream_csv_export(session, start, end, area_ids, type_ids, ordered):
+    '''
+    Streams the matching crimes as the crime_data.csv download (see
+    stream_batches). Returns None if nothing matches.
+    '''
+    batches = session.export_batches(start, end, area_ids, type_ids, ordered, EXPORT_BATCH_ROWS)
+    if batches is None:
+        return None
+    return stream_batches(session, batches, encode_csv_batch, 'text/csv',
+                          {"Content-Disposition": "attachment;filename=crime_data.csv"})
 
 @api.route('/rawcsv')
 def get_rawcsv():
@@ -102,271 +208,444 @@ def get_rawcsv():
     Generates and returns a CSV file containing all crime data.
     The CSV includes: date, area, type, victim age, and victim sex.
     '''
+    session = None
     try:
-        connection = get_connection()
-        if not connection:
-            return json.dumps({"error": "Database connection failed"}), 500
-            
-        cursor = connection.cursor()
-        query = '''
-            SELECT months.month, areas.area, types.type,
-                   crimes.vict_age, crimes.vict_sex
-            FROM crimes
-            JOIN crime_events ON crimes.id = crime_events.crime_id
-            JOIN types ON types.id = crime_events.type_id
-            JOIN months ON months.id = crime_events.month_id
-            JOIN areas ON areas.id = crime_events.area_id
-            ORDER BY months.month ASC;
-        '''
-        cursor.execute(query)
-        rows = cursor.fetchall()
-        
-        if not rows:
-            return json.dumps({"error": "No data found"}), 404
-            
+        session = get_session()
+        if not session:
+            return to_json({"error": "Database connection failed"}), 500
+
+        response = stream_csv_export(session, None, None, None, None, ordered=True)
+        if response is None:
+            return to_json({"error": "No data found"}), 404
+
+        # The response now owns the session and closes it when done.
+        session = None
+        return response
+
     except Exception as e:
         print(f"Error generating CSV: {e}", file=sys.stderr)
-        return json.dumps({"error": "Internal server error"}), 500
+        return to_json({"error": "Internal server error"}), 500
     finally:
-        if 'connection' in locals():
-            connection.close()
+        if session is not None:
+            release_session(session)
 
-    def generate():
-        output = csv.StringIO()
-        writer = csv.writer(output)
-        writer.writerow(['month', 'area', 'type', 'victim_age', 'victim_sex'])
-        yield output.getvalue()
-        output.seek(0)
-        output.truncate(0)
-
-        for row in rows:
-            writer.writerow(row)
-            yield output.getvalue()
-            output.seek(0)
-            output.truncate(0)
-
-    return Response(generate(), 
-                   mimetype='text/csv',
-                   headers={"Content-Disposition": "attachment;filename=crime_data.csv"})
 
-@api.route('/crimes')
-def get_crimes():
+# Largest page a /crimes?limit= request may ask for
+CRIMES_MAX_LIMIT = getattr(config, 'crimes_max_limit', 10000)
+
+def crime_record(row):
+    '''Converts a crime row (see backends.CRIMES_QUERY) to the dict /crimes returns for it'''
+    return {
+        "date": row[0],
+        "area": row[1],
+        "type": row[2],
+        "victim_age": row[3],
+        "victim_sex": row[4]
+    }
+
+def encode_ndjson_batch(rows, first):
+    '''Formats a batch of crime rows as newline-delimited JSON'''
+    return ''.join(dumps(crime_record(row)) + '\n' for row in rows)
+
+def encode_json_array_batch(rows, first):
+    '''Formats a batch of crime rows as part of one JSON array, opened by the first batch'''
+    return ('[' if first else ', ') + dumps([crime_record(row) for row in rows])[1:-1]
+
+def encode_page_token(month_id, event_id):
+    '''Returns the opaque /crimes "next" token for the position after an event'''
+    return base64.urlsafe_b64encode(json.dumps([month_id, event_id]).encode()).decode()
+
+def decode_page_token(token):
+    '''Returns the (month_id, event_id) in a "next" token; raises ValueError if it is invalid'''
+    try:
+        month_id, event_id = json.loads(base64.urlsafe_b64decode(token.encode()))
+    except Exception:
+        raise ValueError('invalid next token')
+    if not isinstance(month_id, int) or not isinstance(event_id, int):
+        raise ValueError('invalid next token')
+    return month_id, event_id
+
+def list_arg(args, *names):
+    '''Returns the values of the named query parameters, which may be repeated and comma-separated'''
+    return [value.strip() for name in names for param in args.getlist(name)
+            for value in param.split(',') if value.strip()]
+
+def parse_month_ranges(text):
     '''
-    Returns filtered crime data based on query parameters:
-    - start_month: Start of date range
-    - end_month: End of date range
-    - area: Specific area to filter by
-    - type: Specific crime type to filter by
+    Parses a /crimes months= value: comma-separated YYYY-MM..YYYY-MM ranges,
+    either end of which may be left out, or single YYYY-MM months. Returns
+    the ranges as (start, end) pairs (None for an open end), sorted and with
+    overlapping ranges merged; raises ValueError if a range is malformed.
+    '''
+    bounds = []
+    for item in text.split(','):
+        item = item.strip()
+        start, separator, end = item.partition('..')
+        if not separator:
+            end = start
+        for month in (start, end):
+            if month and not re.match(r'^\d{4}-(0[1-9]|1[0-2])$', month):
+                raise ValueError(f"Invalid month range '{item}'. Use YYYY-MM..YYYY-MM")
+        if start and end and start > end:
+            raise ValueError(f"Invalid month range '{item}': it ends before it starts")
+        # '' sorts before and '~' after every month
+        bounds.append((start or '', end or '~'))
+
+    merged = []
+    for start, end in sorted(bounds):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return [(start or None, None if end == '~' else end) for start, end in merged]
+
+def range_month_ids(session, ranges):
+    '''Returns the ids of the months in ranges (from parse_month_ranges), in month order'''
+    return [month_id for start, end in ranges for month_id in session.month_ids(start, end)]
+
+# A validated /crimes request (see parse_crimes_args)
+CrimesQuery = namedtuple('CrimesQuery', ['start', 'end', 'month_ranges', 'areas', 'types', 'group_by',
+                                         'paginate', 'limit', 'after', 'want_count', 'output_format'])
+
+def parse_crimes_args(args):
     '''
-    start_month = request.args.get('start_month', None)
-    end_month = request.args.get('end_month', None)
-    area = request.args.get('area', None)
-    crime_type = request.args.get('type', None)
+    Validates the query parameters of /crimes (see get_crimes).
+    Returns: a CrimesQuery; raises ValueError with the message for a 400 response
+    '''
+    start_month = args.get('start_month', None)
+    end_month = args.get('end_month', None)
+    months = args.get('months', None)
+    group_by = [column.lower() for column in list_arg(args, 'group_by')]
+    limit = args.get('limit', None)
+    next_token = args.get('next', None)
+    output_format = args.get('format', 'json').lower()
 
     date_pattern = r'^\d{4}-\d{2}$'
-    
+
     # Validate date format if provided
     if start_month and not re.match(date_pattern, start_month):
-        return json.dumps({"error": "Invalid start_month format. Use YYYY-MM"}), 400
+        raise ValueError("Invalid start_month format. Use YYYY-MM")
     if end_month and not re.match(date_pattern, end_month):
-        return json.dumps({"error": "Invalid end_month format. Use YYYY-MM"}), 400
+        raise ValueError("Invalid end_month format. Use YYYY-MM")
+    if output_format not in ('json', 'ndjson'):
+        raise ValueError("Invalid format. Use json or ndjson")
+
+    month_ranges = None
+    if months is not None:
+        if start_month or end_month:
+            raise ValueError("Use either months or start_month/end_month")
+        month_ranges = parse_month_ranges(months)
+
+    unknown = [column for column in group_by if column not in backends.GROUP_COLUMNS]
+    if unknown:
+        raise ValueError(f"Cannot group by {', '.join(unknown)}. "
+                         f"Use {', '.join(backends.GROUP_COLUMNS)}")
+    if group_by and (limit is not None or next_token is not None or output_format != 'json'):
+        raise ValueError("group_by cannot be combined with limit, next or format")
+
+    paginate = limit is not None or next_token is not None
+    after = None
+    if paginate:
+        try:
+            limit = int(limit) if limit is not None else CRIMES_MAX_LIMIT
+        except ValueError:
+            limit = 0
+        if not 1 <= limit <= CRIMES_MAX_LIMIT:
+            raise ValueError(f"limit must be between 1 and {CRIMES_MAX_LIMIT}")
+        after = decode_page_token(next_token) if next_token else None
+
+    return CrimesQuery(start_month, end_month, month_ranges,
+                       list_arg(args, 'area', 'areas'), list_arg(args, 'type', 'types'),
+                       # Each column once, in the order given
+                       list(dict.fromkeys(group_by)),
+                       paginate, limit, after,
+                       args.get('count', '').lower() in ('1', 'true', 'yes'), output_format)
+
+def grouped_counts_body(group_by, rows, want_count):
+    '''Returns the /crimes?group_by= JSON for a session's grouped_counts() rows'''
+    result = {"group_by": group_by,
+              "groups": [dict(zip(group_by + ["count"], row)) for row in rows]}
+    if want_count:
+        result["count"] = sum(row[-1] for row in rows)
+    return to_json(result)
 
+@api.route('/crimes')
+def get_crimes():
+    '''
+    Returns filtered crime data based on query parameters:
+    - start_month: Start of date range
+    - end_month: End of date range
+    - months: Several month ranges instead, e.g. 2024-06..2024-08,2025-01..2025-03
+    - area: Areas to filter by, comma-separated or repeated
+    - type: Crime types to filter by, comma-separated or repeated
+    - group_by: Return the number of matching crimes for each combination of
+      these columns (month, area, type, sex) instead of the crimes
+    - limit: Return one page of at most this many crimes, as
+      {"crimes": [...], "next": token}; pass the token as next= for the following page
+    - count: If true, include the total number of matching crimes ("count")
+      instead of, or alongside a page of, the crimes themselves
+    - format: "ndjson" streams every match as one JSON object per line
+    '''
+    try:
+        query = parse_crimes_args(request.args)
+    except ValueError as e:
+        return to_json({"error": str(e)}), 400
+    start_month, end_month = query.start, query.end
+    areas, types, group_by = query.areas, query.types, query.group_by
+    paginate, limit, after = query.paginate, query.limit, query.after
+    want_count, output_format = query.want_count, query.output_format
+
+    session = None
     try:
-        connection = get_connection()
-        if not connection:
-            return json.dumps({"error": "Database connection failed"}), 500
-            
-        cursor = connection.cursor()
-
-        query = '''
-            SELECT months.month, areas.area, types.type,
-                   crimes.vict_age, crimes.vict_sex
-            FROM crimes
-            JOIN crime_events ON crimes.id = crime_events.crime_id
-            JOIN types ON types.id = crime_events.type_id
-            JOIN months ON months.id = crime_events.month_id
-            JOIN areas ON areas.id = crime_events.area_id
-            WHERE (%s IS NULL OR months.month >= %s) 
-            AND (%s IS NULL OR months.month <= %s)
-        '''
-        params = [start_month, start_month, end_month, end_month]
-
-        if area:
-            query += ' AND LOWER(areas.area) = LOWER(%s)'
-            params.append(area)
-
-        if crime_type:
-            query += ' AND LOWER(types.type) = LOWER(%s)'
-            params.append(crime_type)
-
-        query += ' ORDER BY months.month ASC'
-        cursor.execute(query, params)
-        rows = cursor.fetchall()
-        if not rows:
-            return json.dumps({"message": "No records found for the given criteria"}), 404
-
-
-        crimes = []
-        for row in rows:
-            if len(row) == 5:
-                crimes.append({
-                    "date": row[0],
-                    "area": row[1],
-                    "type": row[2],
-                    "victim_age": row[3],
-                    "victim_sex": row[4]
-                })
-            else:
-                print(f"Unexpected row format: {row}", file=sys.stderr)
+        session = get_session()
+        if not session:
+            return to_json({"error": "Database connection failed"}), 500
+
+        area_ids = session.area_ids(areas) if areas else None
+        type_ids = session.type_ids(types) if types else None
+        month_ids = range_month_ids(session, query.month_ranges) if query.month_ranges is not None else None
+
+        if group_by:
+            rows = session.grouped_counts(group_by, start_month, end_month, area_ids, type_ids, month_ids)
+            return grouped_counts_body(group_by, rows, want_count)
+
+        if output_format == 'ndjson':
+            batches = session.export_batches(start_month, end_month, area_ids, type_ids,
+                                             True, EXPORT_BATCH_ROWS, month_ids)
+            if batches is None:
+                return to_json({"message": "No records found for the given criteria"}), 404
+            response = stream_batches(session, batches, encode_ndjson_batch, 'application/x-ndjson')
+            # The response now owns the session and closes it when done.
+            session = None
+            return response
+
+        result = {}
+        if want_count:
+            result["count"] = session.event_count(start_month, end_month, area_ids, type_ids, month_ids)
+            if not paginate:
+                return to_json(result)
+
+        if paginate:
+            if month_ids is None:
+                month_ids = session.month_ids(start_month, end_month)
+            if after is not None and after[0] not in month_ids:
+                return to_json({"error": "invalid next token"}), 400
+
+            rows, next_position = session.crimes_page(month_ids, area_ids, type_ids, after, limit)
+            result["crimes"] = [crime_record(row) for row in rows]
+            result["next"] = encode_page_token(*next_position) if next_position else None
+            return to_json(result)
+
+        batches = session.export_batches(start_month, end_month, area_ids, type_ids,
+                                         True, EXPORT_BATCH_ROWS, month_ids)
+        if batches is None:
+            return to_json({"message": "No records found for the given criteria"}), 404
+
+        if flask.g.get('batch_session') is None:
+            # Encoded and sent batch by batch instead of building the whole list first
+            response = stream_batches(session, batches, encode_json_array_batch, 'application/json', end=']')
+            session = None
+            return response
+
+        # Inside /batch the rows become part of the combined response
+        crimes = [crime_record(row) for batch in batches for row in batch]
 
     except Exception as e:
         print(f"Error retrieving crimes: {e}", file=sys.stderr)
-        return json.dumps({"error": "Internal server error"}), 500
+        return to_json({"error": "Internal server error"}), 500
     finally:
-        if 'connection' in locals():
-            connection.close()
+        if session is not None:
+            release_session(session)
 
-    return json.dumps(crimes)
+    return to_json(crimes)
 
 @api.route('/help')
 def get_help():
     return flask.render_template('help.html')
 
-@api.route('/charts/crimesOverTime')
-def crimes_over_time():
+# Chart responses keyed by their normalized filter. Bounded by entry count
+# and total size, least recently used first out, cleared on data reloads.
+chart_cache = cache.LRUCache(max_entries=getattr(config, 'chart_cache_entries', 512),
+                             max_bytes=getattr(config, 'chart_cache_bytes', 16 * 1024 * 1024))
+cache.register(chart_cache.clear)
+
+def chart_cache_key(route, start, end, areas, types):
     '''
-    Returns aggregated data for visualization based on selected filters
+    Returns the chart_cache key for a chart route's filter. Area and type
+    names (already lowercased) become sorted sets, so the same selection in
+    any order or with repeats maps to one entry.
     '''
-    start = request.args.get('start_month')
-    end = request.args.get('end_month')
-    areas = request.args.get('areas', '').split(',')
-    types = request.args.get('types', '').split(',')
+    return (route, start or None, end or None,
+            tuple(sorted(set(areas))), tuple(sorted(set(types))))
+
+@api.route('/metrics')
+def get_metrics():
+    '''Returns this process's request counters and timing histograms in the Prometheus text format'''
+    return Response(metrics.render(backends.get_backend().stats()),
+                    mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+@api.route('/cache')
+def get_cache_stats():
+    '''Returns the chart result cache's size and hit/miss/eviction counters'''
+    return to_json({"charts": chart_cache.stats()})
+
+def age_bucket_label(bucket):
+    '''Formats the lower bound of a 10-year age bucket, e.g. 30 -> "30-39"'''
+    return f"{bucket}-{bucket + 9}"
+
+def over_time_filter(args):
+    '''
+    Validates the query parameters of /charts/crimesOverTime.
+    Returns: (start, end, lowercased areas, lowercased types); raises
+    ValueError with the message for a 400 response
+    '''
+    start = args.get('start_month')
+    end = args.get('end_month')
+    areas = args.get('areas', '').split(',')
+    types = args.get('types', '').split(',')
 
     # Validate required parameters
     if not all([start, end, areas[0], types[0]]):
-        return json.dumps({
-            "error": "Missing required parameters. Required: start_month, end_month, areas, types"
-        }), 400
+        raise ValueError("Missing required parameters. Required: start_month, end_month, areas, types")
 
     # Validate date format
-    if not (start.match(r'^\d{4}-\d{2}$') and end.match(r'^\d{4}-\d{2}$')):
-        return json.dumps({
-            "error": "Invalid date format. Use YYYY-MM"
-        }), 400
+    if not (re.match(r'^\d{4}-\d{2}$', start) and re.match(r'^\d{4}-\d{2}$', end)):
+        raise ValueError("Invalid date format. Use YYYY-MM")
+
+    # Convert areas and types to lowercase for case-insensitive comparison
+    areas_lower = [area.lower() for area in areas if area]
+    types_lower = [type_.lower() for type_ in types if type_]
+
+    if not areas_lower or not types_lower:
+        raise ValueError("At least one area and one type must be selected")
+    return start, end, areas_lower, types_lower
 
+def over_time_body(month_totals, age_totals, sex_totals):
+    '''Returns the /charts/crimesOverTime JSON for a session's chart_counts(), or None if nothing matched'''
+    if not month_totals:
+        return None
+    month_counts = dict(sorted(month_totals.items()))
+    age_buckets = {age_bucket_label(bucket): count
+                   for bucket, count in sorted(age_totals.items())}
+    sex_counts = {'M': 0, 'F': 0, 'Unknown': 0}
+    for sex, count in sex_totals.items():
+        if sex in sex_counts:
+            sex_counts[sex] = count
+
+    return to_json({
+        "month_counts": month_counts,
+        "age_buckets": age_buckets,
+        "sex_counts": sex_counts
+    })
+
+@api.route('/charts/crimesOverTime')
+def crimes_over_time():
+    '''
+    Returns aggregated data for visualization based on selected filters
+    '''
     try:
-        conn = get_connection()
-        if not conn:
-            return json.dumps({"error": "Database connection failed"}), 500
+        start, end, areas_lower, types_lower = over_time_filter(request.args)
+    except ValueError as e:
+        return to_json({"error": str(e)}), 400
 
-        cur = conn.cursor()
+    key = chart_cache_key('crimesOverTime', start, end, areas_lower, types_lower)
+    body = chart_cache.get(key)
+    if body is not None:
+        return body
 
-        # Convert areas and types to lowercase for case-insensitive comparison
-        areas_lower = [area.lower() for area in areas if area]
-        types_lower = [type_.lower() for type_ in types if type_]
-        
-        if not areas_lower or not types_lower:
-            return json.dumps({
-                "error": "At least one area and one type must be selected"
-            }), 400
-
-        # Create the array literals for the SQL query
-        areas_array = "{" + ",".join(f'"{area}"' for area in areas_lower) + "}"
-        types_array = "{" + ",".join(f'"{type_}"' for type_ in types_lower) + "}"
-
-        query = '''
-            SELECT months.month, crimes.vict_age, crimes.vict_sex
-            FROM crimes
-            JOIN crime_events ON crimes.id = crime_events.crime_id
-            JOIN types ON types.id = crime_events.type_id
-            JOIN months ON months.id = crime_events.month_id
-            JOIN areas ON areas.id = crime_events.area_id
-            WHERE months.month BETWEEN %s AND %s
-            AND LOWER(areas.area) = ANY(%s)
-            AND LOWER(types.type) = ANY(%s)
-            ORDER BY months.month ASC;
-        '''
-        
-        cur.execute(query, (start, end, areas_array, types_array))
-        rows = cur.fetchall()
-
-        if not rows:
-            return json.dumps({"message": "No data found for the given criteria"}), 404
-
-        # Initialize data structures for aggregation
-        month_counts = {}
-        age_buckets = {}
-        sex_counts = {'M': 0, 'F': 0, 'Unknown': 0}
-
-        # Process the results
-        for row in rows:
-            month, age, sex = row
-            
-            # Count by month
-            month_counts[month] = month_counts.get(month, 0) + 1
-            
-            # Count by age bucket
-            if age and age > 0:
-                bucket = f"{(age // 10) * 10}-{(age // 10) * 10 + 9}"
-                age_buckets[bucket] = age_buckets.get(bucket, 0) + 1
-            
-            # Count by sex
-            if sex in sex_counts:
-                sex_counts[sex] += 1
-
-        return json.dumps({
-            "month_counts": month_counts,
-            "age_buckets": age_buckets,
-            "sex_counts": sex_counts
-        })
+    try:
+        session = get_session()
+        if not session:
+            return to_json({"error": "Database connection failed"}), 500
+
+        # Resolve the names to dimension ids once, instead of comparing names per row
+        area_ids = session.area_ids(areas_lower)
+        type_ids = session.type_ids(types_lower)
+
+        body = over_time_body(*session.chart_counts(start, end, area_ids, type_ids))
+        if body is None:
+            return to_json({"message": "No data found for the given criteria"}), 404
+
+        return chart_cache.set(key, body)
 
     except Exception as e:
         print(f"Error generating chart data: {e}", file=sys.stderr)
-        return json.dumps({"error": "Internal server error"}), 500
+        return to_json({"error": "Internal server error"}), 500
     finally:
-        if 'conn' in locals():
-            conn.close()
+        if 'session' in locals():
+            release_session(session)
+
+def victim_age_buckets(ages):
+    '''Counts victim ages by 10-year bucket, labelled like "30-39"'''
+    buckets = {}
+    for age in ages:
+        bin = (age // 10) * 10
+        label = f"{bin}-{bin+9}"
+        buckets[label] = buckets.get(label, 0) + 1
+    return buckets
 
 @api.route('/charts/victimAges')
 def victimAges():
     buckets = {}
     try:
-        conn = get_connection()
-        cur = conn.cursor()
-        query = '''
-            SELECT vict_age FROM crimes
-            WHERE vict_age IS NOT NULL AND vict_age > 0
-        '''
-        cur.execute(query)
-        for (age,) in cur.fetchall():
-            bin = (age // 10) * 10
-            label = f"{bin}-{bin+9}"
-            buckets[label] = buckets.get(label, 0) + 1
+        session = get_session()
+        buckets = victim_age_buckets(session.victim_ages())
     except Exception as e:
         print(e, file=sys.stderr)
     finally:
-        conn.close()
-    return json.dumps(buckets)
+        release_session(session)
+    return to_json(buckets)
 
 @api.route('/charts/victimSex')
 def victimSex():
     counts = {}
     try:
-        conn = get_connection()
-        cur = conn.cursor()
-        query = '''
-            SELECT vict_sex, COUNT(*) FROM crimes
-            WHERE vict_sex IS NOT NULL AND vict_sex != ''
-            GROUP BY vict_sex
-        '''
-        cur.execute(query)
-        for sex, count in cur.fetchall():
-            counts[sex] = count
+        session = get_session()
+        counts.update(session.victim_sex_counts())
     except Exception as e:
         print(e, file=sys.stderr)
     finally:
-        conn.close()
-    return json.dumps(counts)
+        release_session(session)
+    return to_json(counts)
+
+def filtered_chart_filter(args):
+    '''Returns the (start, end, lowercased areas, lowercased types) filter of /charts/filtered'''
+    areas = args.get('areas', '').split(',')
+    types = args.get('types', '').split(',')
+    # Convert areas and types to lowercase for case-insensitive comparison
+    areas_lower = [area.lower().lstrip() for area in areas if area]
+    types_lower = [type_.lower().lstrip() for type_ in types if type_]
+    return args.get('start_month'), args.get('end_month'), areas_lower, types_lower
+
+def filtered_chart_body(month_totals, age_totals, sex_totals):
+    '''Returns the /charts/filtered JSON for a session's chart_counts()'''
+    # Initialize counts for all possible months
+    counts_by_month = {
+        "2024-06": 0, "2024-07": 0, "2024-08": 0,
+        "2024-09": 0, "2024-10": 0, "2024-11": 0,
+        "2024-12": 0, "2025-01": 0, "2025-02": 0,
+        "2025-03": 0
+    }
+    for month, count in month_totals.items():
+        if month in counts_by_month:
+            counts_by_month[month] = count
+
+    sorted_age_buckets = {age_bucket_label(bucket): count
+                          for bucket, count in sorted(age_totals.items())}
+
+    # Keys come in sorted order (F, M, X, ...). Before the counts were
+    # aggregated they came in the order each sex first appeared in the scanned
+    # rows, which varied with the filter and so did the pie chart's colours.
+    sex_counts = {}
+    for sex, count in sorted(sex_totals.items(), key=lambda item: item[0] or ''):
+        if sex:
+            sex_counts[sex] = count
+
+    return to_json({
+        "month_counts": counts_by_month,
+        "age_buckets": sorted_age_buckets,
+        "sex_counts": sex_counts
+    })
 
 @api.route('/charts/filtered')
 def get_filtered_charts():
@@ -377,87 +656,31 @@ def get_filtered_charts():
     - Gender distribution
     Filters include: date range, areas, and crime types
     '''
-    start = request.args.get('start_month')
-    end = request.args.get('end_month')
-    areas = request.args.get('areas', '').split(',')
-    types = request.args.get('types', '').split(',')
+    start, end, areas_lower, types_lower = filtered_chart_filter(request.args)
+    if not areas_lower or not types_lower:
+        return filtered_chart_body({}, {}, {})
 
-    # Initialize counts for all possible months
-    counts_by_month = {
-        "2024-06": 0, "2024-07": 0, "2024-08": 0,
-        "2024-09": 0, "2024-10": 0, "2024-11": 0,
-        "2024-12": 0, "2025-01": 0, "2025-02": 0,
-        "2025-03": 0
-    }
-    age_buckets = {}
-    sex_counts = {}
+    key = chart_cache_key('filtered', start, end, areas_lower, types_lower)
+    body = chart_cache.get(key)
+    if body is not None:
+        return body
 
     try:
-        conn = get_connection()
-        cur = conn.cursor()
+        session = get_session()
 
-        # Convert areas and types to lowercase for case-insensitive comparison
-        areas_lower = [area.lower().lstrip() for area in areas if area]
-        types_lower = [type_.lower().lstrip() for type_ in types if type_]
-        
-        if not areas_lower or not types_lower:
-            return json.dumps({
-                "month_counts": counts_by_month,
-                "age_buckets": {},
-                "sex_counts": {}
-            })
-
-        # Create the array literals for the SQL query
-        areas_array = "{" + ",".join(f'"{area}"' for area in areas_lower) + "}"
-        types_array = "{" + ",".join(f'"{type_}"' for type_ in types_lower) + "}"
-
-        query = '''
-            SELECT months.month, crimes.vict_age, crimes.vict_sex
-            FROM crimes
-            JOIN crime_events ON crimes.id = crime_events.crime_id
-            JOIN months ON crime_events.month_id = months.id
-            JOIN areas ON crime_events.area_id = areas.id
-            JOIN types ON crime_events.type_id = types.id
-            WHERE (months.month >= %s OR %s IS NULL)
-              AND (months.month <= %s OR %s IS NULL)
-              AND LOWER(areas.area) = ANY(%s::text[])
-              AND LOWER(types.type) = ANY(%s::text[])
-        '''
-        
-        params = [start, start, end, end, areas_array, types_array]
-        
-        cur.execute(query, params)
-
-        for month, age, sex in cur.fetchall():
-            # Month count
-            if month in counts_by_month:
-                counts_by_month[month] += 1
-
-            # Age bucket
-            if age is not None and isinstance(age, (int, float)) and age > 0:
-                bucket = f"{(int(age)//10)*10}-{(int(age)//10)*10+9}"
-                age_buckets[bucket] = age_buckets.get(bucket, 0) + 1
-
-            # Sex count
-            if sex:
-                sex_counts[sex] = sex_counts.get(sex, 0) + 1
-
-        # Sort age buckets by age range
-        sorted_age_buckets = dict(sorted(age_buckets.items(), 
-                                       key=lambda x: int(x[0].split('-')[0])))
+        # Resolve the names to dimension ids once, instead of comparing names per row
+        area_ids = session.area_ids(areas_lower)
+        type_ids = session.type_ids(types_lower)
 
+        body = filtered_chart_body(*session.chart_counts(start, end, area_ids, type_ids))
 
     except Exception as e:
         print(f"Error in filtered chart API: {e}", file=sys.stderr)
-        return json.dumps({"error": str(e)}), 500
+        return to_json({"error": str(e)}), 500
     finally:
-        conn.close()
+        release_session(session)
 
-    return json.dumps({
-        "month_counts": counts_by_month,
-        "age_buckets": sorted_age_buckets,
-        "sex_counts": sex_counts
-    })
+    return chart_cache.set(key, body)
 
 
 
@@ -472,62 +695,128 @@ def get_filteredcsv():
     areas = request.args.get('areas', '').split(',')
     types = request.args.get('types', '').split(',')
     crimes = []
+    session = None
     try:
-        connection = get_connection()
-        if not connection:
-            return json.dumps({"error": "Database connection failed"}), 500
+        session = get_session()
+        if not session:
+            return to_json({"error": "Database connection failed"}), 500
         
         areas_lower = [area.lower().lstrip() for area in areas if area]
         types_lower = [type_.lower().lstrip() for type_ in types if type_]
         if not areas_lower or not types_lower:
-            return json.dumps(crimes)
+            return to_json(crimes)
         
-        areas_array = "{" + ",".join(f'"{area}"' for area in areas_lower) + "}"
-        types_array = "{" + ",".join(f'"{type_}"' for type_ in types_lower) + "}"
-
-        cursor = connection.cursor()
-        query = '''
-            SELECT months.month, areas.area, types.type,
-                   crimes.vict_age, crimes.vict_sex
-            FROM crimes
-            JOIN crime_events ON crimes.id = crime_events.crime_id
-            JOIN types ON types.id = crime_events.type_id
-            JOIN months ON months.id = crime_events.month_id
-            JOIN areas ON areas.id = crime_events.area_id
-            WHERE (months.month >= %s OR %s IS NULL)
-              AND (months.month <= %s OR %s IS NULL)
-              AND LOWER(areas.area) = ANY(%s::text[])
-              AND LOWER(types.type) = ANY(%s::text[])
-        '''
-        params = [start, start, end, end, areas_array, types_array]
-
-        cursor.execute(query, params)
-        rows = cursor.fetchall()
-        
-        if not rows:
-            return json.dumps({"error": "No data found"}), 404
-            
+        area_ids = session.area_ids(areas_lower)
+        type_ids = session.type_ids(types_lower)
+
+        response = stream_csv_export(session, start, end, area_ids, type_ids, ordered=False)
+        if response is None:
+            return to_json({"error": "No data found"}), 404
+
+        # The response now owns the session and closes it when done.
+        session = None
+        return response
+
     except Exception as e:
         print(f"Error generating CSV: {e}", file=sys.stderr)
-        return json.dumps({"error": "Internal server error"}), 500
+        return to_json({"error": "Internal server error"}), 500
+    finally:
+        if session is not None:
+            release_session(session)
+
+# Routes /batch can run, by their path under /api. Streamed downloads are
+# left out, since their bodies outlive the sub-query.
+BATCH_ROUTES = {
+    'areas': get_areas,
+    'types': get_types,
+    'dates': get_months,
+    'crimes': get_crimes,
+    'charts/crimesOverTime': crimes_over_time,
+    'charts/filtered': get_filtered_charts,
+    'charts/victimAges': victimAges,
+    'charts/victimSex': victimSex,
+}
+
+# Most sub-queries one /batch request may contain
+BATCH_MAX_QUERIES = getattr(config, 'batch_max_queries', 32)
+
+def run_sub_query(path, params):
+    '''
+    Runs the view for path with params as its query string, in a request
+    context of its own; returns (status, JSON body or text).
+    '''
+    view = BATCH_ROUTES[path]
+    with flask.current_app.test_request_context('/api/' + path, query_string=params):
+        response = flask.current_app.make_response(view())
+    body = response.get_data(as_text=True)
+    try:
+        return response.status_code, json.loads(body)
+    except ValueError:
+        return response.status_code, body
+
+def parse_batch(payload):
+    '''
+    Validates a /batch request body (see run_batch).
+    Returns: [(id, path, params)]; raises ValueError with the message for a 400 response
+    '''
+    queries = payload.get('queries') if isinstance(payload, dict) else None
+    if not isinstance(queries, list) or not queries:
+        raise ValueError('Expected a JSON body like {"queries": [{"path": "types"}, ...]}')
+    if len(queries) > BATCH_MAX_QUERIES:
+        raise ValueError(f"At most {BATCH_MAX_QUERIES} queries per batch")
+
+    parsed = []
+    for query in queries:
+        if not isinstance(query, dict):
+            raise ValueError("Each query must be an object with a path")
+        path = str(query.get('path', '')).strip('/')
+        if path.startswith('api/'):
+            path = path[len('api/'):]
+        params = query.get('params') or {}
+        query_id = str(query.get('id', path))
+        if path not in BATCH_ROUTES:
+            raise ValueError(f"Unsupported path '{path}'. Use one of: {', '.join(BATCH_ROUTES)}")
+        if not isinstance(params, dict):
+            raise ValueError(f"params of '{query_id}' must be an object")
+        if str(params.get('format', 'json')).lower() != 'json':
+            raise ValueError(f"'{query_id}': only JSON responses can be batched")
+        if any(query_id == other for other, _, _ in parsed):
+            raise ValueError(f"Duplicate query id '{query_id}'")
+        parsed.append((query_id, path, params))
+    return parsed
+
+@api.route('/batch', methods=['POST'])
+def run_batch():
+    '''
+    Runs several GET routes in one request, on one backend session:
+        {"queries": [{"id": "types", "path": "types"},
+                     {"id": "west", "path": "charts/filtered",
+                      "params": {"areas": "West LA", "types": "theft", ...}}]}
+    Each query names a route under /api (see BATCH_ROUTES) and optionally its
+    query parameters and an id, which defaults to the path. Returns
+    {"results": {id: {"status": code, "body": response}}}, in query order.
+    '''
+    try:
+        parsed = parse_batch(request.get_json(silent=True))
+    except ValueError as e:
+        return to_json({"error": str(e)}), 400
+
+    session = get_session()
+    if not session:
+        return to_json({"error": "Database connection failed"}), 500
+    flask.g.batch_session = session
+    results = {}
+    try:
+        for query_id, path, params in parsed:
+            status, body = run_sub_query(path, params)
+            # A failed query must not leave the others on an aborted transaction
+            session.recover()
+            results[query_id] = {"status": status, "body": body}
+    except Exception as e:
+        print(f"Error running batch: {e}", file=sys.stderr)
+        return to_json({"error": "Internal server error"}), 500
     finally:
-        if 'connection' in locals():
-            connection.close()
+        flask.g.batch_session = None
+        release_session(session)
 
-    def generate():
-        output = csv.StringIO()
-        writer = csv.writer(output)
-        writer.writerow(['month', 'area', 'type', 'victim_age', 'victim_sex'])
-        yield output.getvalue()
-        output.seek(0)
-        output.truncate(0)
-
-        for row in rows:
-            writer.writerow(row)
-            yield output.getvalue()
-            output.seek(0)
-            output.truncate(0)
-
-    return Response(generate(), 
-                   mimetype='text/csv',
-                   headers={"Content-Disposition": "attachment;filename=crime_data.csv"})
+    return to_json({"results": results})
@@ -8,9 +8,17 @@
 import argparse
 import flask
 import api
+import pool
+import cache
+import metrics
+import profiling
 
 app = flask.Flask(__name__, static_folder='static', template_folder='templates')
 app.register_blueprint(api.api, url_prefix='/api')
+pool.init_app(app)
+cache.init_app(app)
+metrics.init_app(app)
+profiling.init_app(app)
 
 # Define the home route, which serves the index.html template
 @app.route('/')
@@ -0,0 +1,619 @@
+#!/usr/bin/env python3
+'''
+    asgi.py
+    Owen Xu, Chloe Xufeng
+
+    The web app as an ASGI application, so a few worker processes can serve
+    many concurrent requests; run it from this directory with
+
+        uvicorn asgi:app --host localhost --port 5000 --workers 4
+
+    It serves the same pages and /api routes as app.py, with the same
+    parameters and response bodies: requests are validated and responses
+    built by the functions in api.py, and the SQL comes from the query
+    builders in backends.py. With the postgres backend the queries run on
+    psycopg 3 async connections from an AsyncConnectionPool, so a request
+    waiting on the database (or a client slowly reading a CSV export) does
+    not hold up the others. The memory backend answers in the event loop.
+
+    Requires starlette, uvicorn and psycopg[pool] (psycopg 3) in addition
+    to the Flask app's packages. The pool reads pool_min_size,
+    pool_max_size, pool_timeout and pool_health_check from config.py.
+
+    /api requests are timed by phase as in app.py (see metrics.py) and
+    served at /api/metrics; each worker process reports its own.
+'''
+import os
+import sys
+import json
+import time
+import contextlib
+from email.utils import formatdate
+from urllib.parse import urlencode
+
+import psycopg
+from psycopg_pool import AsyncConnectionPool
+from starlette.applications import Starlette
+from starlette.datastructures import QueryParams
+from starlette.responses import Response, StreamingResponse, FileResponse
+from starlette.middleware import Middleware
+from starlette.routing import Route, Mount
+from starlette.staticfiles import StaticFiles
+
+import config
+import cache
+import backends
+import dimensions
+import api
+import compress
+import metrics
+
+WEBAPP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+class AsyncPostgresSession:
+    '''
+    The async counterpart of backends.PostgresSession, on one pooled
+    psycopg 3 connection. Connections are in autocommit mode and bind
+    parameters client-side, as psycopg2 does, so the builders' SQL runs
+    unchanged.
+    '''
+
+    def __init__(self, connection, release):
+        self.connection = connection
+        self._release = release
+
+    async def close(self):
+        if self.connection is not None:
+            connection, self.connection = self.connection, None
+            await self._release(connection)
+
+    async def recover(self):
+        if self.connection.info.transaction_status == psycopg.pq.TransactionStatus.INERROR:
+            await self.connection.rollback()
+
+    async def _fetchall(self, query, params=None):
+        with metrics.phase('execute'):
+            cursor = await self.connection.execute(query, params)
+        with metrics.phase('fetch'):
+            rows = await cursor.fetchall()
+        metrics.add_rows(len(rows))
+        return rows
+
+    async def dimension_values(self, dimension):
+        return [row[0] for row in await self._fetchall(backends.DIMENSION_QUERIES[dimension])]
+
+    async def _dimension_ids(self, table, names):
+        lookup = dimensions.loaded_map(table, names)
+        if lookup is None:
+            lookup = dimensions.store_map(table, await self._fetchall(dimensions.map_query(table)))
+        return dimensions.lookup_ids(lookup, names)
+
+    async def area_ids(self, names):
+        return await self._dimension_ids('areas', names)
+
+    async def type_ids(self, names):
+        return await self._dimension_ids('types', names)
+
+    async def month_ids(self, start, end):
+        return [row[0] for row in await self._fetchall(*backends.month_ids_query(start, end))]
+
+    async def crimes(self, start, end, area_ids=None, type_ids=None, month_ids=None):
+        return await self._fetchall(*backends.crimes_query(start, end, area_ids, type_ids, True, month_ids))
+
+    async def crimes_page(self, month_ids, area_ids, type_ids, after, limit):
+        '''See backends.PostgresSession.crimes_page'''
+        if after is None:
+            position, last_id = 0, 0
+        else:
+            position, last_id = month_ids.index(after[0]), after[1]
+
+        rows = []
+        for month_id in month_ids[position:]:
+            page = await self._fetchall(*backends.crimes_page_query(month_id, last_id, area_ids, type_ids,
+                                                                     limit + 1 - len(rows)))
+            rows.extend((month_id, row) for row in page)
+            if len(rows) > limit:
+                break
+            last_id = 0
+
+        next_position = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            month_id, row = rows[-1]
+            next_position = (month_id, row[5])
+        return [row for _, row in rows], next_position
+
+    async def export_batches(self, start, end, area_ids, type_ids, ordered, batch_rows, month_ids=None):
+        '''
+        Yields the matching crime rows in lists of up to batch_rows, read
+        from a server-side cursor inside a transaction.
+        '''
+        query, params = backends.crimes_query(start, end, area_ids, type_ids, ordered, month_ids)
+        # Server-side cursors bind parameters on the server; render them here instead.
+        query = psycopg.ClientCursor(self.connection).mogrify(query, params)
+        async with self.connection.transaction():
+            async with self.connection.cursor(name='streamed_query') as cursor:
+                with metrics.phase('execute'):
+                    await cursor.execute(query)
+                while True:
+                    with metrics.phase('fetch'):
+                        batch = await cursor.fetchmany(batch_rows)
+                    if not batch:
+                        break
+                    metrics.add_rows(len(batch))
+                    yield batch
+
+    async def _run_on_rollup(self, build_query, *args):
+        '''See backends.PostgresSession._run_on_rollup; shares its availability flag'''
+        if getattr(config, 'use_rollup', True):
+            if backends._rollup_available is None:
+                rows = await self._fetchall("SELECT to_regclass('crime_rollup') IS NOT NULL")
+                backends._rollup_available = rows[0][0]
+            if backends._rollup_available:
+                try:
+                    return await self._fetchall(*build_query(backends.ROLLUP_CHART_SOURCE, *args))
+                except psycopg.Error as e:
+                    print(f"Chart rollup unavailable, using crime_events: {e}", file=sys.stderr)
+                    backends._rollup_available = False
+        return await self._fetchall(*build_query(backends.EVENTS_CHART_SOURCE, *args))
+
+    async def chart_counts(self, start, end, area_ids, type_ids):
+        rows = await self._run_on_rollup(backends.chart_counts_query, start, end, area_ids, type_ids)
+        return backends.chart_counts_from_rows(rows)
+
+    async def event_count(self, start, end, area_ids=None, type_ids=None, month_ids=None):
+        rows = await self._run_on_rollup(backends.event_count_query, start, end, area_ids, type_ids, month_ids)
+        return rows[0][0]
+
+    async def grouped_counts(self, group_by, start, end, area_ids=None, type_ids=None, month_ids=None):
+        return await self._run_on_rollup(backends.grouped_counts_query, group_by, start, end,
+                                         area_ids, type_ids, month_ids)
+
+    async def victim_ages(self):
+        return [age for (age,) in await self._fetchall(backends.VICTIM_AGES_QUERY)]
+
+    async def victim_sex_counts(self):
+        return dict(await self._fetchall(backends.VICTIM_SEX_QUERY))
+
+class AsyncPostgresBackend:
+    '''Sessions on an AsyncConnectionPool, opened when the app starts'''
+    name = 'postgres'
+
+    def __init__(self):
+        check = AsyncConnectionPool.check_connection if getattr(config, 'pool_health_check', True) else None
+        self.pool = AsyncConnectionPool(
+            kwargs={"dbname": config.database, "user": config.user, "password": config.password,
+                    "autocommit": True, "client_encoding": 'utf8',
+                    "cursor_factory": psycopg.AsyncClientCursor},
+            min_size=getattr(config, 'pool_min_size', 1),
+            max_size=getattr(config, 'pool_max_size', 10),
+            timeout=getattr(config, 'pool_timeout', 5.0),
+            check=check,
+            open=False)
+
+    async def start(self):
+        await self.pool.open()
+
+    async def stop(self):
+        await self.pool.close()
+
+    async def session(self):
+        return AsyncPostgresSession(await self.pool.getconn(), self.pool.putconn)
+
+    def stats(self):
+        return self.pool.get_stats()
+
+class AsyncMemorySession:
+    '''Gives a backends.MemorySession the async session interface; its work never blocks on I/O'''
+
+    def __init__(self, session):
+        self._session = session
+
+    def __getattr__(self, name):
+        method = getattr(self._session, name)
+
+        async def call(*args):
+            return method(*args)
+        return call
+
+    async def export_batches(self, *args):
+        for batch in self._session.export_batches(*args) or ():
+            yield batch
+
+class AsyncMemoryBackend:
+    name = 'memory'
+
+    def __init__(self):
+        self.backend = backends.get_backend()
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    async def session(self):
+        return AsyncMemorySession(self.backend.session())
+
+    def stats(self):
+        return self.backend.stats()
+
+class RequestSession:
+    '''
+    Opens a session on first use and closes it when the request is done,
+    unless a streamed response has taken it over.
+    '''
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.session = None
+
+    async def get(self):
+        if self.session is None:
+            with metrics.phase('connect'):
+                self.session = await self.backend.session()
+        return self.session
+
+    def hand_over(self):
+        '''Returns the session for a streamed response to close'''
+        session, self.session = self.session, None
+        return session
+
+    async def close(self):
+        if self.session is not None:
+            session, self.session = self.session, None
+            await session.close()
+
+def json_response(body, status=200):
+    return Response(body, status_code=status, media_type='application/json')
+
+def error_response(message, status):
+    return json_response(api.to_json({"error": message}), status)
+
+async def stream_batches(request, session, first, batches, encode_batch, media_type, headers=None, end=''):
+    '''
+    Streams the crime rows of the first batch and the rest of batches (an
+    async iterator) followed by end, compressed when the client accepts
+    brotli or gzip, then closes session (see api.stream_batches).
+    '''
+    encoding = None
+    if getattr(config, 'export_gzip', True):
+        encoding = compress.choose_encoding(request.headers.get('accept-encoding'))
+
+    async def generate():
+        try:
+            compressor = compress.compressor(encoding) if encoding else None
+            batch, is_first = first, True
+            while batch is not None:
+                with metrics.phase('serialize'):
+                    chunk = encode_batch(batch, is_first).encode('utf-8')
+                    is_first = False
+                    if compressor:
+                        chunk = compressor.compress(chunk)
+                if chunk:
+                    yield chunk
+                batch = await anext(batches, None)
+            with metrics.phase('serialize'):
+                chunk = end.encode('utf-8')
+                if compressor:
+                    chunk = compressor.compress(chunk) + compressor.flush()
+            if chunk:
+                yield chunk
+        finally:
+            await batches.aclose()
+            await session.close()
+
+    headers = dict(headers or {})
+    headers["Vary"] = "Accept-Encoding"
+    if encoding:
+        headers["Content-Encoding"] = encoding
+    return StreamingResponse(generate(), media_type=media_type, headers=headers)
+
+async def streamed_export(request, sessions, batches, encode_batch, media_type, headers=None, end=''):
+    '''Returns the streamed response for batches, or None if they are empty'''
+    first = await anext(batches, None)
+    if first is None:
+        await batches.aclose()
+        return None
+    return await stream_batches(request, sessions.hand_over(), first, batches,
+                                encode_batch, media_type, headers, end)
+
+def compress_response(request, response):
+    '''Compresses a finished response as compress.compress_response does for the Flask app'''
+    if (isinstance(response, (StreamingResponse, FileResponse)) or 'content-encoding' in response.headers
+            or not compress.should_compress(response.status_code, response.media_type, len(response.body))):
+        return response
+    response.headers['Vary'] = 'Accept-Encoding'
+    encoding = compress.choose_encoding(request.headers.get('accept-encoding'))
+    if encoding is None:
+        return response
+    with metrics.phase('serialize'):
+        response.body = compress.compress(response.body, encoding)
+    response.headers['Content-Length'] = str(len(response.body))
+    response.headers['Content-Encoding'] = encoding
+    etag = response.headers.get('etag')
+    if etag and not etag.startswith('W/'):
+        response.headers['ETag'] = 'W/' + etag
+    return response
+
+# -- Routes, each taking the request's query parameters and RequestSession --
+
+async def dimension_list(request, sessions, dimension, not_found_message):
+    entry = api.dimension_cache.get(dimension)
+    if entry is None:
+        values = await (await sessions.get()).dimension_values(dimension)
+        if not values:
+            return error_response(not_found_message, 404)
+        entry = api.dimension_cache.set(dimension, cache.make_cached_response(api.to_json(values)))
+
+    etag = f'"{entry.etag}"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache",
+               "Last-Modified": formatdate(entry.last_modified, usegmt=True)}
+    if request is not None and etag in request.headers.get('if-none-match', ''):
+        return Response(status_code=304, headers=headers)
+    return Response(entry.body, media_type='application/json', headers=headers)
+
+async def get_areas(request, params, sessions):
+    return await dimension_list(request, sessions, 'areas', "No areas found")
+
+async def get_types(request, params, sessions):
+    return await dimension_list(request, sessions, 'types', "No crime types found")
+
+async def get_months(request, params, sessions):
+    return await dimension_list(request, sessions, 'months', "No dates found")
+
+async def get_crimes(request, params, sessions):
+    try:
+        query = api.parse_crimes_args(params)
+    except ValueError as e:
+        return error_response(str(e), 400)
+
+    session = await sessions.get()
+    area_ids = await session.area_ids(query.areas) if query.areas else None
+    type_ids = await session.type_ids(query.types) if query.types else None
+    month_ids = None
+    if query.month_ranges is not None:
+        month_ids = [month_id for start, end in query.month_ranges
+                     for month_id in await session.month_ids(start, end)]
+    start, end = query.start, query.end
+
+    if query.group_by:
+        rows = await session.grouped_counts(query.group_by, start, end, area_ids, type_ids, month_ids)
+        return json_response(api.grouped_counts_body(query.group_by, rows, query.want_count))
+
+    if query.output_format == 'ndjson':
+        batches = session.export_batches(start, end, area_ids, type_ids, True, api.EXPORT_BATCH_ROWS, month_ids)
+        response = await streamed_export(request, sessions, batches, api.encode_ndjson_batch,
+                                         'application/x-ndjson')
+        if response is None:
+            return json_response(api.to_json({"message": "No records found for the given criteria"}), 404)
+        return response
+
+    result = {}
+    if query.want_count:
+        result["count"] = await session.event_count(start, end, area_ids, type_ids, month_ids)
+        if not query.paginate:
+            return json_response(api.to_json(result))
+
+    if query.paginate:
+        if month_ids is None:
+            month_ids = await session.month_ids(start, end)
+        if query.after is not None and query.after[0] not in month_ids:
+            return error_response("invalid next token", 400)
+        rows, next_position = await session.crimes_page(month_ids, area_ids, type_ids, query.after, query.limit)
+        result["crimes"] = [api.crime_record(row) for row in rows]
+        result["next"] = api.encode_page_token(*next_position) if next_position else None
+        return json_response(api.to_json(result))
+
+    batches = session.export_batches(start, end, area_ids, type_ids, True, api.EXPORT_BATCH_ROWS, month_ids)
+    if request is not None:
+        # Encoded and sent batch by batch instead of building the whole list first
+        response = await streamed_export(request, sessions, batches, api.encode_json_array_batch,
+                                         'application/json', end=']')
+        return response or json_response(api.to_json({"message": "No records found for the given criteria"}), 404)
+    # Inside /batch the rows become part of the combined response
+    crimes = [api.crime_record(row) async for batch in batches for row in batch]
+    if not crimes:
+        return json_response(api.to_json({"message": "No records found for the given criteria"}), 404)
+    return json_response(api.to_json(crimes))
+
+async def crimes_over_time(request, params, sessions):
+    try:
+        start, end, areas, types = api.over_time_filter(params)
+    except ValueError as e:
+        return error_response(str(e), 400)
+
+    key = api.chart_cache_key('crimesOverTime', start, end, areas, types)
+    body = api.chart_cache.get(key)
+    if body is None:
+        session = await sessions.get()
+        totals = await session.chart_counts(start, end, await session.area_ids(areas), await session.type_ids(types))
+        body = api.over_time_body(*totals)
+        if body is None:
+            return json_response(api.to_json({"message": "No data found for the given criteria"}), 404)
+        api.chart_cache.set(key, body)
+    return json_response(body)
+
+async def get_filtered_charts(request, params, sessions):
+    start, end, areas, types = api.filtered_chart_filter(params)
+    if not areas or not types:
+        return json_response(api.filtered_chart_body({}, {}, {}))
+
+    key = api.chart_cache_key('filtered', start, end, areas, types)
+    body = api.chart_cache.get(key)
+    if body is None:
+        session = await sessions.get()
+        totals = await session.chart_counts(start, end, await session.area_ids(areas), await session.type_ids(types))
+        body = api.chart_cache.set(key, api.filtered_chart_body(*totals))
+    return json_response(body)
+
+async def victim_ages(request, params, sessions):
+    session = await sessions.get()
+    return json_response(api.to_json(api.victim_age_buckets(await session.victim_ages())))
+
+async def victim_sex(request, params, sessions):
+    session = await sessions.get()
+    return json_response(api.to_json(await session.victim_sex_counts()))
+
+async def get_rawcsv(request, params, sessions):
+    session = await sessions.get()
+    batches = session.export_batches(None, None, None, None, True, api.EXPORT_BATCH_ROWS)
+    response = await streamed_export(request, sessions, batches, api.encode_csv_batch, 'text/csv',
+                                     {"Content-Disposition": "attachment;filename=crime_data.csv"})
+    return response or error_response("No data found", 404)
+
+async def get_filteredcsv(request, params, sessions):
+    start, end, areas, types = api.filtered_chart_filter(params)
+    if not areas or not types:
+        return json_response(api.to_json([]))
+    session = await sessions.get()
+    batches = session.export_batches(start, end, await session.area_ids(areas), await session.type_ids(types),
+                                     False, api.EXPORT_BATCH_ROWS)
+    response = await streamed_export(request, sessions, batches, api.encode_csv_batch, 'text/csv',
+                                     {"Content-Disposition": "attachment;filename=crime_data.csv"})
+    return response or error_response("No data found", 404)
+
+# The routes /batch can run, as in api.BATCH_ROUTES
+BATCH_ROUTES = {
+    'areas': get_areas,
+    'types': get_types,
+    'dates': get_months,
+    'crimes': get_crimes,
+    'charts/crimesOverTime': crimes_over_time,
+    'charts/filtered': get_filtered_charts,
+    'charts/victimAges': victim_ages,
+    'charts/victimSex': victim_sex,
+}
+
+async def run_batch(request, params, sessions):
+    try:
+        payload = await request.json()
+    except ValueError:
+        payload = None
+    try:
+        parsed = api.parse_batch(payload)
+    except ValueError as e:
+        return error_response(str(e), 400)
+
+    results = {}
+    for query_id, path, query_params in parsed:
+        try:
+            response = await BATCH_ROUTES[path](None, QueryParams(urlencode(query_params, doseq=True)), sessions)
+        except Exception as e:
+            print(f"Error running batch query {query_id}: {e}", file=sys.stderr)
+            response = error_response("Internal server error", 500)
+        if sessions.session is not None:
+            await sessions.session.recover()
+        body = response.body.decode('utf-8')
+        try:
+            body = json.loads(body)
+        except ValueError:
+            pass
+        results[query_id] = {"status": response.status_code, "body": body}
+    return json_response(api.to_json({"results": results}))
+
+def api_route(handler):
+    '''
+    Wraps a route handler: gives it the query parameters and a
+    RequestSession, which is closed afterwards, and turns errors into 500s.
+    '''
+    async def endpoint(request):
+        sessions = RequestSession(request.app.state.backend)
+        try:
+            return compress_response(request, await handler(request, request.query_params, sessions))
+        except Exception as e:
+            print(f"Error handling {request.url.path}: {e}", file=sys.stderr)
+            return error_response("Internal server error", 500)
+        finally:
+            await sessions.close()
+    return endpoint
+
+async def get_pool_stats(request):
+    return json_response(api.to_json(request.app.state.backend.stats()))
+
+async def get_metrics(request):
+    return Response(metrics.render(request.app.state.backend.stats()),
+                    media_type='text/plain; version=0.0.4; charset=utf-8')
+
+async def get_cache_stats(request):
+    return json_response(api.to_json({"charts": api.chart_cache.stats()}))
+
+async def home(request):
+    return FileResponse(os.path.join(WEBAPP_DIR, 'templates', 'index.html'))
+
+async def get_help(request):
+    return FileResponse(os.path.join(WEBAPP_DIR, 'templates', 'help.html'))
+
+class RequestMetrics:
+    '''
+    ASGI middleware timing the /api requests as metrics.init_app does for
+    the Flask app: the request is recorded once its last body chunk has
+    been sent, and the time spent sending belongs to no phase.
+    '''
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if (scope['type'] != 'http' or not scope['path'].startswith('/api/')
+                or not getattr(config, 'request_metrics', True)):
+            await self.app(scope, receive, send)
+            return
+        query = scope['query_string'].decode('latin-1')
+        timer = metrics.start(scope['path'], scope['method'], scope['path'] + ('?' + query if query else ''))
+
+        async def timed_send(message):
+            if message['type'] == 'http.response.start':
+                timer.status = message['status']
+            elif message['type'] == 'http.response.body':
+                timer.bytes += len(message.get('body', b''))
+            paused = time.perf_counter()
+            await send(message)
+            timer.sending += time.perf_counter() - paused
+
+        try:
+            await self.app(scope, receive, timed_send)
+        finally:
+            # The router adds the endpoint to the scope when a route matched
+            if 'endpoint' not in scope:
+                timer.route = 'unmatched'
+            timer.status = timer.status or 500
+            metrics.finish(timer)
+
+def create_backend():
+    '''The async backend for config.backend (see backends.get_backend)'''
+    if backends.uses_database():
+        return AsyncPostgresBackend()
+    return AsyncMemoryBackend()
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    app.state.backend = create_backend()
+    await app.state.backend.start()
+    cache.start_reload_listener()
+    try:
+        yield
+    finally:
+        await app.state.backend.stop()
+
+routes = [
+    Route('/', home),
+    Route('/api/help', get_help),
+    Route('/api/pool', get_pool_stats),
+    Route('/api/cache', get_cache_stats),
+    Route('/api/metrics', get_metrics),
+    Route('/api/areas', api_route(get_areas)),
+    Route('/api/types', api_route(get_types)),
+    Route('/api/dates', api_route(get_months)),
+    Route('/api/crimes', api_route(get_crimes)),
+    Route('/api/rawcsv', api_route(get_rawcsv)),
+    Route('/api/filteredcsv', api_route(get_filteredcsv)),
+    Route('/api/charts/crimesOverTime', api_route(crimes_over_time)),
+    Route('/api/charts/filtered', api_route(get_filtered_charts)),
+    Route('/api/charts/victimAges', api_route(victim_ages)),
+    Route('/api/charts/victimSex', api_route(victim_sex)),
+    Route('/api/batch', api_route(run_batch), methods=['POST']),
+    Mount('/static', StaticFiles(directory=os.path.join(WEBAPP_DIR, 'static')), name='static'),
+]
+
+app = Starlette(routes=routes, lifespan=lifespan, middleware=[Middleware(RequestMetrics)])
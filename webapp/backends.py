@@ -0,0 +1,721 @@
+#!/usr/bin/env python3
+'''
+    backends.py
+    Owen Xu, Chloe Xufeng
+
+    The data sources the API routes query. A backend hands out sessions, and
+    a session answers the routes' questions (dimension lists, filtered crime
+    rows, chart aggregates, exports) in plain Python values, so the routes do
+    not depend on where the data lives.
+
+    PostgresBackend runs SQL on pooled connections; the SQL comes from the
+    query builder functions below, which only build strings and parameters.
+    MemoryBackend loads a columnar snapshot (see snapshot.py) into NumPy
+    arrays and answers with boolean masks and bincount, without a database.
+
+    Settings in config.py (all optional):
+        backend                  'postgres' (default) or 'memory'
+        memory_snapshot          snapshot directory for the memory backend
+                                 (default data/2024&2025data.snapshot)
+        memory_reload_interval   seconds between checks for a rebuilt
+                                 snapshot (default 10)
+'''
+import os
+import sys
+import time
+import bisect
+import threading
+
+import psycopg2
+import config
+import metrics
+import pool
+import dimensions
+import cache
+
+DIMENSION_QUERIES = {
+    'areas': 'SELECT area FROM areas ORDER BY area ASC',
+    'types': 'SELECT type FROM types ORDER BY type ASC',
+    'months': 'SELECT month FROM months ORDER BY month ASC',
+}
+
+# Rows are (month, area, type, vict_age, vict_sex); crimes_page_query()
+# adds the event id, which only exists once data/crime-events-keys.sql ran
+CRIMES_QUERY = '''
+    SELECT months.month, areas.area, types.type,
+           crimes.vict_age, crimes.vict_sex{extra_columns}
+    FROM crimes
+    JOIN crime_events ON crimes.id = crime_events.crime_id
+    JOIN types ON types.id = crime_events.type_id
+    JOIN months ON months.id = crime_events.month_id
+    JOIN areas ON areas.id = crime_events.area_id
+'''
+
+# Row sources for the chart and count queries: the precomputed rollup from
+# data/rollup.sql when it is installed, otherwise the raw event tables.
+# Each yields (month, age_bucket, vict_sex, event_count, area_id, type_id)
+# rows, with the fact table aliased as facts for filtering on its ids.
+ROLLUP_CHART_SOURCE = '''
+    SELECT months.month, facts.age_bucket, facts.vict_sex, facts.event_count,
+           facts.area_id, facts.type_id
+    FROM crime_rollup AS facts
+    JOIN months ON facts.month_id = months.id
+'''
+
+EVENTS_CHART_SOURCE = '''
+    SELECT months.month,
+           CASE WHEN crimes.vict_age > 0
+                THEN crimes.vict_age / 10 * 10 END AS age_bucket,
+           crimes.vict_sex, 1 AS event_count, facts.area_id, facts.type_id
+    FROM crime_events AS facts
+    JOIN crimes ON crimes.id = facts.crime_id
+    JOIN months ON facts.month_id = months.id
+'''
+
+VICTIM_AGES_QUERY = '''
+    SELECT vict_age FROM crimes
+    WHERE vict_age IS NOT NULL AND vict_age > 0
+'''
+
+VICTIM_SEX_QUERY = '''
+    SELECT vict_sex, COUNT(*) FROM crimes
+    WHERE vict_sex IS NOT NULL AND vict_sex != ''
+    GROUP BY vict_sex
+'''
+
+# Columns /crimes?group_by= can group on, as named in grouped_counts_query()
+GROUP_COLUMNS = {
+    'month': 'matching.month',
+    'area': 'areas.area',
+    'type': 'types.type',
+    'sex': 'matching.vict_sex',
+}
+
+def id_conditions(table, area_ids, type_ids, month_ids=None):
+    '''
+    Returns SQL (starting with AND) and parameters restricting table's
+    area_id, type_id and month_id to the given ids; None leaves a column
+    unrestricted.
+    '''
+    conditions = ''
+    params = []
+    if month_ids is not None:
+        conditions += f' AND {table}.month_id = ANY(%s)'
+        params.append(month_ids)
+    if area_ids is not None:
+        conditions += f' AND {table}.area_id = ANY(%s)'
+        params.append(area_ids)
+    if type_ids is not None:
+        conditions += f' AND {table}.type_id = ANY(%s)'
+        params.append(type_ids)
+    return conditions, params
+
+def crimes_query(start, end, area_ids=None, type_ids=None, ordered=True, month_ids=None):
+    '''Returns the query and parameters for the crimes in a month range, optionally in month order'''
+    conditions, params = id_conditions('crime_events', area_ids, type_ids, month_ids)
+    query = CRIMES_QUERY.format(extra_columns='') + '''
+        WHERE (%s IS NULL OR months.month >= %s)
+          AND (%s IS NULL OR months.month <= %s)
+    ''' + conditions
+    if ordered:
+        query += ' ORDER BY months.month ASC'
+    return query, [start, start, end, end] + params
+
+def month_ids_query(start, end):
+    '''Returns the query and parameters for the ids of the months in a range, in month order'''
+    return '''
+        SELECT id FROM months
+        WHERE (%s IS NULL OR month >= %s) AND (%s IS NULL OR month <= %s)
+        ORDER BY month ASC
+    ''', [start, start, end, end]
+
+def crimes_page_query(month_id, last_id, area_ids, type_ids, limit):
+    '''
+    Returns the query and parameters for up to limit crimes of one month with
+    event ids above last_id, in id order. It is answered with an index range
+    scan on (month_id, id), so deep pages cost the same as the first.
+    '''
+    conditions, params = id_conditions('crime_events', area_ids, type_ids)
+    query = CRIMES_QUERY.format(extra_columns=', crime_events.id') + '''
+        WHERE crime_events.month_id = %s AND crime_events.id > %s
+    ''' + conditions + '''
+        ORDER BY crime_events.id
+        LIMIT %s
+    '''
+    return query, [month_id, last_id] + params + [limit]
+
+def chart_counts_query(source, start, end, area_ids, type_ids):
+    '''
+    Returns the query and parameters counting the matching events by month,
+    by age bucket and by victim sex in one pass, as
+    (month, age_bucket, vict_sex, GROUPING bits, count) rows.
+    '''
+    query = '''
+        SELECT month, age_bucket, vict_sex,
+               GROUPING(month, age_bucket, vict_sex), SUM(event_count)::bigint
+        FROM ({source}
+            WHERE (months.month >= %s OR %s IS NULL)
+              AND (months.month <= %s OR %s IS NULL)
+              AND facts.area_id = ANY(%s)
+              AND facts.type_id = ANY(%s)
+        ) AS matching
+        GROUP BY GROUPING SETS ((month), (age_bucket), (vict_sex))
+    '''.format(source=source)
+    return query, [start, start, end, end, area_ids, type_ids]
+
+def event_count_query(source, start, end, area_ids=None, type_ids=None, month_ids=None):
+    '''Returns the query and parameters for the number of matching events'''
+    conditions, params = id_conditions('facts', area_ids, type_ids, month_ids)
+    query = '''
+        SELECT COALESCE(SUM(event_count), 0)::bigint
+        FROM ({source}
+            JOIN areas ON facts.area_id = areas.id
+            JOIN types ON facts.type_id = types.id
+            WHERE (months.month >= %s OR %s IS NULL)
+              AND (months.month <= %s OR %s IS NULL)
+              {conditions}
+        ) AS matching
+    '''.format(source=source, conditions=conditions)
+    return query, [start, start, end, end] + params
+
+def grouped_counts_query(source, group_by, start, end, area_ids=None, type_ids=None, month_ids=None):
+    '''
+    Returns the query and parameters counting the matching events for each
+    combination of the group_by columns (keys of GROUP_COLUMNS), as rows of
+    the column values followed by the count, sorted by the column values.
+    '''
+    conditions, params = id_conditions('facts', area_ids, type_ids, month_ids)
+    columns = ', '.join(GROUP_COLUMNS[column] for column in group_by)
+    query = '''
+        SELECT {columns}, SUM(matching.event_count)::bigint
+        FROM ({source}
+            WHERE (months.month >= %s OR %s IS NULL)
+              AND (months.month <= %s OR %s IS NULL)
+              {conditions}
+        ) AS matching
+        JOIN areas ON matching.area_id = areas.id
+        JOIN types ON matching.type_id = types.id
+        GROUP BY {columns}
+        ORDER BY {columns}
+    '''.format(source=source, columns=columns, conditions=conditions)
+    return query, [start, start, end, end] + params
+
+def chart_counts_from_rows(rows):
+    '''
+    Splits the rows of chart_counts_query() into (month_counts, age_counts,
+    sex_counts); age_counts is keyed by the bucket's lower bound and leaves
+    out ages of 0 or less.
+    '''
+    month_counts = {}
+    age_counts = {}
+    sex_counts = {}
+    # GROUPING() sets one bit per column that is rolled up in that row:
+    # 0b011 is a per-month total, 0b101 per age bucket and 0b110 per sex.
+    for month, bucket, sex, grouping, count in rows:
+        if grouping == 0b011:
+            month_counts[month] = count
+        elif grouping == 0b101:
+            if bucket is not None:
+                age_counts[bucket] = count
+        elif grouping == 0b110:
+            sex_counts[sex] = count
+    return month_counts, age_counts, sex_counts
+
+cache.register(dimensions.invalidate)
+
+_rollup_available = None
+
+@cache.register
+def forget_rollup_available():
+    '''Rechecks for the rollup table after new data is loaded'''
+    global _rollup_available
+    _rollup_available = None
+
+class PostgresSession:
+    '''Answers queries on one connection checked out of the pool.'''
+
+    def __init__(self, connection, release):
+        self.connection = connection
+        self._release = release
+        self._cursor = None
+
+    @property
+    def cursor(self):
+        if self._cursor is None:
+            self._cursor = self.connection.cursor(cursor_factory=metrics.TimedCursor)
+        return self._cursor
+
+    def close(self):
+        '''Returns the connection to the pool'''
+        if self.connection is not None:
+            connection, self.connection = self.connection, None
+            self._release(connection)
+
+    def detach(self):
+        '''Lets the session outlive the request, for streamed responses; close() must still be called'''
+        pool.detach(self.connection)
+
+    def recover(self):
+        '''Rolls back a transaction a failed query left aborted, so the session can be reused'''
+        if self.connection.info.transaction_status == psycopg2.extensions.TRANSACTION_STATUS_INERROR:
+            self.connection.rollback()
+
+    def dimension_values(self, dimension):
+        '''Returns the sorted names in a dimension: 'areas', 'types' or 'months\''''
+        self.cursor.execute(DIMENSION_QUERIES[dimension])
+        return [row[0] for row in self.cursor]
+
+    def area_ids(self, names):
+        return dimensions.area_ids(self.cursor, names)
+
+    def type_ids(self, names):
+        return dimensions.type_ids(self.cursor, names)
+
+    def month_ids(self, start, end):
+        self.cursor.execute(*month_ids_query(start, end))
+        return [row[0] for row in self.cursor.fetchall()]
+
+    def crimes(self, start, end, area_ids=None, type_ids=None, month_ids=None):
+        '''Returns the matching crime rows (see CRIMES_QUERY) in month order'''
+        self.cursor.execute(*crimes_query(start, end, area_ids, type_ids, True, month_ids))
+        return self.cursor.fetchall()
+
+    def crimes_page(self, month_ids, area_ids, type_ids, after, limit):
+        '''
+        Returns up to limit crime rows in month order, and within a month in
+        event id order, that come after the (month_id, event_id) position
+        `after` (None for the first page), plus the position to continue
+        from, or None on the last page.
+        '''
+        if after is None:
+            position, last_id = 0, 0
+        else:
+            position, last_id = month_ids.index(after[0]), after[1]
+
+        # Read one row past the page to learn whether another page follows.
+        rows = []
+        for month_id in month_ids[position:]:
+            self.cursor.execute(*crimes_page_query(month_id, last_id, area_ids, type_ids,
+                                                   limit + 1 - len(rows)))
+            rows.extend((month_id, row) for row in self.cursor.fetchall())
+            if len(rows) > limit:
+                break
+            last_id = 0
+
+        next_position = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            month_id, row = rows[-1]
+            next_position = (month_id, row[5])
+        return [row for _, row in rows], next_position
+
+    def export_batches(self, start, end, area_ids, type_ids, ordered, batch_rows, month_ids=None):
+        '''
+        Returns an iterator over the matching crime rows in lists of up to
+        batch_rows, read from a server-side cursor, or None if nothing matches.
+        '''
+        cursor = self.connection.cursor(name='streamed_query', cursor_factory=metrics.TimedCursor)
+        cursor.execute(*crimes_query(start, end, area_ids, type_ids, ordered, month_ids))
+        rows = cursor.fetchmany(batch_rows)
+        if not rows:
+            cursor.close()
+            return None
+
+        def batches():
+            batch = rows
+            while batch:
+                yield batch
+                batch = cursor.fetchmany(batch_rows)
+            cursor.close()
+        return batches()
+
+    def _rollup_available(self):
+        '''
+        Returns whether the crime_rollup table can serve chart queries. Set
+        use_rollup = False in config.py to always query the event tables.
+        '''
+        global _rollup_available
+        if not getattr(config, 'use_rollup', True):
+            return False
+        if _rollup_available is None:
+            self.cursor.execute("SELECT to_regclass('crime_rollup') IS NOT NULL")
+            _rollup_available = self.cursor.fetchone()[0]
+        return _rollup_available
+
+    def _run_on_rollup(self, build_query, *args):
+        '''
+        Runs the query build_query(source, *args) returns against the rollup
+        when it is available, falling back to the event tables.
+        '''
+        global _rollup_available
+        if self._rollup_available():
+            try:
+                self.cursor.execute(*build_query(ROLLUP_CHART_SOURCE, *args))
+                return self.cursor.fetchall()
+            except psycopg2.Error as e:
+                print(f"Chart rollup unavailable, using crime_events: {e}", file=sys.stderr)
+                self.connection.rollback()
+                _rollup_available = False
+        self.cursor.execute(*build_query(EVENTS_CHART_SOURCE, *args))
+        return self.cursor.fetchall()
+
+    def chart_counts(self, start, end, area_ids, type_ids):
+        '''
+        Counts the crime events matching the chart filters by month, by
+        10-year victim age bucket and by victim sex (see chart_counts_from_rows).
+        '''
+        rows = self._run_on_rollup(chart_counts_query, start, end, area_ids, type_ids)
+        return chart_counts_from_rows(rows)
+
+    def event_count(self, start, end, area_ids=None, type_ids=None, month_ids=None):
+        '''
+        Returns the number of crime events in the month range whose area,
+        type and month are among area_ids, type_ids and month_ids (None means any)
+        '''
+        return self._run_on_rollup(event_count_query, start, end, area_ids, type_ids, month_ids)[0][0]
+
+    def grouped_counts(self, group_by, start, end, area_ids=None, type_ids=None, month_ids=None):
+        '''Returns the matching event counts by the group_by columns (see grouped_counts_query)'''
+        return self._run_on_rollup(grouped_counts_query, group_by, start, end,
+                                   area_ids, type_ids, month_ids)
+
+    def victim_ages(self):
+        '''Returns the ages (above 0) of the distinct victims'''
+        self.cursor.execute(VICTIM_AGES_QUERY)
+        return [age for (age,) in self.cursor.fetchall()]
+
+    def victim_sex_counts(self):
+        '''Returns the number of distinct victims of each (non-empty) sex'''
+        self.cursor.execute(VICTIM_SEX_QUERY)
+        return dict(self.cursor.fetchall())
+
+class PostgresBackend:
+    '''
+    Sessions on connections from the webapp's pool, or from connection_pool
+    (a pool.ConnectionPool) when one is given, e.g. outside Flask.
+    '''
+    name = 'postgres'
+
+    def __init__(self, connection_pool=None):
+        self.connection_pool = connection_pool
+
+    def session(self):
+        if self.connection_pool is None:
+            return PostgresSession(pool.checkout(), pool.release)
+        return PostgresSession(self.connection_pool.getconn(), self.connection_pool.putconn)
+
+    def stats(self):
+        return (self.connection_pool or pool.get_pool()).stats()
+
+REPO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+DEFAULT_SNAPSHOT = os.path.join(REPO_DIR, 'data', '2024&2025data.snapshot')
+
+class MemoryData:
+    '''
+    The columns of a snapshot in memory, with the derived columns and
+    indexes the memory backend filters and counts on. With use_bitmaps,
+    filters and counts are answered from bitmap indexes of the area, type,
+    month, sex and age bucket columns (see bitmaps.py).
+    '''
+
+    def __init__(self, path, use_bitmaps=True):
+        import numpy as np
+        if REPO_DIR not in sys.path:
+            sys.path.append(REPO_DIR)
+        import snapshot
+
+        self.np = np
+        self.snapshot = snapshot.open_snapshot(path, mmap=False)
+        dictionaries = self.snapshot.dictionaries
+        self.rows = len(self.snapshot)
+
+        self.area = self.snapshot['area']
+        self.type = self.snapshot['type']
+        self.sex = self.snapshot['sex']
+        self.area_names = np.array(dictionaries['area'], dtype=object)
+        self.type_names = np.array(dictionaries['type'], dtype=object)
+        self.sex_names = np.array(dictionaries['sex'], dtype=object)
+
+        # Months as codes into the sorted 'yyyy-mm' names
+        month_values, month = np.unique(self.snapshot['month'], return_inverse=True)
+        self.month = month.astype(np.uint16)
+        self.month_names = self.snapshot.month_names(month_values.tolist())
+        self.month_name_array = np.array(self.month_names, dtype=object)
+
+        # Ages: None for blanks, and the 10-year bucket (-1 for ages of 0 or less)
+        age = self.snapshot['age']
+        self.age_values = np.where(age >= 0, age, None).astype(object)
+        self.age_bucket = np.where(age > 0, age // 10, -1).astype(np.int16)
+        self.bucket_count = int(self.age_bucket.max()) + 1 if self.rows else 0
+
+        # Row numbers grouped by month, ascending within each month; event ids are row + 1
+        self.by_month = np.argsort(self.month, kind='stable')
+        self.month_starts = np.searchsorted(self.month[self.by_month],
+                                            np.arange(len(self.month_names) + 1))
+
+        # Distinct (age, sex) victims, as the crimes table holds them
+        victims = np.unique(age.astype(np.int32) * 256 + self.sex)
+        self.victim_ages = victims // 256
+        self.victim_sexes = victims % 256
+
+        self.bitmaps = None
+        if use_bitmaps:
+            import bitmaps
+            self.bitmaps = bitmaps.BitmapIndex(self.rows, {
+                'area': (self.area, len(self.area_names)),
+                'type': (self.type, len(self.type_names)),
+                'month': (self.month, len(self.month_names)),
+                'sex': (self.sex, len(self.sex_names)),
+                'age_bucket': (self.age_bucket, self.bucket_count),
+            })
+
+    def codes(self, column, names):
+        return self.snapshot.codes(column, names)
+
+    def member_mask(self, column, codes, size):
+        '''Returns a boolean array selecting the rows whose column code is one of codes'''
+        lookup = self.np.zeros(size, dtype=bool)
+        lookup[list(codes)] = True
+        return lookup[column]
+
+    def month_code_range(self, start, end):
+        '''Returns the range of month codes from start to end ('yyyy-mm', None for open)'''
+        low = 0 if start is None else bisect.bisect_left(self.month_names, start)
+        high = len(self.month_names) if end is None else bisect.bisect_right(self.month_names, end)
+        return range(low, high)
+
+    def mask(self, start, end, area_ids, type_ids, month_ids=None):
+        '''Returns a boolean array selecting the rows matching a filter (None ids mean any)'''
+        np = self.np
+        mask = np.ones(self.rows, dtype=bool)
+        months = self.month_code_range(start, end)
+        if months.start > 0 or months.stop < len(self.month_names):
+            mask &= (self.month >= months.start) & (self.month < months.stop)
+        if month_ids is not None:
+            mask &= self.member_mask(self.month, month_ids, len(self.month_names))
+        if area_ids is not None:
+            mask &= self.member_mask(self.area, area_ids, len(self.area_names))
+        if type_ids is not None:
+            mask &= self.member_mask(self.type, type_ids, len(self.type_names))
+        return mask
+
+    def select(self, start, end, area_ids, type_ids, month_ids=None):
+        '''Returns the bitmap of the rows matching a filter, or None when it matches every row'''
+        months = self.month_code_range(start, end)
+        if month_ids is not None:
+            months = [month for month in month_ids if month in months]
+        elif months.start == 0 and months.stop == len(self.month_names):
+            months = None
+        return self.bitmaps.select({'month': months, 'area': area_ids, 'type': type_ids})
+
+    def matching_rows(self, start, end, area_ids, type_ids, month_ids=None):
+        '''Returns the numbers of the rows matching a filter, ascending'''
+        if self.bitmaps is not None:
+            return self.bitmaps.to_rows(self.select(start, end, area_ids, type_ids, month_ids))
+        return self.np.flatnonzero(self.mask(start, end, area_ids, type_ids, month_ids))
+
+    def crime_rows(self, rows):
+        '''Returns the crime rows (month, area, type, vict_age, vict_sex, id) for an array of row numbers'''
+        return list(zip(self.month_name_array[self.month[rows]].tolist(),
+                        self.area_names[self.area[rows]].tolist(),
+                        self.type_names[self.type[rows]].tolist(),
+                        self.age_values[rows].tolist(),
+                        self.sex_names[self.sex[rows]].tolist(),
+                        (rows + 1).tolist()))
+
+class MemorySession:
+    '''Answers queries from a MemoryData; holds no resources.'''
+
+    def __init__(self, data):
+        self.data = data
+
+    def close(self):
+        pass
+
+    def detach(self):
+        pass
+
+    def recover(self):
+        pass
+
+    def dimension_values(self, dimension):
+        data = self.data
+        if dimension == 'months':
+            return list(data.month_names)
+        names = data.area_names if dimension == 'areas' else data.type_names
+        return sorted(names.tolist())
+
+    def area_ids(self, names):
+        return self.data.codes('area', names)
+
+    def type_ids(self, names):
+        return self.data.codes('type', names)
+
+    def month_ids(self, start, end):
+        return list(self.data.month_code_range(start, end))
+
+    def _matching_rows(self, start, end, area_ids, type_ids, ordered, month_ids=None):
+        data = self.data
+        rows = data.matching_rows(start, end, area_ids, type_ids, month_ids)
+        if ordered:
+            rows = rows[data.np.argsort(data.month[rows], kind='stable')]
+        return rows
+
+    def crimes(self, start, end, area_ids=None, type_ids=None, month_ids=None):
+        return self.data.crime_rows(self._matching_rows(start, end, area_ids, type_ids, True, month_ids))
+
+    def crimes_page(self, month_ids, area_ids, type_ids, after, limit):
+        data = self.data
+        np = data.np
+        if after is None:
+            position, last_id = 0, 0
+        else:
+            position, last_id = month_ids.index(after[0]), after[1]
+
+        pieces = []
+        found = 0
+        for month_id in month_ids[position:]:
+            rows = data.by_month[data.month_starts[month_id]:data.month_starts[month_id + 1]]
+            # Row r has event id r + 1, so ids above last_id start at row last_id.
+            rows = rows[np.searchsorted(rows, last_id):]
+            if area_ids is not None:
+                rows = rows[data.member_mask(data.area[rows], area_ids, len(data.area_names))]
+            if type_ids is not None:
+                rows = rows[data.member_mask(data.type[rows], type_ids, len(data.type_names))]
+            pieces.append(rows[:limit + 1 - found])
+            found += len(pieces[-1])
+            if found > limit:
+                break
+            last_id = 0
+
+        rows = np.concatenate(pieces) if pieces else np.empty(0, dtype=np.intp)
+        next_position = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_position = (int(data.month[rows[-1]]), int(rows[-1]) + 1)
+        return data.crime_rows(rows), next_position
+
+    def export_batches(self, start, end, area_ids, type_ids, ordered, batch_rows, month_ids=None):
+        rows = self._matching_rows(start, end, area_ids, type_ids, ordered, month_ids)
+        if not len(rows):
+            return None
+        return (self.data.crime_rows(rows[i:i + batch_rows]) for i in range(0, len(rows), batch_rows))
+
+    def chart_counts(self, start, end, area_ids, type_ids):
+        data = self.data
+        np = data.np
+        if data.bitmaps is not None:
+            selection = data.select(start, end, area_ids, type_ids)
+            by_month = data.bitmaps.counts(selection, 'month')
+            by_bucket = data.bitmaps.counts(selection, 'age_bucket')
+            by_sex = data.bitmaps.counts(selection, 'sex')
+        else:
+            mask = data.mask(start, end, area_ids, type_ids)
+            by_month = np.bincount(data.month[mask], minlength=len(data.month_names))
+            buckets = data.age_bucket[mask]
+            by_bucket = np.bincount(buckets[buckets >= 0], minlength=data.bucket_count)
+            by_sex = np.bincount(data.sex[mask], minlength=len(data.sex_names))
+        month_counts = {data.month_names[i]: int(count) for i, count in enumerate(by_month) if count}
+        age_counts = {i * 10: int(count) for i, count in enumerate(by_bucket) if count}
+        sex_counts = {data.sex_names[i]: int(count) for i, count in enumerate(by_sex) if count}
+        return month_counts, age_counts, sex_counts
+
+    def event_count(self, start, end, area_ids=None, type_ids=None, month_ids=None):
+        data = self.data
+        if data.bitmaps is not None:
+            return data.bitmaps.count(data.select(start, end, area_ids, type_ids, month_ids))
+        return int(data.mask(start, end, area_ids, type_ids, month_ids).sum())
+
+    def grouped_counts(self, group_by, start, end, area_ids=None, type_ids=None, month_ids=None):
+        data = self.data
+        np = data.np
+        rows = data.matching_rows(start, end, area_ids, type_ids, month_ids)
+        columns = {
+            'month': (data.month, data.month_name_array),
+            'area': (data.area, data.area_names),
+            'type': (data.type, data.type_names),
+            'sex': (data.sex, data.sex_names),
+        }
+        codes = np.stack([columns[column][0][rows].astype(np.int32) for column in group_by])
+        groups, counts = np.unique(codes, axis=1, return_counts=True)
+        names = [columns[column][1][groups[i]].tolist() for i, column in enumerate(group_by)]
+        return sorted(zip(*names, counts.tolist()))
+
+    def victim_ages(self):
+        ages = self.data.victim_ages
+        return ages[ages > 0].tolist()
+
+    def victim_sex_counts(self):
+        data = self.data
+        counts = data.np.bincount(data.victim_sexes, minlength=len(data.sex_names))
+        return {data.sex_names[i]: int(count) for i, count in enumerate(counts)
+                if count and data.sex_names[i]}
+
+class MemoryBackend:
+    '''
+    Serves the data of a snapshot from memory. The snapshot is reloaded when
+    it is rebuilt, checked at most every reload_interval seconds, and the
+    response caches are cleared; its bitmap indexes are rebuilt with it.
+    '''
+    name = 'memory'
+
+    def __init__(self, path=DEFAULT_SNAPSHOT, reload_interval=10, use_bitmaps=True):
+        self.path = path
+        self.reload_interval = reload_interval
+        self.use_bitmaps = use_bitmaps
+        self._lock = threading.Lock()
+        self._data = MemoryData(path, use_bitmaps)
+        self._loaded_mtime = self._snapshot_mtime()
+        self._checked_at = time.monotonic()
+
+    def _snapshot_mtime(self):
+        # snapshot.py renames a new directory into place, so the inode changes too
+        stat = os.stat(os.path.join(self.path, 'meta.json'))
+        return stat.st_ino, stat.st_mtime_ns
+
+    def _reload_if_changed(self):
+        if time.monotonic() - self._checked_at < self.reload_interval:
+            return
+        with self._lock:
+            self._checked_at = time.monotonic()
+            try:
+                mtime = self._snapshot_mtime()
+                if mtime != self._loaded_mtime:
+                    self._data = MemoryData(self.path, self.use_bitmaps)
+                    self._loaded_mtime = mtime
+                    cache.invalidate_all()
+            except Exception as e:
+                print(f"Keeping the loaded snapshot, reload failed: {e}", file=sys.stderr)
+
+    def session(self):
+        self._reload_if_changed()
+        return MemorySession(self._data)
+
+    def stats(self):
+        data = self._data
+        return {"backend": self.name, "snapshot": self.path, "rows": data.rows,
+                "bitmaps": data.bitmaps.library if data.bitmaps is not None else None}
+
+_backend = None
+_backend_lock = threading.Lock()
+
+def get_backend():
+    '''Returns this process's backend, chosen by config.backend, creating it on first use.'''
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                name = getattr(config, 'backend', 'postgres')
+                if name == 'memory':
+                    _backend = MemoryBackend(getattr(config, 'memory_snapshot', DEFAULT_SNAPSHOT),
+                                             getattr(config, 'memory_reload_interval', 10),
+                                             getattr(config, 'memory_bitmaps', True))
+                elif name == 'postgres':
+                    _backend = PostgresBackend()
+                else:
+                    raise ValueError(f"Unknown backend in config.py: {name!r}")
+    return _backend
+
+def uses_database():
+    '''Whether the configured backend needs PostgreSQL'''
+    return getattr(config, 'backend', 'postgres') == 'postgres'
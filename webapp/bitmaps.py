@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+'''
+    bitmaps.py
+    Owen Xu, Chloe Xufeng
+
+    Bitmap indexes for the memory backend: for each code of a dictionary
+    column (area, type, month, ...), the set of row numbers holding it. A
+    filter is answered by ORing the bitmaps of the wanted codes of each
+    column and ANDing the columns, and counts come from the cardinality of
+    the result, without touching the rows themselves.
+
+    Bitmaps are compressed roaring bitmaps when pyroaring is installed, and
+    Python ints used as bit sets otherwise.
+'''
+from functools import reduce
+import operator
+
+import numpy as np
+
+try:
+    from pyroaring import BitMap
+except ImportError:
+    BitMap = None
+
+class RoaringBitmaps:
+    '''Bitmap operations on pyroaring BitMaps'''
+    name = 'roaring'
+
+    def __init__(self, rows):
+        self.rows = rows
+
+    def from_rows(self, rows):
+        bitmap = BitMap(rows.astype(np.uint32))
+        bitmap.run_optimize()
+        return bitmap
+
+    def union(self, bitmaps):
+        return BitMap.union(*bitmaps) if bitmaps else BitMap()
+
+    def cardinality(self, bitmap):
+        return len(bitmap)
+
+    def intersection_cardinality(self, bitmap, other):
+        return bitmap.intersection_cardinality(other)
+
+    def to_rows(self, bitmap):
+        return np.frombuffer(bitmap.to_array(), dtype=np.uint32).astype(np.intp)
+
+class IntBitmaps:
+    '''Bitmap operations on Python ints, bit i standing for row i'''
+    name = 'int'
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.size = (rows + 7) // 8
+
+    def from_rows(self, rows):
+        mask = np.zeros(self.rows, dtype=bool)
+        mask[rows] = True
+        return int.from_bytes(np.packbits(mask, bitorder='little').tobytes(), 'little')
+
+    def union(self, bitmaps):
+        return reduce(operator.or_, bitmaps, 0)
+
+    def cardinality(self, bitmap):
+        return bitmap.bit_count()
+
+    def intersection_cardinality(self, bitmap, other):
+        return (bitmap & other).bit_count()
+
+    def to_rows(self, bitmap):
+        bits = np.unpackbits(np.frombuffer(bitmap.to_bytes(self.size, 'little'), dtype=np.uint8),
+                             bitorder='little', count=self.rows)
+        return np.flatnonzero(bits)
+
+class BitmapIndex:
+    '''
+    Bitmaps of the rows holding each code of some columns. columns maps a
+    name to (codes, size): an array with a code per row, and the number of
+    codes; rows with a negative code are in no bitmap.
+    '''
+
+    def __init__(self, rows, columns):
+        self.rows = rows
+        self.ops = RoaringBitmaps(rows) if BitMap is not None else IntBitmaps(rows)
+        self.bitmaps = {}
+        for name, (codes, size) in columns.items():
+            # Row numbers sorted by code (ascending within each), split at each code
+            order = np.argsort(codes, kind='stable')
+            bounds = np.searchsorted(codes[order], np.arange(size + 1))
+            self.bitmaps[name] = [self.ops.from_rows(order[bounds[code]:bounds[code + 1]])
+                                  for code in range(size)]
+
+    @property
+    def library(self):
+        return self.ops.name
+
+    def select(self, filters):
+        '''
+        Returns the bitmap of the rows matching every filter in filters, a
+        dict of column name -> codes (None means any), or None when nothing
+        is filtered.
+        '''
+        selection = None
+        for name, codes in filters.items():
+            if codes is None:
+                continue
+            bitmaps = self.bitmaps[name]
+            union = self.ops.union([bitmaps[code] for code in set(codes) if 0 <= code < len(bitmaps)])
+            selection = union if selection is None else selection & union
+        return selection
+
+    def count(self, selection):
+        '''The number of rows in a selection (None for all rows)'''
+        return self.rows if selection is None else self.ops.cardinality(selection)
+
+    def counts(self, selection, name):
+        '''Returns how many rows of a selection hold each code of column name, as a list'''
+        if selection is None:
+            return [self.ops.cardinality(bitmap) for bitmap in self.bitmaps[name]]
+        return [self.ops.intersection_cardinality(selection, bitmap) for bitmap in self.bitmaps[name]]
+
+    def to_rows(self, selection):
+        '''Returns the row numbers in a selection (None for all rows), ascending'''
+        if selection is None:
+            return np.arange(self.rows)
+        return self.ops.to_rows(selection)
@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+'''
+    cache.py
+    Owen Xu, Chloe Xufeng
+
+    In-process caches for API responses, and the hook that clears them when
+    new crime data is loaded.
+
+    Loaders (convert.py) send NOTIFY crime_data_reloaded after a load
+    commits. Each worker process keeps one connection LISTENing on that
+    channel and clears every registered cache when a notification arrives.
+    Entries also expire after their TTL in case a notification is missed.
+'''
+import os
+import sys
+import time
+import select
+import hashlib
+import threading
+from collections import namedtuple, OrderedDict
+
+import psycopg2
+import config
+
+RELOAD_CHANNEL = 'crime_data_reloaded'
+
+# body: the serialized response; etag: a hash of the body;
+# last_modified: when it was built (seconds since the epoch)
+CachedResponse = namedtuple('CachedResponse', ['body', 'etag', 'last_modified'])
+
+
+class TTLCache:
+    '''A thread-safe dict whose entries expire ttl seconds after being stored.'''
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        '''Returns the cached value for key, or None if it is missing or expired.'''
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None:
+                return None
+            expires, value = item
+            if time.monotonic() >= expires:
+                del self._entries[key]
+                return None
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class LRUCache:
+    '''
+    A thread-safe dict holding at most max_entries values and, if max_bytes
+    is set, at most max_bytes of them as measured by size(value). The least
+    recently used entries are evicted first.
+    '''
+
+    def __init__(self, max_entries=256, max_bytes=None, size=len):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._size = size
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key):
+        '''Returns the cached value for key (marking it recently used), or None.'''
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        size = self._size(value)
+        if self.max_bytes is not None and size > self.max_bytes:
+            return value
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= self._size(old)
+            self._entries[key] = value
+            self._bytes += size
+            while (len(self._entries) > self.max_entries
+                   or (self.max_bytes is not None and self._bytes > self.max_bytes)):
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= self._size(evicted)
+                self.evictions += 1
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            self.invalidations += 1
+
+    def stats(self):
+        '''Returns the cache's size and hit/miss/eviction counters as a dict.'''
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations
+            }
+
+
+def make_cached_response(body):
+    '''Wraps a serialized body with its ETag and Last-Modified time.'''
+    etag = hashlib.md5(body.encode('utf-8')).hexdigest()
+    return CachedResponse(body, etag, int(time.time()))
+
+
+_invalidation_hooks = []
+
+def register(hook):
+    '''Registers a function (e.g. a cache's clear method) to call on reload.'''
+    _invalidation_hooks.append(hook)
+    return hook
+
+def invalidate_all():
+    '''Clears every registered cache. Called when new data has been loaded.'''
+    for hook in _invalidation_hooks:
+        try:
+            hook()
+        except Exception as e:
+            print(f"Cache invalidation failed: {e}", file=sys.stderr)
+
+
+_listener_pid = None
+_listener_lock = threading.Lock()
+
+def _listen_for_reloads():
+    '''Runs in a daemon thread: LISTENs for reload notifications, reconnecting on errors.'''
+    delay = 1
+    while True:
+        connection = None
+        try:
+            connection = psycopg2.connect(database=config.database,
+                                          user=config.user,
+                                          password=config.password)
+            connection.autocommit = True
+            connection.cursor().execute(f'LISTEN {RELOAD_CHANNEL}')
+            # Anything loaded while we were disconnected went unnoticed.
+            invalidate_all()
+            delay = 1
+            while True:
+                if select.select([connection], [], [], 60) == ([], [], []):
+                    continue
+                connection.poll()
+                if connection.notifies:
+                    connection.notifies.clear()
+                    invalidate_all()
+        except Exception as e:
+            print(f"Reload listener error, retrying in {delay}s: {e}", file=sys.stderr)
+            time.sleep(delay)
+            delay = min(delay * 2, 60)
+        finally:
+            if connection is not None:
+                connection.close()
+
+def start_reload_listener():
+    '''
+    Starts this process's reload listener if it is not running yet. Called
+    per request so forked workers start their own. Set listen_for_reloads =
+    False in config.py to rely on TTL expiry alone. Backends other than
+    PostgreSQL have no database to listen to.
+    '''
+    global _listener_pid
+    if (_listener_pid == os.getpid() or not getattr(config, 'listen_for_reloads', True)
+            or getattr(config, 'backend', 'postgres') != 'postgres'):
+        return
+    with _listener_lock:
+        if _listener_pid != os.getpid():
+            thread = threading.Thread(target=_listen_for_reloads, name='reload-listener', daemon=True)
+            thread.start()
+            _listener_pid = os.getpid()
+
+def init_app(app):
+    '''Hooks the reload listener into the Flask app.'''
+    app.before_request(start_reload_listener)
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+'''
+    compress.py
+    Owen Xu, Chloe Xufeng
+
+    Compression of API responses by the client's Accept-Encoding: brotli
+    when the brotli package is installed and the client accepts it, else
+    gzip. Whole responses are compressed once they reach
+    compress_min_bytes; streamed downloads compress each chunk as it is
+    sent (see api.stream_batches). asgi.py compresses its responses the
+    same way.
+'''
+import zlib
+
+import flask
+from werkzeug.http import parse_accept_header
+
+import config
+import metrics
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE = {'application/json', 'application/x-ndjson', 'text/csv', 'text/html', 'text/plain'}
+GZIP_LEVEL = 6
+# Brotli's default quality (11) is meant for static files; 5 compresses
+# about as fast as gzip -6 and smaller.
+BROTLI_QUALITY = 5
+
+def choose_encoding(accept_encoding):
+    '''Returns 'br', 'gzip' or None: the encoding to answer a request's Accept-Encoding header with'''
+    accepted = parse_accept_header(accept_encoding)
+    if brotli is not None and getattr(config, 'compress_brotli', True) and accepted.quality('br') > 0:
+        return 'br'
+    if accepted.quality('gzip') > 0:
+        return 'gzip'
+    return None
+
+class BrotliCompressor:
+    '''A brotli stream with zlib's compress()/flush() interface'''
+
+    def __init__(self):
+        self._compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+
+    def compress(self, data):
+        return self._compressor.process(data)
+
+    def flush(self):
+        return self._compressor.finish()
+
+def compressor(encoding):
+    '''Returns a streaming compressor for encoding ('br' or 'gzip')'''
+    if encoding == 'br':
+        return BrotliCompressor()
+    return zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+def compress(data, encoding):
+    '''Compresses a whole body'''
+    if encoding == 'br':
+        return brotli.compress(data, quality=BROTLI_QUALITY)
+    stream = compressor(encoding)
+    return stream.compress(data) + stream.flush()
+
+def should_compress(status, mimetype, size):
+    '''Returns whether a finished response body is worth compressing'''
+    return (getattr(config, 'compress_responses', True) and 200 <= status and status not in (204, 304)
+            and mimetype in COMPRESSIBLE and size >= getattr(config, 'compress_min_bytes', 1024))
+
+def compress_response(response):
+    '''
+    Compresses a finished (not streamed) response when it is large enough
+    and of a text type, and the client accepts an encoding. A strong ETag
+    becomes weak, as the bytes now depend on the encoding.
+    '''
+    if (response.is_streamed or 'Content-Encoding' in response.headers
+            or not should_compress(response.status_code, response.mimetype,
+                                   response.calculate_content_length() or 0)):
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = choose_encoding(flask.request.headers.get('Accept-Encoding'))
+    if encoding is None:
+        return response
+    with metrics.phase('serialize'):
+        response.set_data(compress(response.get_data(), encoding))
+    response.headers['Content-Encoding'] = encoding
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
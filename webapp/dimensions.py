@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+'''
+    dimensions.py
+    Owen Xu, Chloe Xufeng
+
+    In-process maps from lowercased area and crime type names to their ids.
+    Routes resolve the names in a request to ids once, then filter
+    crime_events on its integer area_id/type_id columns.
+'''
+import time
+import threading
+
+# table -> (time loaded, {lowercased name: [ids]})
+_maps = {}
+_lock = threading.Lock()
+
+# A lookup that misses rereads its table at most this often (seconds).
+MISS_RELOAD_INTERVAL = 30
+
+DIMENSIONS = {
+    'areas': 'area',
+    'types': 'type',
+}
+
+def map_query(table):
+    '''Returns the query reading a dimension table's (id, name) rows'''
+    return f'SELECT id, {DIMENSIONS[table]} FROM {table}'
+
+def store_map(table, rows):
+    '''Builds the {lowercased name: [ids]} dict of a dimension table from its (id, name) rows and keeps it'''
+    names = {}
+    for id, name in rows:
+        if name is not None:
+            names.setdefault(name.lower(), []).append(id)
+    with _lock:
+        _maps[table] = (time.monotonic(), names)
+    return names
+
+def load_map(cursor, table):
+    '''Reads a dimension table into a {lowercased name: [ids]} dict'''
+    cursor.execute(map_query(table))
+    return store_map(table, cursor.fetchall())
+
+def loaded_map(table, names):
+    '''
+    Returns the kept map of table, or None if it must be (re)read first:
+    it was never read, or one of names is missing and it was read more than
+    MISS_RELOAD_INTERVAL seconds ago, in case new data has been loaded.
+    '''
+    loaded_at, lookup = _maps.get(table, (None, None))
+    if lookup is None:
+        return None
+    if (any(name.lower() not in lookup for name in names)
+            and time.monotonic() - loaded_at > MISS_RELOAD_INTERVAL):
+        return None
+    return lookup
+
+def lookup_ids(lookup, names):
+    '''Returns the ids of names in a map, each id once; names that match nothing are skipped'''
+    ids = []
+    for name in names:
+        for id in lookup.get(name.lower(), []):
+            if id not in ids:
+                ids.append(id)
+    return ids
+
+def resolve(cursor, table, names):
+    '''
+    Returns the ids of the rows in table whose name matches one of names,
+    ignoring case (see loaded_map for when the table is reread).
+    '''
+    lookup = loaded_map(table, names)
+    if lookup is None:
+        lookup = load_map(cursor, table)
+    return lookup_ids(lookup, names)
+
+def area_ids(cursor, names):
+    '''Returns the area ids matching the given area names, ignoring case'''
+    return resolve(cursor, 'areas', names)
+
+def type_ids(cursor, names):
+    '''Returns the crime type ids matching the given type names, ignoring case'''
+    return resolve(cursor, 'types', names)
+
+def invalidate():
+    '''Forgets the loaded maps so the next lookup rereads the tables'''
+    with _lock:
+        _maps.clear()
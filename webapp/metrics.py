@@ -0,0 +1,316 @@
+#!/usr/bin/env python3
+'''
+    metrics.py
+    Owen Xu, Chloe Xufeng
+
+    Per-request timing of the /api routes. Each request's time is split into
+    phases:
+
+    - connect: opening a session (checking out a pooled connection)
+    - execute: running SQL
+    - fetch: reading result rows from the database
+    - serialize: turning results into JSON, CSV or NDJSON
+    - transform: the rest of the route's Python work (filters, aggregation,
+      and with the memory backend, its in-memory queries)
+
+    Phases nest without double counting: SQL run inside a serialize phase
+    counts as execute only. The time a server spends writing a streamed
+    body to the client belongs to no phase.
+
+    Finished requests update per-route counters and histograms, served in
+    the Prometheus text format by /api/metrics, and requests slower than
+    slow_request_ms are logged as JSON lines (to slow_request_log, or
+    stderr). Each worker process keeps its own metrics.
+
+    The current request's timer is a context variable, so it follows each
+    request through its thread under app.py and through its task under
+    asgi.py, which times requests with its own hooks.
+'''
+import sys
+import json
+import time
+import threading
+import contextlib
+import contextvars
+
+import flask
+import psycopg2.extensions
+
+import config
+
+PHASES = ('connect', 'execute', 'fetch', 'transform', 'serialize')
+
+# Histogram bucket upper bounds, in seconds and bytes
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216, 67108864)
+
+class RequestTimer:
+    '''The phase times, database rows and body bytes of one request'''
+
+    def __init__(self, route, method):
+        self.route = route
+        self.method = method
+        self.path = None
+        self.started = time.perf_counter()
+        self.phases = dict.fromkeys(PHASES, 0.0)
+        self.rows = 0
+        self.bytes = 0
+        self.sending = 0.0
+        self.status = None
+        self._stack = []
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        '''Counts the time spent inside the block as phase name, pausing the enclosing phase'''
+        now = time.perf_counter()
+        if self._stack:
+            outer = self._stack[-1]
+            self.phases[outer[0]] += now - outer[1]
+        self._stack.append([name, now])
+        try:
+            yield
+        finally:
+            now = time.perf_counter()
+            inner = self._stack.pop()
+            self.phases[inner[0]] += now - inner[1]
+            if self._stack:
+                self._stack[-1][1] = now
+
+    def finish(self):
+        '''Returns the total duration, putting the time no other phase claimed into transform'''
+        total = time.perf_counter() - self.started
+        claimed = sum(seconds for name, seconds in self.phases.items() if name != 'transform')
+        self.phases['transform'] = max(0.0, total - self.sending - claimed)
+        return total
+
+_current_timer = contextvars.ContextVar('request_timer', default=None)
+
+def current():
+    '''The timer of the request being served, or None'''
+    return _current_timer.get()
+
+@contextlib.contextmanager
+def phase(name):
+    '''Times the block as phase name of the current request, if one is being timed'''
+    timer = current()
+    if timer is None:
+        yield
+    else:
+        with timer.phase(name):
+            yield
+
+def add_rows(count):
+    timer = current()
+    if timer is not None:
+        timer.rows += count
+
+class TimedCursor(psycopg2.extensions.cursor):
+    '''A cursor that times its queries as execute and its fetches as fetch'''
+
+    def execute(self, query, vars=None):
+        with phase('execute'):
+            return super().execute(query, vars)
+
+    def fetchone(self):
+        with phase('fetch'):
+            row = super().fetchone()
+        add_rows(row is not None)
+        return row
+
+    def fetchmany(self, size=None):
+        with phase('fetch'):
+            rows = super().fetchmany(self.arraysize if size is None else size)
+        add_rows(len(rows))
+        return rows
+
+    def fetchall(self):
+        with phase('fetch'):
+            rows = super().fetchall()
+        add_rows(len(rows))
+        return rows
+
+    def __iter__(self):
+        while True:
+            rows = self.fetchmany(self.itersize)
+            if not rows:
+                return
+            yield from rows
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.sum += value
+        self.count += 1
+
+class Registry:
+    '''The counters and histograms of finished requests'''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = {}        # (route, method, status) -> count
+        self.durations = {}       # route -> Histogram
+        self.phases = {}          # (route, phase) -> Histogram
+        self.sizes = {}           # route -> Histogram of body bytes
+        self.rows = {}            # route -> database rows fetched
+        self.slow = {}            # route -> slow requests
+
+    def record(self, timer, total, slow):
+        route = timer.route
+        with self.lock:
+            key = (route, timer.method, timer.status)
+            self.requests[key] = self.requests.get(key, 0) + 1
+            self.durations.setdefault(route, Histogram(DURATION_BUCKETS)).observe(total)
+            for name, seconds in timer.phases.items():
+                if seconds:
+                    self.phases.setdefault((route, name), Histogram(DURATION_BUCKETS)).observe(seconds)
+            self.sizes.setdefault(route, Histogram(SIZE_BUCKETS)).observe(timer.bytes)
+            self.rows[route] = self.rows.get(route, 0) + timer.rows
+            if slow:
+                self.slow[route] = self.slow.get(route, 0) + 1
+
+registry = Registry()
+_slow_log_lock = threading.Lock()
+
+def log_slow_request(timer, total):
+    entry = {
+        "time": time.strftime('%Y-%m-%dT%H:%M:%S'),
+        "route": timer.route,
+        "path": timer.path,
+        "status": timer.status,
+        "ms": round(1000 * total, 1),
+        "phases_ms": {name: round(1000 * seconds, 1) for name, seconds in timer.phases.items()},
+        "rows": timer.rows,
+        "bytes": timer.bytes,
+    }
+    line = json.dumps(entry) + '\n'
+    path = getattr(config, 'slow_request_log', None)
+    try:
+        with _slow_log_lock:
+            if path:
+                with open(path, 'a', encoding='utf-8') as f:
+                    f.write(line)
+            else:
+                sys.stderr.write(line)
+    except OSError as e:
+        print(f"Could not write the slow request log: {e}", file=sys.stderr)
+
+def start(route, method, path):
+    '''Starts timing a request; phases run from here on count towards it'''
+    timer = RequestTimer(route, method)
+    timer.path = path
+    _current_timer.set(timer)
+    return timer
+
+def finish(timer):
+    '''Records a finished request and stops timing it'''
+    if _current_timer.get() is timer:
+        _current_timer.set(None)
+    total = timer.finish()
+    threshold = getattr(config, 'slow_request_ms', 1000)
+    slow = threshold is not None and 1000 * total >= threshold
+    registry.record(timer, total, slow)
+    if slow:
+        log_slow_request(timer, total)
+
+def counted(body, timer):
+    '''Passes a streamed body through, counting its bytes and the time spent sending it'''
+    try:
+        for chunk in body:
+            timer.bytes += len(chunk)
+            paused = time.perf_counter()
+            yield chunk
+            timer.sending += time.perf_counter() - paused
+    finally:
+        close = getattr(body, 'close', None)
+        if close:
+            close()
+
+def _labels(**labels):
+    return '{' + ','.join(f'{name}="{value}"' for name, value in labels.items()) + '}'
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+def _histogram_lines(name, histograms):
+    lines = []
+    for labels, histogram in histograms:
+        cumulative = 0
+        for bound, count in zip(histogram.buckets, histogram.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{_labels(**labels, le=bound)} {cumulative}')
+        lines.append(f'{name}_bucket{_labels(**labels, le="+Inf")} {histogram.count}')
+        lines.append(f'{name}_sum{_labels(**labels)} {_format_value(histogram.sum)}')
+        lines.append(f'{name}_count{_labels(**labels)} {histogram.count}')
+    return lines
+
+def render(backend_stats=None):
+    '''Returns the metrics in the Prometheus text exposition format'''
+    lines = []
+
+    def family(name, kind, description, samples):
+        lines.append(f'# HELP {name} {description}')
+        lines.append(f'# TYPE {name} {kind}')
+        lines.extend(samples)
+
+    with registry.lock:
+        family('crime_api_requests_total', 'counter', 'Requests answered, by route, method and status.',
+               [f'crime_api_requests_total{_labels(route=route, method=method, status=status)} {count}'
+                for (route, method, status), count in sorted(registry.requests.items())])
+        family('crime_api_request_duration_seconds', 'histogram', 'Time to answer a request.',
+               _histogram_lines('crime_api_request_duration_seconds',
+                                [({'route': route}, h) for route, h in sorted(registry.durations.items())]))
+        family('crime_api_phase_duration_seconds', 'histogram',
+               'Time a request spent in each phase (connect, execute, fetch, transform, serialize).',
+               _histogram_lines('crime_api_phase_duration_seconds',
+                                [({'route': route, 'phase': name}, h)
+                                 for (route, name), h in sorted(registry.phases.items())]))
+        family('crime_api_response_bytes', 'histogram', 'Size of response bodies as sent.',
+               _histogram_lines('crime_api_response_bytes',
+                                [({'route': route}, h) for route, h in sorted(registry.sizes.items())]))
+        family('crime_api_rows_fetched_total', 'counter', 'Rows fetched from the database.',
+               [f'crime_api_rows_fetched_total{_labels(route=route)} {count}'
+                for route, count in sorted(registry.rows.items())])
+        family('crime_api_slow_requests_total', 'counter', 'Requests slower than slow_request_ms.',
+               [f'crime_api_slow_requests_total{_labels(route=route)} {count}'
+                for route, count in sorted(registry.slow.items())])
+
+    for name, value in sorted((backend_stats or {}).items()):
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            family(f'crime_api_backend_{name}', 'gauge', f'{name} as reported by /api/pool.',
+                   [f'crime_api_backend_{name} {_format_value(value)}'])
+    return '\n'.join(lines) + '\n'
+
+def _start_request():
+    request = flask.request
+    _current_timer.set(None)
+    if request.blueprint != 'api' or not getattr(config, 'request_metrics', True):
+        return
+    start(request.url_rule.rule if request.url_rule else 'unmatched', request.method,
+          request.full_path.rstrip('?'))
+
+def _finish_request(response):
+    timer = current()
+    if timer is None:
+        return response
+    timer.status = response.status_code
+    if response.is_streamed:
+        response.response = counted(response.response, timer)
+    else:
+        timer.bytes = response.calculate_content_length() or 0
+    # Recorded once the body has been sent, after any streaming
+    response.call_on_close(lambda: finish(timer))
+    return response
+
+def init_app(app):
+    '''Times the /api requests of the Flask app'''
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
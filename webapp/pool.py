@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+'''
+    pool.py
+    Owen Xu, Chloe Xufeng
+
+    A small thread-safe pool of PostgreSQL connections shared by every API route,
+    so requests reuse open connections instead of reconnecting each time.
+
+    Settings are read from config.py (all optional):
+        pool_min_size      connections opened up front (default 1)
+        pool_max_size      most connections open at once (default 10)
+        pool_timeout       seconds to wait for a free connection (default 5)
+        pool_health_check  run SELECT 1 before handing out a connection (default True)
+'''
+import os
+import sys
+import time
+import atexit
+import threading
+from collections import deque
+
+import flask
+import psycopg2
+import config
+
+
+class PoolTimeout(Exception):
+    '''Raised when no connection becomes free within the checkout timeout.'''
+
+
+class ConnectionPool:
+    '''
+    Keeps between min_size and max_size open connections. getconn() waits up
+    to `timeout` seconds for a free connection, and putconn() hands it back.
+    '''
+
+    def __init__(self, connect, min_size=1, max_size=10, timeout=5.0, health_check=True):
+        if min_size < 0 or max_size < 1 or min_size > max_size:
+            raise ValueError('Invalid pool size: min=%s max=%s' % (min_size, max_size))
+        self._connect = connect
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.health_check = health_check
+
+        self._lock = threading.Condition()
+        self._idle = deque()
+        self._in_use = set()
+        self._opened = 0
+        self._waiting = 0
+        self._closed = False
+
+        # Metrics
+        self._checkouts = 0
+        self._timeouts = 0
+        self._discarded = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+        for _ in range(min_size):
+            self._idle.append(self._connect())
+            self._opened += 1
+
+    def getconn(self):
+        '''Checks out a connection, opening a new one or waiting as needed.'''
+        started = time.perf_counter()
+        deadline = started + self.timeout
+        while True:
+            connection = None
+            with self._lock:
+                if self._closed:
+                    raise psycopg2.InterfaceError('connection pool is closed')
+                while not self._idle and self._opened >= self.max_size:
+                    remaining = deadline - time.perf_counter()
+                    if remaining <= 0:
+                        self._timeouts += 1
+                        raise PoolTimeout('no connection available after %.1fs' % self.timeout)
+                    self._waiting += 1
+                    try:
+                        self._lock.wait(remaining)
+                    finally:
+                        self._waiting -= 1
+                if self._idle:
+                    connection = self._idle.pop()
+                else:
+                    self._opened += 1
+
+            if connection is None:
+                try:
+                    connection = self._connect()
+                except Exception:
+                    with self._lock:
+                        self._opened -= 1
+                        self._lock.notify()
+                    raise
+            elif not self._is_healthy(connection):
+                self._discard(connection)
+                continue
+
+            waited = time.perf_counter() - started
+            with self._lock:
+                self._in_use.add(connection)
+                self._checkouts += 1
+                self._wait_total += waited
+                self._wait_max = max(self._wait_max, waited)
+            return connection
+
+    def putconn(self, connection, discard=False):
+        '''Returns a connection to the pool, closing it if it is broken.'''
+        with self._lock:
+            if connection not in self._in_use:
+                return
+            self._in_use.discard(connection)
+
+        if not discard and not connection.closed:
+            try:
+                # Never hand the next request a half-finished transaction.
+                connection.rollback()
+            except psycopg2.Error:
+                discard = True
+
+        if discard or connection.closed or self._closed:
+            self._discard(connection)
+            return
+
+        with self._lock:
+            self._idle.append(connection)
+            self._lock.notify()
+
+    def closeall(self):
+        '''Closes every idle connection and refuses further checkouts.'''
+        with self._lock:
+            self._closed = True
+            idle = list(self._idle)
+            self._idle.clear()
+            self._lock.notify_all()
+        for connection in idle:
+            self._discard(connection, count=False)
+
+    def stats(self):
+        '''Returns a snapshot of the pool metrics as a dict.'''
+        with self._lock:
+            return {
+                "min_size": self.min_size,
+                "max_size": self.max_size,
+                "open": self._opened,
+                "idle": len(self._idle),
+                "in_use": len(self._in_use),
+                "waiting": self._waiting,
+                "checkouts": self._checkouts,
+                "timeouts": self._timeouts,
+                "discarded": self._discarded,
+                "checkout_wait_avg_ms": round(1000 * self._wait_total / self._checkouts, 3) if self._checkouts else 0.0,
+                "checkout_wait_max_ms": round(1000 * self._wait_max, 3)
+            }
+
+    def _is_healthy(self, connection):
+        if connection.closed:
+            return False
+        if not self.health_check:
+            return True
+        try:
+            cursor = connection.cursor()
+            cursor.execute('SELECT 1')
+            cursor.close()
+            connection.rollback()
+            return True
+        except psycopg2.Error as e:
+            print(f"Dropping unhealthy pooled connection: {e}", file=sys.stderr)
+            return False
+
+    def _discard(self, connection, count=True):
+        try:
+            connection.close()
+        except Exception:
+            pass
+        with self._lock:
+            self._opened -= 1
+            if count:
+                self._discarded += 1
+            self._lock.notify()
+
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+def _connect():
+    return psycopg2.connect(database=config.database,
+                            user=config.user,
+                            password=config.password)
+
+
+def get_pool():
+    '''
+    Returns this process's pool, creating it on first use. Forked workers
+    (e.g. gunicorn) each build their own pool instead of sharing sockets.
+    '''
+    global _pool, _pool_pid
+    if _pool is not None and _pool_pid == os.getpid():
+        return _pool
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            _pool = ConnectionPool(_connect,
+                                   min_size=getattr(config, 'pool_min_size', 1),
+                                   max_size=getattr(config, 'pool_max_size', 10),
+                                   timeout=getattr(config, 'pool_timeout', 5.0),
+                                   health_check=getattr(config, 'pool_health_check', True))
+            _pool_pid = os.getpid()
+        return _pool
+
+
+def close_pool():
+    '''Closes this process's pool, if it has one.'''
+    global _pool
+    with _pool_lock:
+        if _pool is not None and _pool_pid == os.getpid():
+            _pool.closeall()
+        _pool = None
+
+
+def checkout():
+    '''Checks out a connection for the current request.'''
+    connection = get_pool().getconn()
+    if flask.has_app_context():
+        flask.g.setdefault('pool_connections', []).append(connection)
+    return connection
+
+
+def detach(connection):
+    '''
+    Stops tracking a connection as part of the current request, for responses
+    that keep using it after the view returns (e.g. streamed downloads). The
+    caller must release() it.
+    '''
+    if flask.has_app_context():
+        held = flask.g.get('pool_connections', [])
+        if connection in held:
+            held.remove(connection)
+    return connection
+
+def release(connection, discard=False):
+    '''Returns a connection checked out with checkout() to the pool.'''
+    if connection is None:
+        return
+    detach(connection)
+    if _pool is not None and _pool_pid == os.getpid():
+        _pool.putconn(connection, discard=discard)
+    else:
+        connection.close()
+
+
+def _release_request_connections(exception=None):
+    for connection in list(flask.g.get('pool_connections', [])):
+        release(connection)
+
+
+def init_app(app):
+    '''
+    Hooks the pool into the Flask app: connections a route forgot to return
+    are released when the request ends, and the pool closes at exit.
+    '''
+    app.teardown_appcontext(_release_request_connections)
+    atexit.register(close_pool)
@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+'''
+    profiling.py
+    Owen Xu, Chloe Xufeng
+
+    Opt-in profiling of single requests. A request is profiled when it
+    comes from one of the profile_clients addresses and asks for it, with
+    an X-Profile header or a profile query parameter, or when it falls in
+    the random profile_sample_rate fraction of all requests. The value
+    chooses the profiler:
+
+    - sample (the default): the request's thread is sampled every
+      profile_interval_ms milliseconds, giving folded stacks for a
+      flamegraph (the .folded file opens in speedscope or flamegraph.pl,
+      and .svg is rendered from it)
+    - cprofile: cProfile, saved as a .pstats file with a .txt summary of
+      the slowest functions
+
+    Streamed responses are profiled until their body has been sent. The
+    profile is written to profile_dir (keeping the newest profile_keep),
+    its id is returned in the X-Profile-Id header, and profile_clients can
+    list profiles at /api/profiles and download them at
+    /api/profiles/<id>.<svg|folded|pstats|txt>.
+
+    With no profile_clients and profile_sample_rate 0 (the defaults) no
+    hooks are installed at all.
+'''
+import os
+import io
+import re
+import sys
+import html
+import json
+import time
+import random
+import pstats
+import cProfile
+import tempfile
+import threading
+import zlib
+from collections import Counter
+
+import flask
+
+import config
+
+PROFILE_HEADER = 'X-Profile'
+PROFILE_PARAM = 'profile'
+MODES = ('sample', 'cprofile')
+PROFILE_FILE = re.compile(r'^([0-9]{8}-[0-9]{6}-[a-z0-9_]+-[0-9a-f]{6})\.(svg|folded|pstats|txt)$')
+MIMETYPES = {'svg': 'image/svg+xml', 'folded': 'text/plain', 'txt': 'text/plain',
+             'pstats': 'application/octet-stream'}
+
+def profile_dir():
+    return getattr(config, 'profile_dir', os.path.join(tempfile.gettempdir(), 'crime-profiles'))
+
+def allowed_client():
+    return flask.request.remote_addr in getattr(config, 'profile_clients', ())
+
+class StackSampler(threading.Thread):
+    '''Counts the stacks of one thread, sampled every interval seconds, as folded stack strings'''
+
+    def __init__(self, thread_id, interval):
+        super().__init__(name='profile-sampler', daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            frames = []
+            while frame is not None:
+                code = frame.f_code
+                frames.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+                frame = frame.f_back
+            if frames:
+                self.stacks[';'.join(reversed(frames))] += 1
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+class RequestProfile:
+    '''A profiler running for one request'''
+
+    def __init__(self, mode):
+        self.mode = mode
+        route = flask.request.url_rule.rule if flask.request.url_rule else 'unmatched'
+        slug = re.sub(r'[^a-z0-9]+', '_', route.lower()).strip('_') or 'root'
+        self.id = f"{time.strftime('%Y%m%d-%H%M%S')}-{slug}-{random.getrandbits(24):06x}"
+        self.info = {"id": self.id, "mode": mode, "route": route,
+                     "path": flask.request.full_path.rstrip('?'), "created": time.time()}
+        self.started = time.perf_counter()
+        if mode == 'cprofile':
+            self.profiler = cProfile.Profile()
+            try:
+                self.profiler.enable()
+            except ValueError:
+                # Python 3.12+ runs one cProfile at a time; sample this request instead
+                self.mode = mode = self.info["mode"] = 'sample'
+        if mode == 'sample':
+            self.profiler = StackSampler(threading.get_ident(), getattr(config, 'profile_interval_ms', 5) / 1000)
+            self.profiler.start()
+
+    def stop(self, status):
+        '''Stops profiling and writes the profile files'''
+        if self.mode == 'cprofile':
+            self.profiler.disable()
+        else:
+            self.profiler.stop()
+        self.info["ms"] = round(1000 * (time.perf_counter() - self.started), 1)
+        self.info["status"] = status
+        try:
+            self.save()
+        except OSError as e:
+            print(f"Could not save profile {self.id}: {e}", file=sys.stderr)
+
+    def save(self):
+        directory = profile_dir()
+        os.makedirs(directory, exist_ok=True)
+        base = os.path.join(directory, self.id)
+        if self.mode == 'cprofile':
+            self.profiler.dump_stats(base + '.pstats')
+            summary = io.StringIO()
+            pstats.Stats(self.profiler, stream=summary).sort_stats('cumulative').print_stats(40)
+            with open(base + '.txt', 'w', encoding='utf-8') as f:
+                f.write(summary.getvalue())
+            self.info["files"] = ['pstats', 'txt']
+        else:
+            with open(base + '.folded', 'w', encoding='utf-8') as f:
+                f.writelines(f'{stack} {count}\n' for stack, count in self.profiler.stacks.most_common())
+            self.info["samples"] = sum(self.profiler.stacks.values())
+            self.info["files"] = ['svg', 'folded']
+        # The metadata is written last: listed profiles are complete
+        with open(base + '.json', 'w', encoding='utf-8') as f:
+            json.dump(self.info, f)
+        prune(directory, getattr(config, 'profile_keep', 100))
+
+def prune(directory, keep):
+    '''Deletes all but the newest keep profiles in directory'''
+    profiles = sorted((name for name in os.listdir(directory) if name.endswith('.json')), reverse=True)
+    for name in profiles[keep:]:
+        profile_id = name[:-len('.json')]
+        for extension in ('json', 'folded', 'pstats', 'txt'):
+            try:
+                os.remove(os.path.join(directory, f'{profile_id}.{extension}'))
+            except FileNotFoundError:
+                pass
+
+def requested_mode():
+    '''The profiler the current request should run under, or None'''
+    request = flask.request
+    asked = request.headers.get(PROFILE_HEADER) or request.args.get(PROFILE_PARAM)
+    if asked and allowed_client():
+        return asked if asked in MODES else MODES[0]
+    rate = getattr(config, 'profile_sample_rate', 0)
+    if rate and random.random() < rate:
+        return MODES[0]
+    return None
+
+def _start_profile():
+    flask.g.pop('request_profile', None)
+    mode = requested_mode()
+    if mode is not None:
+        flask.g.request_profile = RequestProfile(mode)
+
+def _finish_profile(response):
+    profile = flask.g.pop('request_profile', None)
+    if profile is not None:
+        response.headers['X-Profile-Id'] = profile.id
+        # Stopped once the body has been sent, so streamed responses are profiled to the end
+        status = response.status_code
+        response.call_on_close(lambda: profile.stop(status))
+    return response
+
+def fold(lines):
+    '''Returns the (stack, count) pairs of folded stack lines'''
+    for line in lines:
+        stack, _, count = line.rstrip('\n').rpartition(' ')
+        if stack and count.isdigit():
+            yield stack, int(count)
+
+def flamegraph_svg(stacks, title, width=1200, row=17):
+    '''Renders (stack, count) pairs as a flamegraph SVG, callers below their callees'''
+    root = {"name": "all", "count": 0, "children": {}}
+    for stack, count in stacks:
+        node = root
+        node["count"] += count
+        for frame in stack.split(';'):
+            node = node["children"].setdefault(frame, {"name": frame, "count": 0, "children": {}})
+            node["count"] += count
+    total = root["count"] or 1
+
+    def depth(node):
+        return 1 + max((depth(child) for child in node["children"].values()), default=0)
+    height = depth(root) * row + 30
+
+    shapes = []
+
+    def draw(node, x, level):
+        w = node["count"] / total * (width - 20)
+        if w < 0.5:
+            return
+        y = height - (level + 1) * row - 5
+        hue = zlib.crc32(node["name"].encode()) % 40
+        label = html.escape(node["name"])
+        shapes.append(f'<g><title>{label} ({node["count"]} samples, {100 * node["count"] / total:.1f}%)</title>'
+                      f'<rect x="{x:.1f}" y="{y}" width="{w:.1f}" height="{row - 1}" fill="hsl({hue},85%,60%)"/>')
+        if w > 30:
+            text = node["name"][:int(w / 7)]
+            shapes.append(f'<text x="{x + 3:.1f}" y="{y + row - 5}">{html.escape(text)}</text>')
+        shapes.append('</g>')
+        for child in sorted(node["children"].values(), key=lambda child: child["name"]):
+            draw(child, x, level + 1)
+            x += child["count"] / total * (width - 20)
+
+    draw(root, 10, 0)
+    return (f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}" '
+            f'font-family="monospace" font-size="11">'
+            f'<text x="10" y="16" font-size="13">{html.escape(title)}</text>'
+            + ''.join(shapes) + '</svg>')
+
+def list_profiles():
+    '''Lists the saved profiles, newest first'''
+    if not allowed_client():
+        flask.abort(403)
+    directory = profile_dir()
+    profiles = []
+    if os.path.isdir(directory):
+        for name in sorted(os.listdir(directory), reverse=True):
+            if name.endswith('.json'):
+                try:
+                    with open(os.path.join(directory, name), encoding='utf-8') as f:
+                        profiles.append(json.load(f))
+                except (OSError, ValueError):
+                    pass
+    return flask.Response(json.dumps(profiles), mimetype='application/json')
+
+def download_profile(name):
+    '''Returns one file of a saved profile; .svg is rendered from the .folded stacks'''
+    if not allowed_client():
+        flask.abort(403)
+    match = PROFILE_FILE.match(name)
+    if not match:
+        flask.abort(404)
+    profile_id, extension = match.groups()
+    directory = profile_dir()
+    if extension == 'svg':
+        try:
+            with open(os.path.join(directory, profile_id + '.folded'), encoding='utf-8') as f:
+                svg = flamegraph_svg(list(fold(f)), profile_id)
+        except FileNotFoundError:
+            flask.abort(404)
+        return flask.Response(svg, mimetype=MIMETYPES['svg'])
+    return flask.send_from_directory(directory, name, mimetype=MIMETYPES[extension],
+                                     as_attachment=extension == 'pstats')
+
+def init_app(app):
+    '''Installs the profiling hooks and routes, if profiling is configured'''
+    if not getattr(config, 'profile_clients', ()) and not getattr(config, 'profile_sample_rate', 0):
+        return
+    app.before_request(_start_profile)
+    app.after_request(_finish_profile)
+    app.add_url_rule('/api/profiles', 'list_profiles', list_profiles)
+    app.add_url_rule('/api/profiles/<name>', 'download_profile', download_profile)
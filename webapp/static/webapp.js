@@ -9,10 +9,7 @@ let crimeChart, ageChart, sexChart;
  * - Initializes charts
  */
 function initialize() {
-    loadTypesSelector();
-    loadAreasSelector();
-    loadStartDatesSelector();
-    loadEndDatesSelector();
+    loadSelectors();
 
     const search = document.getElementById('search_button');
     if (search) {
@@ -65,6 +62,39 @@ function toggleAll(type) {
     }
 }
 
+/**
+ * Loads the type, area and date filter options with one /batch request,
+ * falling back to one request per selector if the batch fails
+ */
+function loadSelectors() {
+    const url = getAPIBaseURL() + '/batch';
+    const queries = [{path: 'types'}, {path: 'areas'}, {path: 'dates'}];
+
+    fetch(url, {
+        method: 'POST',
+        headers: {'Content-Type': 'application/json'},
+        body: JSON.stringify({queries: queries})
+    })
+        .then(res => {
+            if (!res.ok) {
+                throw new Error(`HTTP error! status: ${res.status}`);
+            }
+            return res.json();
+        })
+        .then(data => {
+            const results = data.results;
+            fillTypesSelector(results.types.body);
+            fillAreasSelector(results.areas.body);
+            fillDatesSelectors(results.dates.body);
+        })
+        .catch(error => {
+            console.error('Error fetching filter options in one batch:', error);
+            loadTypesSelector();
+            loadAreasSelector();
+            loadDatesSelectors();
+        });
+}
+
 /**
  * Loads crime type filter options
  */
@@ -73,17 +103,23 @@ function loadTypesSelector() {
 
     fetch(url)
         .then(res => res.json())
-        .then(types => {
-            const container = document.getElementById('types_selector');
-            container.innerHTML = ''; // Clear existing content
-            for (const type of types) {
-                const type_words = type.split(" ");
-                for (let i = 0; i < type_words.length; i++) {
-                    type_words[i] = type_words[i][0].toUpperCase() + type_words[i].substr(1);
-                }
-                createCheckbox(' '+ type_words.join(" "), 'types_selector');
-            }
-        });
+        .then(fillTypesSelector);
+}
+
+/**
+ * Fills the crime type checkboxes
+ * @param {Array} types - Type names from /types
+ */
+function fillTypesSelector(types) {
+    const container = document.getElementById('types_selector');
+    container.innerHTML = ''; // Clear existing content
+    for (const type of types) {
+        const type_words = type.split(" ");
+        for (let i = 0; i < type_words.length; i++) {
+            type_words[i] = type_words[i][0].toUpperCase() + type_words[i].substr(1);
+        }
+        createCheckbox(' '+ type_words.join(" "), 'types_selector');
+    }
 }
 
 /**
@@ -94,51 +130,47 @@ function loadAreasSelector() {
 
     fetch(url)
         .then(res => res.json())
-        .then(areas => {
-            const container = document.getElementById('areas_selector');
-            container.innerHTML = ''; // Clear existing content
-            for (const area of areas) {
-                createCheckbox(' '+ area, 'areas_selector');
-            }
-        });
+        .then(fillAreasSelector);
 }
 
 /**
- * Loads the start date dropdown
+ * Fills the area checkboxes
+ * @param {Array} areas - Area names from /areas
  */
-function loadStartDatesSelector() {
-    const url = getAPIBaseURL() + '/dates';
-
-    fetch(url)
-        .then(res => res.json())
-        .then(dates => {
-            let options = '<option value="">Select Start Date</option>\n';
-            // Sort dates to ensure they're in chronological order
-            dates.sort();
-            for (const date of dates) {
-                options += `<option value="${date}">${date}</option>\n`;
-            }
-            document.getElementById('start_dates_selector').innerHTML = options;
-        });
+function fillAreasSelector(areas) {
+    const container = document.getElementById('areas_selector');
+    container.innerHTML = ''; // Clear existing content
+    for (const area of areas) {
+        createCheckbox(' '+ area, 'areas_selector');
+    }
 }
 
 /**
- * Loads the end date dropdown
+ * Loads the start and end date dropdowns from a single /dates request
  */
-function loadEndDatesSelector() {
+function loadDatesSelectors() {
     const url = getAPIBaseURL() + '/dates';
 
     fetch(url)
         .then(res => res.json())
-        .then(dates => {
-            let options = '<option value="">Select End Date</option>\n';
-            // Sort dates to ensure they're in chronological order
-            dates.sort();
-            for (const date of dates) {
-                options += `<option value="${date}">${date}</option>\n`;
-            }
-            document.getElementById('end_dates_selector').innerHTML = options;
-        });
+        .then(fillDatesSelectors);
+}
+
+/**
+ * Fills the start and end date dropdowns
+ * @param {Array} dates - Months from /dates
+ */
+function fillDatesSelectors(dates) {
+    // Sort dates to ensure they're in chronological order
+    dates.sort();
+    let options = '';
+    for (const date of dates) {
+        options += `<option value="${date}">${date}</option>\n`;
+    }
+    document.getElementById('start_dates_selector').innerHTML =
+        '<option value="">Select Start Date</option>\n' + options;
+    document.getElementById('end_dates_selector').innerHTML =
+        '<option value="">Select End Date</option>\n' + options;
 }
 
 /**